@@ -4,6 +4,7 @@ import numpy as np
 import pytz
 from django.db.models import Q
 
+from api.image_similarity import remove_from_image_similarity_index
 from api.models import (
     AlbumAuto,
     AlbumDate,
@@ -227,6 +228,9 @@ def delete_missing_photos(user, job_id):
             faces.delete()
             # To-Do: Remove thumbnails
 
+        remove_from_image_similarity_index(
+            user, [missing_photo.image_hash for missing_photo in missing_photos]
+        )
         missing_photos.delete()
 
         missing_files = File.objects.filter(Q(hash__endswith=user) & Q(missing=True))
@@ -7,13 +7,17 @@ from constance import config as site_config
 from django.db.models import Q
 
 import api.util as util
-from api.image_similarity import build_image_similarity_index
+from api.image_similarity import (
+    add_to_image_similarity_index,
+    update_image_similarity_index,
+)
 from api.models.long_running_job import LongRunningJob
 from api.models.photo import Photo
-from api.semantic_search import create_clip_embeddings
+from api.models.photo_embedding import save_embeddings
+from api.semantic_search import CLIP_MODEL_VERSION, create_clip_embeddings
 
 
-def batch_calculate_clip_embedding(user):
+def batch_calculate_clip_embedding(user, image_hashes=None):
     import torch
 
     job_id = uuid.uuid4()
@@ -25,9 +29,12 @@ def batch_calculate_clip_embedding(user):
     )
     lrj.started_at = datetime.now().replace(tzinfo=pytz.utc)
 
-    count = Photo.objects.filter(
-        Q(owner=user) & Q(clip_embeddings__isnull=True)
-    ).count()
+    missing = Q(owner=user) & (
+        Q(embedding__isnull=True) | ~Q(embedding__model_version=CLIP_MODEL_VERSION)
+    )
+    if image_hashes is not None:
+        missing &= Q(image_hash__in=image_hashes)
+    count = Photo.objects.filter(missing).count()
     lrj.progress_target = count
     lrj.save()
     if not torch.cuda.is_available():
@@ -43,11 +50,7 @@ def batch_calculate_clip_embedding(user):
     done_count = 0
     while done_count < count:
         try:
-            objs = list(
-                Photo.objects.filter(Q(owner=user) & Q(clip_embeddings__isnull=True))[
-                    :BATCH_SIZE
-                ]
-            )
+            objs = list(Photo.objects.filter(missing)[:BATCH_SIZE])
             done_count += len(objs)
 
             if len(objs) == 0:
@@ -62,11 +65,17 @@ def batch_calculate_clip_embedding(user):
                 continue
 
             imgs_emb, magnitudes = create_clip_embeddings(imgs)
+            # the rows of thumbnails, which could not be read, have no magnitude
+            encoded = [i for i, magnitude in enumerate(magnitudes) if magnitude > 0]
+            valid_objs = [valid_objs[i] for i in encoded]
 
-            for obj, img_emb, magnitude in zip(valid_objs, imgs_emb, magnitudes):
-                obj.clip_embeddings = img_emb.tolist()
-                obj.clip_embeddings_magnitude = magnitude
-                obj.save()
+            save_embeddings(
+                valid_objs,
+                [imgs_emb[i] for i in encoded],
+                [magnitudes[i] for i in encoded],
+                CLIP_MODEL_VERSION,
+            )
+            add_to_image_similarity_index(user, [obj.image_hash for obj in valid_objs])
         except Exception as e:
             util.logger.error("Error calculating clip embeddings: {}".format(e))
 
@@ -74,7 +83,7 @@ def batch_calculate_clip_embedding(user):
         lrj.progress_target = count
         lrj.save()
 
-    build_image_similarity_index(user)
+    update_image_similarity_index(user)
     lrj.finished_at = datetime.now().replace(tzinfo=pytz.utc)
     lrj.finished = True
     lrj.save()
@@ -2,6 +2,7 @@ import datetime
 import os
 import stat
 import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import Optional
 from uuid import UUID
 
@@ -9,35 +10,54 @@ import pytz
 from constance import config as site_config
 from django import db
 from django.conf import settings
-from django.core.paginator import Paginator
-from django.db.models import F, Q, QuerySet
+from django.db.models import F, Q, QuerySet, Value
+from django.db.models.functions import Concat, Substr
 from django.utils import timezone
 from django_q.tasks import AsyncTask
 
 import api.util as util
 from api.batch_jobs import batch_calculate_clip_embedding
 from api.face_classify import cluster_all_faces
+from api.ingest_pool import IngestPool
+from api.job_progress import JobProgress
 from api.models import Face, File, LongRunningJob, Photo
+from api.models.cache import change_api_updated_at
 from api.models.file import (
     calculate_hash,
+    classify_media,
     extract_embedded_media,
-    has_embedded_media,
     is_metadata,
-    is_valid_media,
-    is_video,
 )
+from api.models.file_fingerprint import FileFingerprint, to_signed_inode
+from api.scan_manifest import ScanManifest
+from api.search_index import move_search_paths
+from api.sidecar_index import SidecarIndex
 
+# Listing directories is bound by filesystem latency (especially on network shares),
+# so the walker uses more threads than there are cores
+WALKER_THREADS = min(32, (os.cpu_count() or 1) * 4)
 
-def should_skip(path):
+# Number of new files a single ingest task hashes and inserts together
+INGEST_CHUNK_SIZE = 100
+
+# Number of photos a single tagging or geolocation task processes
+TASK_CHUNK_SIZE = 20
+
+
+def get_skip_patterns():
     if not site_config.SKIP_PATTERNS:
-        return False
+        return []
+    return [
+        pattern.strip()
+        for pattern in site_config.SKIP_PATTERNS.split(",")
+        if pattern.strip()
+    ]
 
-    skip_patterns = site_config.SKIP_PATTERNS
-    skip_list = skip_patterns.split(",")
-    skip_list = map(str.strip, skip_list)
 
-    res = [ele for ele in skip_list if (ele in path)]
-    return bool(res)
+def should_skip(path, skip_patterns=None):
+    if skip_patterns is None:
+        skip_patterns = get_skip_patterns()
+    return any(pattern in path for pattern in skip_patterns)
 
 
 if os.name == "Windows":
@@ -58,13 +78,18 @@ else:
         return os.path.basename(path).startswith(".")
 
 
-def create_new_image(user, path) -> Optional[Photo]:
+def create_new_image(
+    user, path, image_hash=None, media_info=None, sidecar_index=None
+) -> Optional[Photo]:
     """
     Creates a new Photo object based on user input and file path.
 
     Args:
         user: The owner of the photo.
         path: The file path of the image.
+        image_hash: The hash of the file, if it was already calculated by the caller.
+        media_info: The result of `classify_media`, if the caller already classified the file.
+        sidecar_index: A SidecarIndex of the directory listing, which contains the path.
 
     Returns:
         Optional[Photo]: The created Photo object if successful, otherwise returns None.
@@ -79,24 +104,23 @@ def create_new_image(user, path) -> Optional[Photo]:
     Example:
         photo_instance = create_new_image(current_user, "/path/to/image.jpg")
     """
-    if not is_valid_media(path):
+    media_info = media_info or classify_media(path)
+    if not media_info.is_valid:
         return
-    hash = calculate_hash(user, path)
+    hash = image_hash or calculate_hash(user, path)
     if File.embedded_media.through.objects.filter(Q(to_file_id=hash)).exists():
         util.logger.warning("embedded content file found {}".format(path))
         return
 
     if is_metadata(path):
-        photo_name = os.path.splitext(os.path.basename(path))[0]
-        photo_dir = os.path.dirname(path)
+        if sidecar_index is None or path not in sidecar_index.paths:
+            sidecar_index = SidecarIndex.from_directory(os.path.dirname(path))
         photo = Photo.objects.filter(
-            Q(files__path__contains=photo_dir)
-            & Q(files__path__contains=photo_name)
-            & ~Q(files__path__contains=os.path.basename(path))
+            owner=user, files__path__in=sidecar_index.get_media_files(path)
         ).first()
 
         if photo:
-            file = File.create(path, user)
+            file = File.create(path, user, hash, media_info)
             photo.files.add(file)
             photo.save()
         else:
@@ -110,11 +134,11 @@ def create_new_image(user, path) -> Optional[Photo]:
         photo.owner = user
         photo.added_on = datetime.datetime.now().replace(tzinfo=pytz.utc)
         photo.geolocation_json = {}
-        photo.video = is_video(path)
+        photo.video = media_info.kind == File.VIDEO
         photo.save()
-        file = File.create(path, user)
-        if has_embedded_media(file):
-            em_path = extract_embedded_media(file)
+        file = File.create(path, user, hash, media_info)
+        if file.has_motion_video:
+            em_path = extract_embedded_media(file, media_info.motion_video_offset)
             if em_path:
                 em_file = File.create(em_path, user)
                 file.embedded_media.add(em_file)
@@ -123,7 +147,7 @@ def create_new_image(user, path) -> Optional[Photo]:
         photo.save()
         return photo
     else:
-        file = File.create(path, user)
+        file = File.create(path, user, hash, media_info)
         photo = photos.first()
         photo.files.add(file)
         if photo.removed:
@@ -135,7 +159,7 @@ def create_new_image(user, path) -> Optional[Photo]:
         return None
 
 
-def handle_new_image(user, path, job_id, photo=None):
+def handle_new_image(user, path, job_id, photo=None, progress=None, sidecar_index=None):
     """
     Handles the creation and all the processing of the photo needed for it to be displayed.
 
@@ -144,64 +168,74 @@ def handle_new_image(user, path, job_id, photo=None):
         path: The file path of the image.
         job_id: The long-running job id, which gets updated when the task runs
         photo: An optional parameter, where you can input a photo instead of creating a new one. Used for uploading.
+        progress: An optional JobProgress of the calling task, which buffers the progress updates.
+        sidecar_index: An optional SidecarIndex from the directory walk, so the sidecar files do not have to be looked up.
 
     Note:
         This function is used, when uploading a picture, because rescanning does not perform machine learning tasks
     """
-    update_scan_counter(job_id)
+    if progress is not None:
+        progress.increment()
+    else:
+        update_scan_counter(job_id)
     try:
         start = datetime.datetime.now()
         if photo is None:
-            photo = create_new_image(user, path)
+            photo = create_new_image(user, path, sidecar_index=sidecar_index)
             elapsed = (datetime.datetime.now() - start).total_seconds()
             util.logger.info(
                 "job {}: save image: {}, elapsed: {}".format(job_id, path, elapsed)
             )
         if photo:
             util.logger.info("job {}: handling image {}".format(job_id, path))
-            photo._generate_thumbnail(True)
-            elapsed = (datetime.datetime.now() - start).total_seconds()
-            util.logger.info(
-                "job {}: generate thumbnails: {}, elapsed: {}".format(
-                    job_id, path, elapsed
+            # every stage updates the photo, collect the changes into one UPDATE
+            sidecars = sidecar_index.sidecars_by_file([path]) if sidecar_index else {}
+            with photo.deferred_commit(), util.use_sidecars(sidecars):
+                thumbnails = photo._generate_thumbnail(True)
+                elapsed = (datetime.datetime.now() - start).total_seconds()
+                util.logger.info(
+                    "job {}: generate thumbnails: {}, elapsed: {}".format(
+                        job_id, path, elapsed
+                    )
                 )
-            )
-            photo._calculate_aspect_ratio(False)
-            elapsed = (datetime.datetime.now() - start).total_seconds()
-            util.logger.info(
-                "job {}: calculate aspect ratio: {}, elapsed: {}".format(
-                    job_id, path, elapsed
+                photo._calculate_aspect_ratio(False, thumbnails.get("thumbnails_big"))
+                elapsed = (datetime.datetime.now() - start).total_seconds()
+                util.logger.info(
+                    "job {}: calculate aspect ratio: {}, elapsed: {}".format(
+                        job_id, path, elapsed
+                    )
                 )
-            )
-            photo._extract_exif_data(True)
-            elapsed = (datetime.datetime.now() - start).total_seconds()
-            util.logger.info(
-                "job {}: extract exif data: {}, elapsed: {}".format(
-                    job_id, path, elapsed
+                photo._get_dominant_color(
+                    False, thumbnails.get("square_thumbnails_small")
                 )
-            )
-
-            photo._extract_date_time_from_exif(True)
-            elapsed = (datetime.datetime.now() - start).total_seconds()
-            util.logger.info(
-                "job {}: extract date time: {}, elapsed: {}".format(
-                    job_id, path, elapsed
+                elapsed = (datetime.datetime.now() - start).total_seconds()
+                util.logger.info(
+                    "job {}: get dominant color: {}, elapsed: {}".format(
+                        job_id, path, elapsed
+                    )
                 )
-            )
-            photo._get_dominant_color()
-            elapsed = (datetime.datetime.now() - start).total_seconds()
-            util.logger.info(
-                "job {}: get dominant color: {}, elapsed: {}".format(
-                    job_id, path, elapsed
+                photo._extract_exif_data(True)
+                elapsed = (datetime.datetime.now() - start).total_seconds()
+                util.logger.info(
+                    "job {}: extract exif data: {}, elapsed: {}".format(
+                        job_id, path, elapsed
+                    )
                 )
-            )
-            photo._recreate_search_captions()
-            elapsed = (datetime.datetime.now() - start).total_seconds()
-            util.logger.info(
-                "job {}: search caption recreated: {}, elapsed: {}".format(
-                    job_id, path, elapsed
+
+                photo._extract_date_time_from_exif(True)
+                elapsed = (datetime.datetime.now() - start).total_seconds()
+                util.logger.info(
+                    "job {}: extract date time: {}, elapsed: {}".format(
+                        job_id, path, elapsed
+                    )
+                )
+                photo._recreate_search_captions()
+                elapsed = (datetime.datetime.now() - start).total_seconds()
+                util.logger.info(
+                    "job {}: search caption recreated: {}, elapsed: {}".format(
+                        job_id, path, elapsed
+                    )
                 )
-            )
 
     except Exception as e:
         try:
@@ -216,60 +250,454 @@ def handle_new_image(user, path, job_id, photo=None):
             )
 
 
-def walk_directory(directory, callback):
-    for file in os.scandir(directory):
-        fpath = os.path.join(directory, file)
-        if not is_hidden(fpath) and not should_skip(fpath):
-            if os.path.isdir(fpath):
-                walk_directory(fpath, callback)
-            else:
-                callback.append(fpath)
+def _create_new_images_batch(user, hashed_paths, media_infos, sidecar_index):
+    hashes = [hash for _, hash in hashed_paths]
+    embedded_hashes = set(
+        File.embedded_media.through.objects.filter(to_file_id__in=hashes).values_list(
+            "to_file_id", flat=True
+        )
+    )
+    existing_hashes = set(
+        Photo.objects.filter(image_hash__in=hashes).values_list("image_hash", flat=True)
+    )
+
+    files = []
+    photos = []
+    # metadata files and duplicates need the photos of this batch to exist already
+    deferred_paths = []
+    added_on = datetime.datetime.now().replace(tzinfo=pytz.utc)
+    for path, hash in hashed_paths:
+        if hash in embedded_hashes:
+            util.logger.warning("embedded content file found {}".format(path))
+            continue
+        if is_metadata(path) or hash in existing_hashes:
+            deferred_paths.append((path, hash))
+            continue
+        existing_hashes.add(hash)
+        file = File(hash=hash, path=path)
+        file._find_out_type(media_infos.get(path))
+        file._read_stat()
+        files.append(file)
+        photos.append(
+            Photo(
+                image_hash=hash,
+                owner=user,
+                added_on=added_on,
+                geolocation_json={},
+                video=file.type == File.VIDEO,
+                main_file_id=hash,
+            )
+        )
+
+    File.objects.bulk_create(
+        files,
+        update_conflicts=True,
+        unique_fields=["hash"],
+        update_fields=[
+            "path",
+            "type",
+            "mime_type",
+            "width",
+            "height",
+            "has_motion_video",
+            "size",
+            "mtime",
+            "inode",
+        ],
+    )
+    Photo.objects.bulk_create(photos, ignore_conflicts=True)
+    Photo.files.through.objects.bulk_create(
+        [
+            Photo.files.through(photo_id=photo.image_hash, file_id=photo.image_hash)
+            for photo in photos
+        ],
+        ignore_conflicts=True,
+    )
+
+    for file in files:
+        if file.has_motion_video:
+            media_info = media_infos.get(file.path)
+            em_path = extract_embedded_media(
+                file, media_info.motion_video_offset if media_info else None
+            )
+            if em_path:
+                em_file = File.create(em_path, user)
+                file.embedded_media.add(em_file)
+
+    for path, hash in deferred_paths:
+        create_new_image(user, path, hash, media_infos.get(path), sidecar_index)
 
+    return list(
+        Photo.objects.filter(
+            image_hash__in=[photo.image_hash for photo in photos], owner=user
+        ).select_related("main_file", "owner")
+    )
+
+
+def create_new_images(
+    user, hashed_paths, media_infos=None, batch_size=1000, sidecar_index=None
+) -> list[Photo]:
+    """
+    Creates the Photo objects of many already hashed files at once.
+
+    Args:
+        user: The owner of the photos.
+        hashed_paths: A list of (path, image_hash) tuples.
+        media_infos: An optional dict of path to the result of `classify_media`.
+        batch_size: The number of files, which are inserted with one query per table.
+        sidecar_index: An optional SidecarIndex, which contains the paths.
+
+    Returns:
+        list[Photo]: The newly created Photo objects.
+
+    Note:
+        Works like `create_new_image`, but inserts the File, Photo and through-table rows
+        of a batch with bulk_create. Metadata files and files whose hash already belongs
+        to a photo are handed to `create_new_image` once the batch is inserted.
+    """
+    new_photos = []
+    for start in range(0, len(hashed_paths), batch_size):
+        new_photos.extend(
+            _create_new_images_batch(
+                user,
+                hashed_paths[start : start + batch_size],
+                media_infos or {},
+                sidecar_index,
+            )
+        )
+    return new_photos
+
+
+def ingest_new_files(user, paths, job_id, sidecar_index=None):
+    """
+    Hashes new media files, creates their photos in bulk and runs all the processing
+    of `handle_new_image` on them.
+
+    Args:
+        user: The owner of the photos.
+        paths: The file paths, which are not part of any photo yet.
+        job_id: The long-running job id, which gets updated for every path
+        sidecar_index: An optional SidecarIndex of the paths from the directory walk.
+
+    Returns:
+        list[str]: The paths, which could not be ingested and have to be retried.
+    """
+    failed_paths = []
+    hashed_paths = []
+    media_infos = {}
+    for path in paths:
+        try:
+            media_info = classify_media(path)
+            if media_info.is_valid:
+                hashed_paths.append((path, calculate_hash(user, path)))
+                media_infos[path] = media_info
+        except Exception:
+            util.logger.exception("job {}: could not hash {}".format(job_id, path))
+            failed_paths.append(path)
+
+    try:
+        photos = create_new_images(
+            user, hashed_paths, media_infos, sidecar_index=sidecar_index
+        )
+    except Exception:
+        util.logger.exception(
+            "job {}: could not create photos of {} files".format(job_id, len(paths))
+        )
+        failed_paths.extend(path for path, _ in hashed_paths)
+        photos = []
+
+    with JobProgress(job_id) as progress:
+        # the other paths were skipped or attached to existing photos
+        progress.increment(count=len(paths) - len(photos))
+        for photo in photos:
+            handle_new_image(
+                user, photo.main_file.path, job_id, photo, progress, sidecar_index
+            )
+    return failed_paths
 
-def walk_files(scan_files, callback):
-    for fpath in scan_files:
-        if os.path.isfile(fpath):
-            callback.append(fpath)
 
+def handle_changed_files(user, paths, job_id, sidecar_index=None):
+    """
+    Runs all the processing of `handle_new_image` on files, which already belong to a
+    photo and changed since the last scan.
 
-def _file_was_modified_after(filepath, time):
+    """
+    with JobProgress(job_id) as progress:
+        for path in paths:
+            handle_new_image(
+                user, path, job_id, progress=progress, sidecar_index=sidecar_index
+            )
+
+
+def _scan_directory_entries(directory, skip_patterns):
+    subdirectories = []
+    files = []
     try:
-        modified = os.path.getmtime(filepath)
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if is_hidden(entry.path) or should_skip(entry.path, skip_patterns):
+                    continue
+                try:
+                    if entry.is_dir():
+                        subdirectories.append(entry.path)
+                    else:
+                        # DirEntry caches its stat result, so size, mtime and inode cost one syscall
+                        entry_stat = entry.stat()
+                        files.append(
+                            (
+                                entry.path,
+                                (
+                                    entry_stat.st_size,
+                                    entry_stat.st_mtime_ns,
+                                    entry_stat.st_ino,
+                                ),
+                            )
+                        )
+                except OSError:
+                    util.logger.warning("could not stat {}".format(entry.path))
     except OSError:
-        return False
-    return datetime.datetime.fromtimestamp(modified).replace(tzinfo=pytz.utc) > time
+        util.logger.warning("could not list directory {}".format(directory))
+    return subdirectories, files
+
+
+def walk_directory_with_stats(directory, max_workers=WALKER_THREADS):
+    """
+    Walks *directory* recursively, listing every directory on a pool of threads.
+
+    Returns a dict of file path to (size, mtime in ns, inode).
+
+    """
+    skip_patterns = get_skip_patterns()
+    found_files = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(_scan_directory_entries, directory, skip_patterns)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirectories, files = future.result()
+                found_files.update(files)
+                for subdirectory in subdirectories:
+                    pending.add(
+                        executor.submit(
+                            _scan_directory_entries, subdirectory, skip_patterns
+                        )
+                    )
+    return found_files
+
+
+def walk_directory(directory, callback):
+    callback.extend(sorted(walk_directory_with_stats(directory).keys()))
+
+
+def _stat_files(paths):
+    found_files = {}
+    for path in paths:
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            continue
+        if stat.S_ISREG(file_stat.st_mode):
+            found_files[path] = (
+                file_stat.st_size,
+                file_stat.st_mtime_ns,
+                file_stat.st_ino,
+            )
+    return found_files
 
 
 def update_scan_counter(job_id, failed=False):
-    # Increment the current progress
-    LongRunningJob.objects.filter(job_id=job_id).update(
-        progress_current=F("progress_current") + 1
+    # Tasks which process a single item report their progress right away
+    with JobProgress(job_id) as progress:
+        progress.increment(failed)
+
+
+def _chunks(queryset, size):
+    chunk = []
+    for item in queryset.iterator():
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def load_file_registry(user, root="", paths=None, batch_size=1000):
+    """
+    Returns the (size, mtime, inode) of every file of the user's photos below *root*,
+    or only of those at *paths*, read with one query per batch of paths. Files
+    registered before these were stored map to None.
+
+    """
+    files = Photo.files.through.objects.filter(photo__owner=user)
+    if root:
+        files = files.filter(file__path__startswith=root.rstrip(os.sep) + os.sep)
+    if paths is None:
+        batches = [files]
+    else:
+        paths = list(paths)
+        batches = [
+            files.filter(file__path__in=paths[start : start + batch_size])
+            for start in range(0, len(paths), batch_size)
+        ]
+    registry = {}
+    for batch in batches:
+        # stale files at the same path lose against the most recently modified one
+        for path, size, mtime, inode in (
+            batch.order_by(F("file__mtime").desc(nulls_last=True), "file__hash")
+            .values_list("file__path", "file__size", "file__mtime", "file__inode")
+            .iterator()
+        ):
+            if path not in registry:
+                registry[path] = None if size is None else (size, mtime, inode)
+    return registry
+
+
+def diff_with_registry(
+    found_files, registry, manifest=None, root="", sidecar_index=None
+):
+    """
+    Splits the walked *found_files*, a dict of path to (size, mtime, inode), into sets
+    of new, changed and unchanged paths, without querying the database per file.
+
+    Paths, which are not part of a photo, are only new when the manifest did not see
+    them unchanged before, so files which are no media are not tried on every scan.
+    Files registered without size and mtime are compared against the manifest as well.
+    Media files are changed, when one of their sidecar files is new or changed.
+
+    """
+    manifest_modified = None
+    if manifest is not None:
+        added, changed, _ = manifest.diff(found_files, root)
+        manifest_modified = added | changed
+
+    new_paths = set()
+    changed_paths = set()
+    unchanged_paths = set()
+    for path, (size, mtime, inode) in found_files.items():
+        modified = manifest_modified is None or path in manifest_modified
+        if path not in registry:
+            (new_paths if modified else unchanged_paths).add(path)
+        elif registry[path] is None:
+            (changed_paths if modified else unchanged_paths).add(path)
+        elif registry[path] != (size, mtime, to_signed_inode(inode)):
+            changed_paths.add(path)
+        else:
+            unchanged_paths.add(path)
+
+    if sidecar_index is None:
+        sidecar_index = SidecarIndex(found_files.keys())
+    for sidecar in [path for path in new_paths | changed_paths if is_metadata(path)]:
+        for path in sidecar_index.get_media_files(sidecar):
+            if path in unchanged_paths and path in registry:
+                unchanged_paths.remove(path)
+                changed_paths.add(path)
+    return new_paths, changed_paths, unchanged_paths
+
+
+def update_file_registry(found_files, registry, job_id, batch_size=1000):
+    """
+    Stores the job as last scan, which saw the registered files, and fills in size,
+    mtime and inode of files, which were registered before these were stored.
+
+    """
+    seen_paths = [path for path in found_files.keys() if path in registry]
+    for start in range(0, len(seen_paths), batch_size):
+        File.objects.filter(path__in=seen_paths[start : start + batch_size]).update(
+            last_seen_scan=job_id
+        )
+
+    legacy_paths = [path for path in seen_paths if registry[path] is None]
+    legacy_files = []
+    for start in range(0, len(legacy_paths), batch_size):
+        for file in File.objects.filter(
+            path__in=legacy_paths[start : start + batch_size]
+        ).only("hash", "path"):
+            size, mtime, inode = found_files[file.path]
+            file.size = size
+            file.mtime = mtime
+            file.inode = to_signed_inode(inode)
+            legacy_files.append(file)
+    File.objects.bulk_update(
+        legacy_files, ["size", "mtime", "inode"], batch_size=batch_size
     )
 
-    # Mark the job as finished if the current progress equals the target
-    LongRunningJob.objects.filter(
-        job_id=job_id, progress_current=F("progress_target")
-    ).update(finished=True, finished_at=timezone.now())
-
-    # Mark the job as failed if the failed flag is set
-    if failed:
-        LongRunningJob.objects.filter(job_id=job_id).update(failed=True)
-
-
-def photo_scanner(user, last_scan, full_scan, path, job_id):
-    files_to_check = [path]
-    files_to_check.extend(util.get_sidecar_files_in_priority_order(path))
-    if (
-        not Photo.objects.filter(files__path=path).exists()
-        or full_scan
-        or not last_scan
-        or any(
-            [_file_was_modified_after(p, last_scan.finished_at) for p in files_to_check]
+
+def _move_paths(model, source, destination):
+    source_prefix = source.rstrip(os.sep) + os.sep
+    destination_prefix = destination.rstrip(os.sep) + os.sep
+    moved = model.objects.filter(path=source).update(path=destination)
+    moved += model.objects.filter(path__startswith=source_prefix).update(
+        path=Concat(Value(destination_prefix), Substr("path", len(source_prefix) + 1))
+    )
+    return moved
+
+
+def move_file_paths(source, destination):
+    """
+    Points the files at *source*, a file or a directory, to *destination*. Moved files
+    keep size, mtime and inode, so the next scan sees them as unchanged and does not
+    hash them again.
+
+    Returns:
+        int: The number of moved files.
+    """
+    # fingerprints are unique per path, a moved file replaces the one at its destination
+    FileFingerprint.objects.filter(
+        Q(path=destination) | Q(path__startswith=destination.rstrip(os.sep) + os.sep)
+    ).delete()
+    _move_paths(FileFingerprint, source, destination)
+    moved = _move_paths(File, source, destination)
+    move_search_paths(source, destination)
+    return moved
+
+
+def reconcile_missing_files(user, found_paths=None, paths=None):
+    """
+    Marks the files of the user's photos, which do not exist anymore, as missing and
+    removes them from their photos.
+
+    Args:
+        user: The owner of the photos.
+        found_paths: The paths found by a directory walk, which are not checked on the
+            filesystem again.
+        paths: Only check the files at these paths instead of all files of the user.
+
+    Returns:
+        int: The number of files, which went missing.
+    """
+    found_paths = set(found_paths) if found_paths is not None else set()
+    links = Photo.files.through.objects.filter(photo__owner=user)
+    if paths is not None:
+        links = links.filter(file__path__in=paths)
+    links = links.values_list("id", "photo_id", "file_id", "file__path")
+    missing_links = []
+    missing_files = set()
+    changed_photos = set()
+    for link_id, photo_id, file_id, path in links.iterator():
+        if path in found_paths:
+            continue
+        # hidden and skipped files are not part of the walk, but they still exist
+        if path and os.path.exists(path):
+            continue
+        missing_links.append(link_id)
+        missing_files.add(file_id)
+        changed_photos.add(photo_id)
+
+    if missing_links:
+        File.objects.filter(hash__in=missing_files).update(missing=True)
+        Photo.files.through.objects.filter(id__in=missing_links).delete()
+        Photo.objects.filter(image_hash__in=changed_photos).update(
+            last_modified=timezone.now()
         )
-    ):
-        AsyncTask(handle_new_image, user, path, job_id).run()
-    else:
-        update_scan_counter(job_id)
+        # bulk updates send no post_save, which invalidates the cached API responses
+        change_api_updated_at()
+        util.logger.info(
+            "{} files of {} photos are missing".format(
+                len(missing_files), len(changed_photos)
+            )
+        )
+    return len(missing_files)
 
 
 def scan_photos(user, full_scan, job_id, scan_directory="", scan_files=[]):
@@ -294,45 +722,107 @@ def scan_photos(user, full_scan, job_id, scan_directory="", scan_files=[]):
     try:
         if scan_directory == "":
             scan_directory = user.scan_directory
-        photo_list = []
+        manifest = None
         if scan_files:
-            walk_files(scan_files, photo_list)
+            # only the touched paths are known, their media files and sidecars are
+            # found in the listings of their directories
+            sidecar_index = SidecarIndex.from_directories(
+                {os.path.dirname(path) for path in scan_files}
+            )
+            found_files = _stat_files(sidecar_index.subset(scan_files).paths)
+            registry = load_file_registry(user, paths=found_files.keys())
         else:
-            walk_directory(scan_directory, photo_list)
-        files_found = len(photo_list)
-        last_scan = (
-            LongRunningJob.objects.filter(finished=True)
-            .filter(job_type=1)
-            .filter(started_by=user)
-            .order_by("-finished_at")
-            .first()
+            found_files = walk_directory_with_stats(scan_directory)
+            manifest = ScanManifest.load(user)
+            registry = load_file_registry(user, scan_directory)
+            sidecar_index = SidecarIndex(found_files.keys())
+        new_paths, changed_paths, unchanged_paths = diff_with_registry(
+            found_files, registry, manifest, scan_directory, sidecar_index
         )
-        all = []
-        for path in photo_list:
-            all.append((user, last_scan, full_scan, path, job_id))
+        util.logger.info(
+            "Found {} files: {} new, {} changed, {} unchanged".format(
+                len(found_files),
+                len(new_paths),
+                len(changed_paths),
+                len(unchanged_paths),
+            )
+        )
+        if full_scan:
+            for path in unchanged_paths:
+                (changed_paths if path in registry else new_paths).add(path)
+        new_paths = sorted(new_paths)
+        changed_paths = sorted(changed_paths)
+        files_found = len(new_paths) + len(changed_paths)
 
         lrj.progress_current = 0
         lrj.progress_target = files_found
+        if files_found == 0:
+            lrj.finished = True
+            lrj.finished_at = timezone.now()
         lrj.save()
         db.connections.close_all()
 
-        for photo in all:
-            photo_scanner(*photo)
+        ingests = []
+        with IngestPool() as pool:
+            for start in range(0, len(changed_paths), INGEST_CHUNK_SIZE):
+                chunk = changed_paths[start : start + INGEST_CHUNK_SIZE]
+                pool.submit(
+                    handle_changed_files,
+                    user,
+                    chunk,
+                    job_id,
+                    sidecar_index.subset(chunk),
+                )
+            for start in range(0, len(new_paths), INGEST_CHUNK_SIZE):
+                chunk = new_paths[start : start + INGEST_CHUNK_SIZE]
+                future = pool.submit(
+                    ingest_new_files, user, chunk, job_id, sidecar_index.subset(chunk)
+                )
+                ingests.append((chunk, future))
+
+            # runs while the workers ingest the last chunks
+            update_file_registry(found_files, registry, job_id)
+        if pool.failed:
+            LongRunningJob.objects.filter(job_id=job_id).update(failed=True)
+        if manifest is not None:
+            # files, which failed to ingest, are left out, so the next scan retries them
+            failed_paths = set()
+            for chunk, future in ingests:
+                if future.exception() is None:
+                    failed_paths.update(future.result())
+                else:
+                    failed_paths.update(chunk)
+            manifest.update(
+                {
+                    path: file_stat
+                    for path, file_stat in found_files.items()
+                    if path not in failed_paths
+                },
+                scan_directory,
+            )
+            manifest.save()
 
         util.logger.info("Scanned {} files in : {}".format(files_found, scan_directory))
 
         util.logger.info("Finished updating album things")
-        exisisting_photos = Photo.objects.filter(owner=user.id).order_by("image_hash")
-        paginator = Paginator(exisisting_photos, 5000)
-        for page in range(1, paginator.num_pages + 1):
-            for existing_photo in paginator.page(page).object_list:
-                existing_photo._check_files()
+        reconcile_missing_files(
+            user, found_files.keys(), paths=scan_files if scan_files else None
+        )
         util.logger.info("Finished checking paths")
 
-        AsyncTask(generate_tags, user, uuid.uuid4()).run()
-        AsyncTask(add_geolocation, user, uuid.uuid4()).run()
-        AsyncTask(batch_calculate_clip_embedding, user).run()
-        AsyncTask(scan_faces, user, uuid.uuid4(), full_scan).run()
+        image_hashes = None
+        if scan_files:
+            # scans of single files, e.g. by the file watcher, only process their photos
+            image_hashes = list(
+                Photo.objects.filter(owner=user, files__path__in=found_files.keys())
+                .values_list("image_hash", flat=True)
+                .distinct()
+            )
+        if image_hashes is None or image_hashes:
+            AsyncTask(generate_tags, user, uuid.uuid4(), image_hashes).run()
+            AsyncTask(add_geolocation, user, uuid.uuid4(), image_hashes).run()
+            AsyncTask(batch_calculate_clip_embedding, user, image_hashes).run()
+            AsyncTask(scan_faces, user, uuid.uuid4(), full_scan, image_hashes).run()
 
     except Exception:
         util.logger.exception("An error occurred: ")
@@ -364,15 +854,16 @@ def generate_face_embeddings(user, job_id: UUID):
         lrj.save()
         db.connections.close_all()
 
-        for face in faces:
-            failed = False
-            try:
-                face.generate_encoding()
-            except Exception as err:
-                util.logger.exception("An error occurred: ")
-                print("[ERR]: {}".format(err))
-                failed = True
-            update_scan_counter(job_id, failed)
+        with JobProgress(job_id) as progress:
+            for face in faces:
+                failed = False
+                try:
+                    face.generate_encoding()
+                except Exception as err:
+                    util.logger.exception("An error occurred: ")
+                    print("[ERR]: {}".format(err))
+                    failed = True
+                progress.increment(failed)
 
         lrj.finished = True
         lrj.save()
@@ -383,12 +874,14 @@ def generate_face_embeddings(user, job_id: UUID):
         lrj.failed = True
 
 
-def generate_tags(user, job_id: UUID):
+def generate_tags(user, job_id: UUID, image_hashes=None):
     existing_photos = Photo.objects.filter(
         Q(owner=user.id)
         & Q(captions_json__isnull=True)
         & Q(captions_json__places365__isnull=True)
     )
+    if image_hashes is not None:
+        existing_photos = existing_photos.filter(image_hash__in=image_hashes)
     if existing_photos.count() == 0:
         return
     if LongRunningJob.objects.filter(job_id=job_id).exists():
@@ -409,8 +902,8 @@ def generate_tags(user, job_id: UUID):
         lrj.save()
         db.connections.close_all()
 
-        for photo in existing_photos:
-            AsyncTask(generate_tag_job, photo, job_id).run()
+        for photos in _chunks(existing_photos, TASK_CHUNK_SIZE):
+            AsyncTask(generate_tag_job, photos, job_id).run()
 
     except Exception as err:
         util.logger.exception("An error occurred: ")
@@ -418,20 +911,22 @@ def generate_tags(user, job_id: UUID):
         lrj.failed = True
 
 
-def generate_tag_job(photo: Photo, job_id: str):
-    failed = False
-    try:
-        photo.refresh_from_db()
-        photo._generate_captions(True)
-    except Exception as err:
-        util.logger.exception("An error occurred: %s", photo.image_hash)
+def generate_tag_job(photos: list[Photo], job_id: str):
+    with JobProgress(job_id) as progress:
+        for photo in photos:
+            failed = False
+            try:
+                photo.refresh_from_db()
+                photo._generate_captions(True)
+            except Exception as err:
+                util.logger.exception("An error occurred: %s", photo.image_hash)
 
-        print("[ERR]: {}".format(err))
-        failed = True
-    update_scan_counter(job_id, failed)
+                print("[ERR]: {}".format(err))
+                failed = True
+            progress.increment(failed)
 
 
-def add_geolocation(user, job_id: UUID):
+def add_geolocation(user, job_id: UUID, image_hashes=None):
     if LongRunningJob.objects.filter(job_id=job_id).exists():
         lrj = LongRunningJob.objects.get(job_id=job_id)
         lrj.started_at = datetime.datetime.now().replace(tzinfo=pytz.utc)
@@ -447,12 +942,14 @@ def add_geolocation(user, job_id: UUID):
 
     try:
         existing_photos = Photo.objects.filter(owner=user.id)
+        if image_hashes is not None:
+            existing_photos = existing_photos.filter(image_hash__in=image_hashes)
         lrj.progress_target = existing_photos.count()
         lrj.save()
         db.connections.close_all()
 
-        for photo in existing_photos:
-            AsyncTask(geolocation_job, photo, job_id).run()
+        for photos in _chunks(existing_photos, TASK_CHUNK_SIZE):
+            AsyncTask(geolocation_job, photos, job_id).run()
 
     except Exception as err:
         util.logger.exception("An error occurred: ")
@@ -460,19 +957,21 @@ def add_geolocation(user, job_id: UUID):
         lrj.failed = True
 
 
-def geolocation_job(photo: Photo, job_id: UUID):
-    failed = False
-    try:
-        photo.refresh_from_db()
-        photo._geolocate()
-        photo._add_location_to_album_dates()
-    except Exception:
-        util.logger.exception("An error occurred: ")
-        failed = True
-    update_scan_counter(job_id, failed)
+def geolocation_job(photos: list[Photo], job_id: UUID):
+    with JobProgress(job_id) as progress:
+        for photo in photos:
+            failed = False
+            try:
+                photo.refresh_from_db()
+                photo._geolocate()
+                photo._add_location_to_album_dates()
+            except Exception:
+                util.logger.exception("An error occurred: ")
+                failed = True
+            progress.increment(failed)
 
 
-def scan_faces(user, job_id: UUID, full_scan=False):
+def scan_faces(user, job_id: UUID, full_scan=False, image_hashes=None):
     if LongRunningJob.objects.filter(job_id=job_id).exists():
         lrj = LongRunningJob.objects.get(job_id=job_id)
         lrj.started_at = datetime.datetime.now().replace(tzinfo=pytz.utc)
@@ -494,30 +993,35 @@ def scan_faces(user, job_id: UUID, full_scan=False):
         .first()
     )
 
+    extracted = 0
     try:
         existing_photos = Photo.objects.filter(
             Q(owner=user.id) & Q(thumbnail_big__isnull=False)
         )
+        if image_hashes is not None:
+            existing_photos = existing_photos.filter(image_hash__in=image_hashes)
 
         lrj.progress_target = existing_photos.count()
         lrj.save()
         db.connections.close_all()
 
-        for photo in existing_photos:
-            failed = False
-            if full_scan or not last_scan or last_scan.started_at < photo.added_on:
-                try:
-                    photo._extract_faces()
-                except Exception:
-                    util.logger.exception("An error occurred: ")
-                    failed = True
-                update_scan_counter(job_id, failed)
-            else:
-                update_scan_counter(job_id)
+        with JobProgress(job_id) as progress:
+            for photo in existing_photos:
+                failed = False
+                if full_scan or not last_scan or last_scan.started_at < photo.added_on:
+                    try:
+                        photo._extract_faces()
+                        extracted += 1
+                    except Exception:
+                        util.logger.exception("An error occurred: ")
+                        failed = True
+                progress.increment(failed)
     except Exception as err:
         util.logger.exception("An error occurred: ")
         print("[ERR]: {}".format(err))
         lrj.failed = True
 
     generate_face_embeddings(user, uuid.uuid4())
-    cluster_all_faces(user, uuid.uuid4())
+    # clustering regroups all faces of the user, which is only needed for new faces
+    if image_hashes is None or extracted:
+        cluster_all_faces(user, uuid.uuid4())
@@ -3,7 +3,8 @@ import PIL
 
 from api.exif_tags import Tags
 from api.face_recognition import get_face_locations
-from api.util import get_metadata, is_number, logger
+from api.metadata_snapshot import get_metadata
+from api.util import is_number, logger
 
 
 class RuleTypes:
@@ -0,0 +1,318 @@
+import os
+import time
+import uuid
+
+from django_q.tasks import AsyncTask
+
+import api.util as util
+from api.directory_watcher import (
+    get_skip_patterns,
+    is_hidden,
+    move_file_paths,
+    scan_photos,
+    should_skip,
+    walk_directory_with_stats,
+)
+from api.models import File, User
+from api.models.user import get_deleted_user
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+    flags = None
+
+# Changes are handed to a scan, when no event arrived for DEBOUNCE_SECONDS,
+# but at the latest MAX_DELAY_SECONDS after the first one
+DEBOUNCE_SECONDS = 2
+MAX_DELAY_SECONDS = 30
+
+# A file moved out of the watched directories only produces a "moved from" event
+MOVE_PAIRING_SECONDS = 1
+
+
+def _is_below(path, directory):
+    return path.startswith(directory.rstrip(os.sep) + os.sep)
+
+
+class PendingChanges:
+    """
+    Coalesces filesystem events, so that a file, which is written, renamed and written
+    again, is scanned only once.
+
+    """
+
+    def __init__(self, debounce=DEBOUNCE_SECONDS, max_delay=MAX_DELAY_SECONDS):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.paths = set()
+        self.moves = {}
+        self.first_event = None
+        self.last_event = None
+
+    def _touch(self, now):
+        now = time.monotonic() if now is None else now
+        if self.first_event is None:
+            self.first_event = now
+        self.last_event = now
+
+    def add(self, path, now=None):
+        """Adds a created, modified or deleted path."""
+        self.paths.add(path)
+        self._touch(now)
+
+    def move(self, source, destination, now=None):
+        for moved_from, moved_to in self.moves.items():
+            # a file moved twice only needs its last move
+            if moved_to == source:
+                self.moves[moved_from] = destination
+                break
+        else:
+            self.moves[source] = destination
+        if source in self.paths:
+            self.paths.remove(source)
+            self.paths.add(destination)
+        self._touch(now)
+
+    def is_due(self, now=None):
+        if self.first_event is None:
+            return False
+        now = time.monotonic() if now is None else now
+        return (
+            now - self.last_event >= self.debounce
+            or now - self.first_event >= self.max_delay
+        )
+
+    def pop(self):
+        paths, moves = self.paths, self.moves
+        self.paths = set()
+        self.moves = {}
+        self.first_event = None
+        self.last_event = None
+        return paths, moves
+
+
+def _get_scanned_users():
+    deleted_user = get_deleted_user()
+    for user in User.objects.exclude(scan_directory="").exclude(
+        scan_directory__isnull=True
+    ):
+        if user != deleted_user:
+            yield user
+
+
+def dispatch_changes(paths, moves):
+    """
+    Applies the moves to the stored files and hands all changed paths to a
+    `scan_photos` of the user, whose scan directory contains them.
+
+    """
+    paths = set(paths)
+    for source, destination in moves.items():
+        moved = move_file_paths(source, destination)
+        util.logger.info(
+            "watcher: moved {} files from {} to {}".format(moved, source, destination)
+        )
+        # moved files are unchanged for the scan, everything else at the destination is new
+        if os.path.isdir(destination):
+            paths.update(walk_directory_with_stats(destination).keys())
+        else:
+            paths.add(destination)
+
+    for user in _get_scanned_users():
+        user_paths = sorted(
+            path for path in paths if _is_below(path, user.scan_directory)
+        )
+        if user_paths:
+            util.logger.info(
+                "watcher: scanning {} files of {}".format(
+                    len(user_paths), user.username
+                )
+            )
+            AsyncTask(
+                scan_photos,
+                user,
+                False,
+                uuid.uuid4(),
+                user.scan_directory,
+                user_paths,
+            ).run()
+
+
+def dispatch_full_scans(directories):
+    """
+    Hands the scan directory of every user, which is watched in *directories*, to a
+    `scan_photos`, which walks it completely.
+
+    """
+    for user in _get_scanned_users():
+        if any(
+            user.scan_directory == directory
+            or _is_below(user.scan_directory, directory)
+            for directory in directories
+        ):
+            util.logger.info("watcher: scanning all files of {}".format(user.username))
+            AsyncTask(scan_photos, user, False, uuid.uuid4(), user.scan_directory).run()
+
+
+class FileWatcher:
+    """
+    Watches directory trees with inotify and scans created, modified, moved and
+    deleted files shortly after they changed.
+
+    """
+
+    def __init__(self, directories, pending=None):
+        if INotify is None:
+            raise RuntimeError("The file watcher needs the inotify_simple package")
+        self.inotify = INotify()
+        self.watch_flags = (
+            flags.CLOSE_WRITE
+            | flags.CREATE
+            | flags.DELETE
+            | flags.MOVED_FROM
+            | flags.MOVED_TO
+        )
+        self.skip_patterns = get_skip_patterns()
+        self.roots = list(directories)
+        self.overflowed = False
+        self.directories = {}
+        self.move_sources = {}
+        self.pending = pending or PendingChanges()
+        for directory in directories:
+            self.add_tree(directory)
+
+    def _should_ignore(self, path):
+        return is_hidden(path) or should_skip(path, self.skip_patterns)
+
+    def add_tree(self, directory):
+        """
+        Watches *directory* and all its subdirectories. Returns the files, which
+        already exist in them.
+
+        """
+        files = []
+        for root, subdirectories, filenames in os.walk(directory):
+            subdirectories[:] = [
+                subdirectory
+                for subdirectory in subdirectories
+                if not self._should_ignore(os.path.join(root, subdirectory))
+            ]
+            try:
+                watch = self.inotify.add_watch(root, self.watch_flags)
+            except OSError:
+                util.logger.exception("watcher: could not watch {}".format(root))
+                continue
+            self.directories[watch] = root
+            files.extend(
+                os.path.join(root, filename)
+                for filename in filenames
+                if not self._should_ignore(os.path.join(root, filename))
+            )
+        return files
+
+    def _rename_watches(self, source, destination):
+        for watch, directory in self.directories.items():
+            if directory == source or _is_below(directory, source):
+                self.directories[watch] = destination + directory[len(source) :]
+
+    def _remove_watches(self, directory):
+        for watch, watched in list(self.directories.items()):
+            if watched == directory or _is_below(watched, directory):
+                del self.directories[watch]
+                try:
+                    self.inotify.rm_watch(watch)
+                except OSError:
+                    pass
+
+    def read(self, timeout=1000):
+        for event in self.inotify.read(timeout=timeout):
+            if event.mask & flags.Q_OVERFLOW:
+                # the kernel dropped events, which only a full scan can make up for
+                self.overflowed = True
+                continue
+            if event.mask & flags.IGNORED:
+                self.directories.pop(event.wd, None)
+                continue
+            directory = self.directories.get(event.wd)
+            if directory is None or not event.name:
+                continue
+            path = os.path.join(directory, event.name)
+            if self._should_ignore(path):
+                continue
+            is_directory = bool(event.mask & flags.ISDIR)
+
+            if event.mask & flags.MOVED_FROM:
+                self.move_sources[event.cookie] = (path, is_directory, time.monotonic())
+            elif event.mask & flags.MOVED_TO:
+                source = self.move_sources.pop(event.cookie, None)
+                if source is None:
+                    self._add_created(path, is_directory)
+                else:
+                    if is_directory:
+                        self._rename_watches(source[0], path)
+                    self.pending.move(source[0], path)
+            elif event.mask & flags.CREATE:
+                # files are added, once they were closed after writing
+                if is_directory:
+                    self._add_created(path, is_directory)
+            elif event.mask & (flags.CLOSE_WRITE | flags.DELETE):
+                if not is_directory:
+                    self.pending.add(path)
+        self._expire_move_sources()
+
+    def _add_created(self, path, is_directory):
+        if is_directory:
+            for file in self.add_tree(path):
+                self.pending.add(file)
+        else:
+            self.pending.add(path)
+
+    def _expire_move_sources(self):
+        now = time.monotonic()
+        for cookie, (path, is_directory, moved_at) in list(self.move_sources.items()):
+            if now - moved_at < MOVE_PAIRING_SECONDS:
+                continue
+            del self.move_sources[cookie]
+            # moved out of the watched directories, which is the same as a deletion
+            if is_directory:
+                self._remove_watches(path)
+                for file_path in File.objects.filter(
+                    path__startswith=path.rstrip(os.sep) + os.sep
+                ).values_list("path", flat=True):
+                    self.pending.add(file_path)
+            else:
+                self.pending.add(path)
+
+    def rescan(self):
+        """
+        Scans the watched directories completely, after events were lost. Only the
+        pending moves are applied, the scans find all other changes.
+
+        """
+        util.logger.warning(
+            "watcher: event queue overflowed, scanning all watched directories"
+        )
+        self.overflowed = False
+        _, moves = self.pending.pop()
+        for source, destination in moves.items():
+            move_file_paths(source, destination)
+        dispatch_full_scans(self.roots)
+
+    def run(self):
+        util.logger.info(
+            "watcher: watching {} directories".format(len(self.directories))
+        )
+        while True:
+            self.read()
+            if self.overflowed:
+                try:
+                    self.rescan()
+                except Exception:
+                    util.logger.exception("watcher: could not scan after overflow")
+            elif self.pending.is_due():
+                paths, moves = self.pending.pop()
+                try:
+                    dispatch_changes(paths, moves)
+                except Exception:
+                    util.logger.exception("watcher: could not dispatch changes")
@@ -1,12 +1,11 @@
 import datetime
-import operator
-from functools import reduce
 
 from django.db.models import Q
 from rest_framework import filters
 
 import api.util as util
 from api.image_similarity import search_similar_embedding
+from api.search_index import search_photos
 from api.semantic_search import calculate_query_embeddings
 
 
@@ -18,11 +17,6 @@ class SemanticSearchFilter(filters.SearchFilter):
         if not search_fields or not search_terms:
             return queryset
 
-        orm_lookups = [
-            self.construct_search(str(search_field), queryset=queryset)
-            for search_field in search_fields
-        ]
-
         if request.user.semantic_search_topk > 0:
             query = request.query_params.get("search")
             start = datetime.datetime.now()
@@ -37,20 +31,12 @@ class SemanticSearchFilter(filters.SearchFilter):
             )
             elapsed = (datetime.datetime.now() - start).total_seconds()
             util.logger.info("search similar embedding - took %.2f seconds" % (elapsed))
-        conditions = []
-        for search_term in search_terms:
-            queries = [Q(**{orm_lookup: search_term}) for orm_lookup in orm_lookups]
-
-            if request.user.semantic_search_topk > 0:
-                queries += [Q(image_hash__in=image_hashes)]
-
-            conditions.append(reduce(operator.or_, queries))
-        queryset = queryset.filter(reduce(operator.and_, conditions))
+        extra_condition = None
+        if request.user.semantic_search_topk > 0:
+            extra_condition = Q(image_hash__in=image_hashes)
+        queryset = search_photos(queryset, search_terms, extra_condition)
 
-        if self.must_call_distinct(queryset, search_fields):
-            # Filtering against a many-to-many field requires us to
-            # call queryset.distinct() in order to avoid duplicate items
-            # in the resulting queryset.
-            # We try to avoid this if possible, for performance reasons.
-            queryset = queryset.distinct()
+        # views, which group by date, order the photos themselves
+        if not queryset.query.order_by:
+            queryset = queryset.order_by("-search_rank")
         return queryset
@@ -1,14 +1,17 @@
+import io
 from datetime import datetime
 
 import numpy as np
 import requests
 from django.conf import settings
-from django.core.paginator import Paginator
-from django.db.models import Q
 
-from api.models import Photo
+from api.models.photo_embedding import PhotoEmbedding, load_embeddings
+from api.semantic_search import CLIP_MODEL_VERSION, NPY_MEDIA_TYPE
 from api.util import logger
 
+# Bytes per chunk of a streamed request body
+NPY_CHUNK_SIZE = 16 * 1024 * 1024
+
 
 def search_similar_embedding(user, emb, result_count=100, threshold=27):
     if isinstance(user, int):
@@ -38,10 +41,11 @@ def search_similar_image(user, photo, threshold=27):
     else:
         user_id = user.id
 
-    if photo.clip_embeddings is None:
+    embedding = PhotoEmbedding.objects.filter(photo=photo).first()
+    if embedding is None:
         return []
 
-    image_embedding = np.array(photo.clip_embeddings, dtype=np.float32)
+    image_embedding = embedding.to_array().astype(np.float32)
 
     post_data = {
         "user_id": user_id,
@@ -60,35 +64,131 @@ def search_similar_image(user, photo, threshold=27):
         return []
 
 
+def iter_npy(*arrays, chunk_size=NPY_CHUNK_SIZE):
+    """
+    Yields *arrays* as consecutive .npy files in chunks of *chunk_size* bytes,
+    without copying the arrays into one body first.
+
+    """
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(
+            header, np.lib.format.header_data_from_array_1_0(array)
+        )
+        yield header.getvalue()
+        data = memoryview(array.reshape(-1)).cast("B")
+        for offset in range(0, len(data), chunk_size):
+            yield data[offset : offset + chunk_size].tobytes()
+
+
 def build_image_similarity_index(user):
     logger.info("building similarity index for user {}".format(user.username))
-    requests.delete(
-        settings.IMAGE_SIMILARITY_SERVER + "/build/",
-        json={"user_id": user.id},
-    )
     start = datetime.now()
-    photos = (
-        Photo.objects.filter(Q(hidden=False) & Q(owner=user))
-        .exclude(clip_embeddings=None)
-        .only("clip_embeddings", "image_hash")
-        .order_by("image_hash")
-        .all()
+    image_hashes, image_embeddings = load_embeddings(user, CLIP_MODEL_VERSION)
+    loaded = (datetime.now() - start).total_seconds()
+
+    if len(image_hashes) == 0:
+        requests.delete(
+            settings.IMAGE_SIMILARITY_SERVER + "/build/",
+            json={"user_id": user.id},
+        )
+        return
+
+    # the service replaces the index of the user with one built from all of them
+    res = requests.put(
+        settings.IMAGE_SIMILARITY_SERVER + "/build/",
+        params={"user_id": user.id, "model_version": CLIP_MODEL_VERSION},
+        data=iter_npy(np.array(image_hashes, dtype="S"), image_embeddings),
+        headers={"Content-Type": NPY_MEDIA_TYPE},
     )
-    paginator = Paginator(photos, 5000)
-
-    for page in range(1, paginator.num_pages + 1):
-        image_hashes = []
-        image_embeddings = []
-        for photo in paginator.page(page).object_list:
-            image_hashes.append(photo.image_hash)
-            image_embedding = np.array(photo.clip_embeddings, dtype=np.float32)
-            image_embeddings.append(image_embedding.tolist())
-
-        post_data = {
-            "user_id": user.id,
-            "image_hashes": image_hashes,
-            "image_embeddings": image_embeddings,
-        }
-        requests.post(settings.IMAGE_SIMILARITY_SERVER + "/build/", json=post_data)
+    if res.status_code != 200:
+        logger.error(
+            "error building similarity index for user {}".format(user.username)
+        )
     elapsed = (datetime.now() - start).total_seconds()
-    logger.info("building similarity index took %.2f seconds" % elapsed)
+    logger.info(
+        "building similarity index of %d photos took %.2f seconds, %.2f to load them"
+        % (len(image_hashes), elapsed, loaded)
+    )
+
+
+def update_image_similarity_index(user):
+    """
+    Builds the index of *user* again, when the service has none or it holds
+    embeddings of another model. Otherwise the service saves the photos, which
+    were added to the index since its last save.
+
+    """
+    try:
+        res = requests.get(
+            settings.IMAGE_SIMILARITY_SERVER + "/index/{}/".format(user.id)
+        )
+        model_version = res.json()["model_version"] if res.status_code == 200 else None
+    except requests.exceptions.RequestException as e:
+        logger.error("error retrieving similarity index status: {}".format(e))
+        return
+    if model_version != CLIP_MODEL_VERSION:
+        build_image_similarity_index(user)
+        return
+    try:
+        requests.post(
+            settings.IMAGE_SIMILARITY_SERVER + "/index/{}/save/".format(user.id)
+        )
+    except requests.exceptions.RequestException as e:
+        logger.error("error saving similarity index: {}".format(e))
+
+
+def add_to_image_similarity_index(user, image_hashes):
+    image_hashes, image_embeddings = load_embeddings(
+        user, CLIP_MODEL_VERSION, image_hashes=image_hashes
+    )
+    if len(image_hashes) == 0:
+        return
+    post_data = {
+        "user_id": user.id,
+        "image_hashes": image_hashes,
+        "image_embeddings": image_embeddings.tolist(),
+        "model_version": CLIP_MODEL_VERSION,
+    }
+    try:
+        res = requests.post(
+            settings.IMAGE_SIMILARITY_SERVER + "/images/", json=post_data
+        )
+    except requests.exceptions.RequestException as e:
+        logger.error("error adding photos to similarity index: {}".format(e))
+        return
+    if res.status_code == 409:
+        # the index holds embeddings of another model
+        build_image_similarity_index(user)
+
+
+def remove_from_image_similarity_index(user, image_hashes):
+    if len(image_hashes) == 0:
+        return
+    try:
+        requests.delete(
+            settings.IMAGE_SIMILARITY_SERVER + "/images/",
+            json={"user_id": user.id, "image_hashes": list(image_hashes)},
+        )
+    except requests.exceptions.RequestException as e:
+        logger.error("error removing photos from similarity index: {}".format(e))
+
+
+def benchmark_image_similarity_index(user, queries=100, n=100):
+    """
+    Compares the recall and latency of the index types of the image similarity
+    service on the embeddings of *user*.
+
+    """
+    _, image_embeddings = load_embeddings(user, CLIP_MODEL_VERSION)
+    body = io.BytesIO()
+    np.save(body, image_embeddings)
+    res = requests.post(
+        settings.IMAGE_SIMILARITY_SERVER + "/benchmark/",
+        params={"queries": queries, "n": n},
+        data=body.getvalue(),
+        headers={"Content-Type": NPY_MEDIA_TYPE},
+    )
+    res.raise_for_status()
+    return res.json()["result"]
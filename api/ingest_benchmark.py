@@ -0,0 +1,435 @@
+import io
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pyvips
+from django.db import connection
+
+import api.directory_watcher as directory_watcher
+import api.util as util
+from api.models import LongRunningJob, Photo
+from api.semantic_search import NPY_MEDIA_TYPE, create_clip_embeddings
+from api.sidecar_index import SidecarIndex
+
+# Share of every kind of file in the corpus, the rest are plain jpegs
+CORPUS_MIX = {
+    "png": 0.1,
+    "heic": 0.1,
+    "sidecar": 0.1,
+    "motion_photo": 0.1,
+    "video": 0.1,
+}
+IMAGE_SIZES = [(1600, 1200), (1200, 1600), (2048, 1152), (1152, 2048)]
+VIDEO_SIZES = [(640, 360), (360, 640)]
+
+# Stand-ins answer the ML services, which are not running
+STAND_IN_PORTS = {"places365": 8011, "clip": 8006, "face_recognition": 8005}
+CLIP_EMBEDDING_SIZE = 512
+
+PHOTO_STAGES = [
+    "_generate_thumbnail",
+    "_calculate_aspect_ratio",
+    "_get_dominant_color",
+    "_extract_exif_data",
+    "_extract_date_time_from_exif",
+    "_recreate_search_captions",
+    "_generate_captions",
+    "_extract_faces",
+]
+INGEST_STAGES = [
+    "walk_directory_with_stats",
+    "classify_media",
+    "calculate_hash",
+    "create_new_images",
+    "handle_new_image",
+]
+
+SIDECAR_TEMPLATE = """<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description xmlns:xmp="http://ns.adobe.com/xap/1.0/"
+    xmlns:dc="http://purl.org/dc/elements/1.1/" xmp:Rating="{rating}">
+   <dc:subject><rdf:Bag><rdf:li>{subject}</rdf:li></rdf:Bag></dc:subject>
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>
+"""
+
+
+def _choose_kind(rng):
+    value = rng.random()
+    for kind, share in CORPUS_MIX.items():
+        if value < share:
+            return kind
+        value -= share
+    return "jpeg"
+
+
+def _create_image(rng):
+    width, height = rng.choice(IMAGE_SIZES)
+    x, y = pyvips.Image.xyz(width, height).bandsplit()
+    red = x * (255 / width)
+    green = y * (255 / height)
+    blue = (x + y) * (255 / (width + height))
+    offset = [rng.randrange(256) for _ in range(3)]
+    return ((red.bandjoin([green, blue]) + offset) % 256).cast("uchar")
+
+
+def _create_video(path, rng, duration=2):
+    width, height = rng.choice(VIDEO_SIZES)
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc=duration={}:size={}x{}:rate=15".format(duration, width, height),
+            "-pix_fmt",
+            "yuv420p",
+            path,
+        ],
+        check=True,
+    )
+
+
+def _exif_arguments(path, rng):
+    taken = time.gmtime(rng.randrange(946684800, 1735689600))
+    return [
+        "-DateTimeOriginal={}".format(time.strftime("%Y:%m:%d %H:%M:%S", taken)),
+        "-Make=Benchmark",
+        "-Model=Camera {}".format(rng.randrange(1, 5)),
+        "-GPSLatitude={:.6f}".format(rng.uniform(0, 70)),
+        "-GPSLatitudeRef={}".format(rng.choice(["N", "S"])),
+        "-GPSLongitude={:.6f}".format(rng.uniform(0, 170)),
+        "-GPSLongitudeRef={}".format(rng.choice(["E", "W"])),
+        path,
+    ]
+
+
+def generate_corpus(directory, count, seed=0):
+    """
+    Writes a reproducible library of *count* media files to *directory*: jpegs with
+    EXIF and GPS, pngs, heic images, jpegs with XMP sidecars, motion photos and short
+    videos. The same *seed* always produces the same library.
+
+    Returns the number of files per kind.
+
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    kinds = {}
+    exif_arguments = []
+    motion_photos = []
+    motion_video = os.path.join(directory, ".motion.mp4")
+    _create_video(motion_video, random.Random(seed), duration=1)
+    with open(motion_video, "rb") as f:
+        motion_video_data = f.read()
+    os.remove(motion_video)
+
+    for index in range(count):
+        kind = _choose_kind(rng)
+        subdirectory = os.path.join(directory, "{:03d}".format(index // 100))
+        os.makedirs(subdirectory, exist_ok=True)
+        base = os.path.join(subdirectory, "IMG_{:05d}".format(index))
+        if kind == "video":
+            path = base + ".mp4"
+            _create_video(path, rng)
+        elif kind == "png":
+            path = base + ".png"
+            _create_image(rng).write_to_file(path)
+        elif kind == "heic":
+            image = _create_image(rng)
+            try:
+                path = base + ".heic"
+                image.write_to_file(path)
+            except pyvips.Error:
+                # libvips was built without libheif
+                kind = "heic_unsupported"
+                path = base + ".jpg"
+                image.write_to_file(path)
+        else:
+            path = base + ".jpg"
+            _create_image(rng).write_to_file(path, Q=85)
+            if kind == "motion_photo":
+                motion_photos.append(path)
+        kinds[kind] = kinds.get(kind, 0) + 1
+
+        if kind != "video":
+            exif_arguments += _exif_arguments(path, rng) + ["-execute"]
+        if kind == "sidecar":
+            with open(base + ".xmp", "w") as f:
+                f.write(
+                    SIDECAR_TEMPLATE.format(
+                        rating=rng.randrange(1, 6), subject="tag{}".format(index % 7)
+                    )
+                )
+
+    # all files are written by one exiftool process
+    argument_file = os.path.join(directory, ".exif_arguments")
+    with open(argument_file, "w") as f:
+        f.write("\n".join(["-overwrite_original", "-q"] + exif_arguments))
+    subprocess.run(["exiftool", "-@", argument_file], check=True)
+    os.remove(argument_file)
+
+    # motion photos get their video after the exif is written, like a camera does
+    for path in motion_photos:
+        with open(path, "ab") as f:
+            f.write(motion_video_data)
+    return kinds
+
+
+class StageStats:
+    """
+    Durations, database queries and failures of every call of a stage. Stages, which
+    call other stages, include their durations and queries.
+
+    """
+
+    def __init__(self):
+        self.durations = []
+        self.queries = 0
+        self.failures = 0
+
+    def record(self, duration, queries, failed=False):
+        self.durations.append(duration)
+        self.queries += queries
+        if failed:
+            self.failures += 1
+
+    def report(self):
+        if not self.durations:
+            return {"calls": 0}
+        durations = np.array(self.durations)
+        total = float(durations.sum())
+        return {
+            "calls": len(durations),
+            "failures": self.failures,
+            "total_seconds": round(total, 3),
+            "throughput_per_second": (
+                round(len(durations) / total, 2) if total else None
+            ),
+            "p50_ms": round(float(np.percentile(durations, 50)) * 1000, 2),
+            "p95_ms": round(float(np.percentile(durations, 95)) * 1000, 2),
+            "queries": self.queries,
+            "queries_per_call": round(self.queries / len(durations), 2),
+        }
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _timed(function, stats, queries):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        queries_before = queries.count
+        failed = False
+        try:
+            result = function(*args, **kwargs)
+            failed = result is False
+            return result
+        except Exception:
+            failed = True
+            raise
+        finally:
+            stats.record(
+                time.perf_counter() - start, queries.count - queries_before, failed
+            )
+
+    return wrapper
+
+
+@contextmanager
+def instrumented(stats, queries):
+    """
+    Times the ingest functions of `directory_watcher` and the processing stages of
+    `Photo`, while the context is active.
+
+    """
+    targets = [(directory_watcher, name) for name in INGEST_STAGES] + [
+        (Photo, name) for name in PHOTO_STAGES
+    ]
+    originals = []
+    for target, name in targets:
+        original = getattr(target, name)
+        originals.append((target, name, original))
+        setattr(
+            target,
+            name,
+            _timed(original, stats.setdefault(name, StageStats()), queries),
+        )
+    try:
+        yield
+    finally:
+        for target, name, original in originals:
+            setattr(target, name, original)
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    def _reply(self, body):
+        if isinstance(body, np.ndarray):
+            buffer = io.BytesIO()
+            np.save(buffer, body)
+            content, content_type = buffer.getvalue(), NPY_MEDIA_TYPE
+        else:
+            content, content_type = json.dumps(body).encode(), "application/json"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        self._reply(stand_in_response(self.path, request))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def stand_in_response(path, request):
+    """
+    Returns the canned answer of a stand-in for the ML service endpoint *path*.
+
+    """
+    if path == "/generate-tags":
+        return {
+            "tags": {
+                "attributes": ["natural light", "open area"],
+                "categories": ["field/wild"],
+                "environment": "outdoor",
+            }
+        }
+    if path == "/clip-embeddings":
+        return np.full(
+            (len(request.get("imgs", [])), CLIP_EMBEDDING_SIZE),
+            1.0 / CLIP_EMBEDDING_SIZE**0.5,
+            dtype=np.float32,
+        )
+    if path == "/face-locations":
+        return {"face_locations": []}
+    if path == "/face-encodings":
+        return {"encodings": []}
+    return {}
+
+
+def _is_port_in_use(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        return s.connect_ex(("localhost", port)) == 0
+
+
+@contextmanager
+def stand_in_services():
+    """
+    Answers the ML services with stand-ins on their ports, unless the real services are
+    running. Yields which of both answered every service.
+
+    """
+    servers = []
+    used = {}
+    for service, port in STAND_IN_PORTS.items():
+        if _is_port_in_use(port):
+            used[service] = "service"
+            continue
+        server = ThreadingHTTPServer(("localhost", port), _StandInHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        used[service] = "stand-in"
+    try:
+        yield used
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+def _peak_rss_mb():
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in KiB on Linux
+    return {"self": round(own / 1024, 1), "children": round(children / 1024, 1)}
+
+
+def run_benchmark(user, directory, chunk_size=directory_watcher.INGEST_CHUNK_SIZE):
+    """
+    Ingests every file in *directory* for *user* with the functions of a scan, but in
+    this process, followed by the ML stages of a photo.
+
+    Returns the report as dict.
+
+    """
+    stats = {}
+    queries = _QueryCounter()
+    job_id = uuid.uuid4()
+    LongRunningJob.objects.create(
+        started_by=user, job_id=job_id, job_type=LongRunningJob.JOB_SCAN_PHOTOS
+    )
+    start = time.perf_counter()
+    with (
+        stand_in_services() as services,
+        connection.execute_wrapper(queries),
+        instrumented(stats, queries),
+    ):
+        found_files = directory_watcher.walk_directory_with_stats(directory)
+        registry = directory_watcher.load_file_registry(user, directory)
+        new_paths, changed_paths, _ = directory_watcher.diff_with_registry(
+            found_files, registry
+        )
+        paths = sorted(new_paths | changed_paths)
+        LongRunningJob.objects.filter(job_id=job_id).update(progress_target=len(paths))
+        sidecar_index = SidecarIndex(found_files.keys())
+        for index in range(0, len(paths), chunk_size):
+            chunk = paths[index : index + chunk_size]
+            directory_watcher.ingest_new_files(
+                user, chunk, job_id, sidecar_index.subset(chunk)
+            )
+        ingest_seconds = time.perf_counter() - start
+
+        clip_stats = stats.setdefault("create_clip_embeddings", StageStats())
+        for photo in Photo.objects.filter(owner=user).select_related("main_file"):
+            photo._generate_captions(True)
+            photo._extract_faces()
+            clip_start = time.perf_counter()
+            queries_before = queries.count
+            try:
+                create_clip_embeddings([photo.thumbnail_big.path])
+                failed = False
+            except Exception:
+                util.logger.exception("benchmark: clip embedding failed")
+                failed = True
+            clip_stats.record(
+                time.perf_counter() - clip_start, queries.count - queries_before, failed
+            )
+
+    total_seconds = time.perf_counter() - start
+    return {
+        "files": len(found_files),
+        "photos": Photo.objects.filter(owner=user).count(),
+        "ingest_seconds": round(ingest_seconds, 3),
+        "total_seconds": round(total_seconds, 3),
+        "files_per_second": (
+            round(len(found_files) / ingest_seconds, 2) if ingest_seconds else None
+        ),
+        "queries": queries.count,
+        "peak_rss_mb": _peak_rss_mb(),
+        "services": services,
+        "stages": {name: stage.report() for name, stage in stats.items()},
+    }
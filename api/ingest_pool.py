@@ -0,0 +1,72 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from constance import config as site_config
+
+import api.util as util
+
+# Work items, which may wait for a free worker, per worker
+QUEUE_SIZE_PER_WORKER = 2
+
+
+def _init_worker():
+    # workers are started by the forkserver, without the Django setup of the scan
+    django.setup()
+
+
+def get_worker_count():
+    return max(1, site_config.HEAVYWEIGHT_PROCESS or 1)
+
+
+class IngestPool:
+    """
+    Runs the ingest of a scan in a pool of worker processes. Every worker keeps its
+    database connection and service sessions for all the work items it runs.
+
+    `submit` blocks, while all workers are busy and the queue is full, so the scan
+    never gets further ahead of the workers than the queue size:
+
+        with IngestPool() as pool:
+            for chunk in chunks:
+                pool.submit(ingest_new_files, user, chunk, job_id)
+
+    """
+
+    def __init__(self, workers=None, queue_size=None):
+        self.workers = workers or get_worker_count()
+        self.queue_size = queue_size or self.workers * QUEUE_SIZE_PER_WORKER
+        self.slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self.failed = False
+        self.executor = None
+
+    def __enter__(self):
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=_init_worker,
+        )
+        return self
+
+    def submit(self, fn, *args):
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        self.slots.release()
+        if future.cancelled():
+            return
+        exception = future.exception()
+        if exception is not None:
+            self.failed = True
+            util.logger.error("ingest worker failed: {}".format(exception))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.executor.shutdown(wait=True, cancel_futures=exc_type is not None)
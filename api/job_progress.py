@@ -0,0 +1,72 @@
+import time
+
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from api.models import LongRunningJob
+
+# A flush happens after this many seconds or increments, whatever comes first
+FLUSH_INTERVAL = 2
+FLUSH_SIZE = 50
+
+
+class JobProgress:
+    """
+    Counts the processed items of a LongRunningJob in memory and adds them to the job
+    with a single UPDATE per flush. The same UPDATE marks the job as finished, once the
+    aggregated counter reaches the target.
+
+    Use it as context manager, so the remaining increments are flushed at the end:
+
+        with JobProgress(job_id) as progress:
+            for item in items:
+                progress.increment(failed=not process(item))
+
+    """
+
+    def __init__(self, job_id, flush_interval=FLUSH_INTERVAL, flush_size=FLUSH_SIZE):
+        self.job_id = job_id
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.pending = 0
+        self.failed = False
+        self.last_flush = time.monotonic()
+
+    def increment(self, failed=False, count=1):
+        self.pending += count
+        self.failed = self.failed or failed
+        if (
+            self.pending >= self.flush_size
+            or time.monotonic() - self.last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if self.pending == 0 and not self.failed:
+            return
+        # the condition sees the row before the update, so it has to add the pending count
+        reached_target = Q(finished=False) & Q(
+            progress_target__lte=F("progress_current") + self.pending
+        )
+        updates = {
+            "progress_current": F("progress_current") + self.pending,
+            "finished": Case(
+                When(reached_target, then=Value(True)), default=F("finished")
+            ),
+            "finished_at": Case(
+                When(reached_target, then=Value(timezone.now())),
+                default=F("finished_at"),
+            ),
+        }
+        if self.failed:
+            updates["failed"] = Value(True)
+        LongRunningJob.objects.filter(job_id=self.job_id).update(**updates)
+        self.pending = 0
+        self.failed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
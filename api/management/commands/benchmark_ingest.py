@@ -0,0 +1,73 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand
+
+from api.ingest_benchmark import generate_corpus, run_benchmark
+from api.models import File, Photo, User
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic photo library, ingest it like a scan and report "
+        "throughput, latency, database queries and peak memory per stage as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-c", "--count", help="Number of media files", type=int, default=200
+        )
+        parser.add_argument(
+            "--seed", help="Seed of the generated library", type=int, default=0
+        )
+        parser.add_argument(
+            "-d",
+            "--directory",
+            help="Directory of the library, a temporary one by default",
+        )
+        parser.add_argument(
+            "-o", "--output", help="Write the report to this file instead of stdout"
+        )
+        parser.add_argument(
+            "--username", help="Owner of the ingested photos", default="benchmark"
+        )
+        parser.add_argument(
+            "--keep",
+            help="Keep the library and the ingested photos",
+            action="store_true",
+        )
+
+    def handle(self, *args, **options):
+        directory = options["directory"] or tempfile.mkdtemp(prefix="benchmark_")
+        directory = os.path.abspath(directory)
+        user, _ = User.objects.get_or_create(
+            username=options["username"], defaults={"scan_directory": directory}
+        )
+        self._remove_photos(user, directory)
+
+        corpus = generate_corpus(directory, options["count"], options["seed"])
+        report = run_benchmark(user, directory)
+        report["corpus"] = {
+            "seed": options["seed"],
+            "count": options["count"],
+            "kinds": corpus,
+        }
+
+        if not options["keep"]:
+            self._remove_photos(user, directory)
+            shutil.rmtree(directory, ignore_errors=True)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def _remove_photos(self, user, directory):
+        # only the photos of the library, the user may have others
+        prefix = directory.rstrip(os.sep) + os.sep
+        Photo.objects.filter(owner=user, main_file__path__startswith=prefix).delete()
+        File.objects.filter(path__startswith=prefix).delete()
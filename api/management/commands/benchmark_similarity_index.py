@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.image_similarity import benchmark_image_similarity_index
+from api.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare recall and search latency of the flat, HNSW and IVF-PQ index on "
+        "the embeddings of a user and report them as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", help="Owner of the embeddings")
+        parser.add_argument(
+            "-q", "--queries", help="Number of searches", type=int, default=100
+        )
+        parser.add_argument(
+            "-n", help="Number of neighbours per search", type=int, default=100
+        )
+        parser.add_argument(
+            "-o", "--output", help="Write the report to this file instead of stdout"
+        )
+
+    def handle(self, *args, **options):
+        user = User.objects.get(username=options["username"])
+        report = benchmark_image_similarity_index(
+            user, queries=options["queries"], n=options["n"]
+        )
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
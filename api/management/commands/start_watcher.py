@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.file_watcher import FileWatcher, INotify
+from api.models import User
+from api.models.user import get_deleted_user
+
+
+class Command(BaseCommand):
+    help = (
+        "Watch the scan directories of all users and scan new, changed, moved and "
+        "deleted files within seconds. Restart it, after a scan directory changed."
+    )
+
+    def handle(self, *args, **kwargs):
+        if INotify is None:
+            raise CommandError("The file watcher needs the inotify_simple package")
+        deleted_user = get_deleted_user()
+        directories = sorted(
+            {
+                user.scan_directory
+                for user in User.objects.exclude(scan_directory="").exclude(
+                    scan_directory__isnull=True
+                )
+                if user != deleted_user
+            }
+        )
+        FileWatcher(directories).run()
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+from django.conf import settings
+
+import api.util as util
+from api.exif_tags import Tags
+
+ALL_TAGS = [value for name, value in vars(Tags).items() if not name.startswith("_")]
+_ALL_TAGS_SET = set(ALL_TAGS)
+
+# Number of snapshots kept in memory. A job touches each file a handful of times in a row,
+# so this only needs to cover the files a worker is currently processing.
+SNAPSHOT_CACHE_SIZE = 256
+
+_snapshots = OrderedDict()
+
+
+def _get_fingerprint(media_file):
+    fingerprint = []
+    for file in [media_file] + util.get_existing_sidecar_files(media_file):
+        try:
+            file_stat = os.stat(file)
+        except OSError:
+            continue
+        fingerprint.append([file, file_stat.st_size, file_stat.st_mtime_ns])
+    return fingerprint
+
+
+class MetadataSnapshot:
+    """
+    Values of all known `Tags` of a media file and its sidecar files, read with one
+    exiftool call and valid for as long as none of these files changes.
+
+    """
+
+    def __init__(self, media_file, fingerprint, values=None):
+        self.media_file = media_file
+        self.fingerprint = fingerprint
+        # tag values per file, read lazily with and without the -struct option
+        self.values = values or {"flat": None, "struct": None}
+
+    @property
+    def files_by_reverse_priority(self):
+        sidecar_files = [
+            file for file, _, _ in self.fingerprint if file != self.media_file
+        ]
+        return [self.media_file] + list(reversed(sidecar_files))
+
+    def _get_values_by_file(self, struct):
+        kind = "struct" if struct else "flat"
+        if self.values[kind] is None:
+            files = [file for file, _, _ in self.fingerprint] or [self.media_file]
+            values = util.get_metadata_batch(
+                files, ALL_TAGS, try_sidecar=False, struct=struct
+            )
+            self.values[kind] = {
+                file: dict(zip(ALL_TAGS, file_values))
+                for file, file_values in zip(files, values)
+            }
+            _persist(self)
+        return self.values[kind]
+
+    def get(self, tags, try_sidecar=True, struct=False):
+        values_by_file = self._get_values_by_file(struct)
+        files = self.files_by_reverse_priority if try_sidecar else [self.media_file]
+        values = []
+        for tag in tags:
+            value = None
+            for file in files:
+                retrieved_value = values_by_file.get(file, {}).get(tag)
+                if retrieved_value is not None:
+                    value = retrieved_value
+            values.append(value)
+        return values
+
+
+def _get_persisted_path(media_file):
+    name = hashlib.sha1(os.fsencode(media_file)).hexdigest()
+    return os.path.join(settings.MEDIA_ROOT, "metadata_snapshots", name[:2], name)
+
+
+def _should_persist(media_file):
+    # Thumbnails are generated by us and do not need to survive the job
+    return settings.PERSIST_METADATA_SNAPSHOTS and not media_file.startswith(
+        settings.MEDIA_ROOT
+    )
+
+
+def _persist(snapshot):
+    if not _should_persist(snapshot.media_file):
+        return
+    path = _get_persisted_path(snapshot.media_file)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(
+                {"fingerprint": snapshot.fingerprint, "values": snapshot.values}, f
+            )
+        os.replace(path + ".tmp", path)
+    except Exception:
+        util.logger.exception(
+            "could not persist metadata snapshot of {}".format(snapshot.media_file)
+        )
+
+
+def _load_persisted(media_file, fingerprint):
+    if not _should_persist(media_file):
+        return None
+    path = _get_persisted_path(media_file)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            persisted = json.load(f)
+    except Exception:
+        util.logger.warning("could not read metadata snapshot of {}".format(media_file))
+        return None
+    if persisted["fingerprint"] != fingerprint:
+        return None
+    return MetadataSnapshot(media_file, fingerprint, persisted["values"])
+
+
+def get_snapshot(media_file):
+    """
+    Returns the metadata snapshot of *media_file*. A new snapshot is created whenever
+    size or mtime of the file or one of its sidecar files changed.
+
+    """
+    media_file = str(media_file)
+    fingerprint = _get_fingerprint(media_file)
+    snapshot = _snapshots.get(media_file)
+    if snapshot is not None and snapshot.fingerprint == fingerprint:
+        _snapshots.move_to_end(media_file)
+        return snapshot
+
+    snapshot = _load_persisted(media_file, fingerprint) or MetadataSnapshot(
+        media_file, fingerprint
+    )
+    _snapshots[media_file] = snapshot
+    _snapshots.move_to_end(media_file)
+    while len(_snapshots) > SNAPSHOT_CACHE_SIZE:
+        _snapshots.popitem(last=False)
+    return snapshot
+
+
+def clear_snapshots():
+    _snapshots.clear()
+
+
+def get_metadata(media_file, tags, try_sidecar=True, struct=False):
+    """
+    Drop-in replacement for `api.util.get_metadata`, which serves the values from
+    the metadata snapshot of *media_file*.
+    Tags which are not part of `Tags` are requested from the exif service directly.
+
+    """
+    if not all(tag in _ALL_TAGS_SET for tag in tags):
+        return util.get_metadata(
+            media_file, tags, try_sidecar=try_sidecar, struct=struct
+        )
+    return get_snapshot(media_file).get(tags, try_sidecar=try_sidecar, struct=struct)
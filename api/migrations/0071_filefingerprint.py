@@ -0,0 +1,33 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0070_photo_removed"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FileFingerprint",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("path", models.TextField(unique=True)),
+                ("size", models.BigIntegerField()),
+                ("mtime", models.BigIntegerField()),
+                ("inode", models.BigIntegerField()),
+                ("algorithm", models.CharField(default="md5", max_length=16)),
+                ("fingerprint", models.CharField(default="", max_length=64)),
+                ("hash", models.CharField(max_length=64)),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0071_filefingerprint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="file",
+            name="mime_type",
+            field=models.CharField(blank=True, max_length=127, null=True),
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="width",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="height",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="has_motion_video",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0072_file_media_info"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="photo",
+            name="video_probe",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0073_photo_video_probe"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="file",
+            name="size",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="mtime",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="inode",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="last_seen_scan",
+            field=models.CharField(blank=True, max_length=36, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="file",
+            index=models.Index(
+                fields=["path"],
+                name="api_file_path_idx",
+                opclasses=["text_pattern_ops"],
+            ),
+        ),
+    ]
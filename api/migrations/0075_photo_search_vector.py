@@ -0,0 +1,75 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:10
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+SEARCH_VECTOR = """
+    setweight(to_tsvector('simple', coalesce({0}search_captions, '')), 'A')
+    || setweight(to_tsvector('simple', coalesce({0}search_location, '')), 'B')
+"""
+
+# The search vector only depends on these columns, so updates of other columns,
+# e.g. bulk updates of last_modified, do not have to recalculate it
+CREATE_TRIGGER = """
+CREATE FUNCTION api_photo_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER api_photo_search_vector_trigger
+BEFORE INSERT OR UPDATE OF search_captions, search_location ON api_photo
+FOR EACH ROW EXECUTE FUNCTION api_photo_search_vector_update();
+
+UPDATE api_photo SET search_vector = {};
+""".format(
+    SEARCH_VECTOR.format("NEW."), SEARCH_VECTOR.format("")
+)
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS api_photo_search_vector_trigger ON api_photo;
+DROP FUNCTION IF EXISTS api_photo_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0074_file_registry"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name="photo",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.AddIndex(
+            model_name="photo",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="api_photo_search_vector_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="photo",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_captions"],
+                name="api_photo_search_captions_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="photo",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_location"],
+                name="api_photo_search_location_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 4.2.16 on 2026-10-18 15:40
+
+import django.db.models.deletion
+import numpy as np
+from django.db import migrations, models
+
+# Version of the model, which calculated the embeddings stored on the photos
+CLIP_MODEL_VERSION = "clip-ViT-B-32"
+BATCH_SIZE = 1000
+
+
+def copy_embeddings(apps, schema_editor):
+    Photo = apps.get_model("api", "Photo")
+    PhotoEmbedding = apps.get_model("api", "PhotoEmbedding")
+    photos = (
+        Photo.objects.exclude(clip_embeddings=None)
+        .values_list("image_hash", "clip_embeddings", "clip_embeddings_magnitude")
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+    batch = []
+    for image_hash, embedding, magnitude in photos:
+        vector = np.asarray(embedding, dtype="<f4")
+        batch.append(
+            PhotoEmbedding(
+                photo_id=image_hash,
+                model_version=CLIP_MODEL_VERSION,
+                dtype="<f4",
+                vector=vector.tobytes(),
+                magnitude=(
+                    magnitude if magnitude is not None else np.linalg.norm(vector)
+                ),
+            )
+        )
+        if len(batch) == BATCH_SIZE:
+            PhotoEmbedding.objects.bulk_create(batch)
+            batch = []
+    PhotoEmbedding.objects.bulk_create(batch)
+
+
+def restore_embeddings(apps, schema_editor):
+    Photo = apps.get_model("api", "Photo")
+    PhotoEmbedding = apps.get_model("api", "PhotoEmbedding")
+    for embedding in PhotoEmbedding.objects.iterator(chunk_size=BATCH_SIZE):
+        Photo.objects.filter(image_hash=embedding.photo_id).update(
+            clip_embeddings=np.frombuffer(embedding.vector, dtype=embedding.dtype)
+            .astype(float)
+            .tolist(),
+            clip_embeddings_magnitude=embedding.magnitude,
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0075_photo_search_vector"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PhotoEmbedding",
+            fields=[
+                (
+                    "photo",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="embedding",
+                        serialize=False,
+                        to="api.photo",
+                    ),
+                ),
+                ("model_version", models.CharField(db_index=True, max_length=64)),
+                (
+                    "dtype",
+                    models.CharField(
+                        choices=[("<f4", "float32"), ("<f2", "float16")],
+                        default="<f4",
+                        max_length=3,
+                    ),
+                ),
+                ("vector", models.BinaryField()),
+                ("magnitude", models.FloatField()),
+            ],
+        ),
+        migrations.RunPython(copy_embeddings, restore_embeddings),
+        migrations.RemoveField(
+            model_name="photo",
+            name="clip_embeddings",
+        ),
+        migrations.RemoveField(
+            model_name="photo",
+            name="clip_embeddings_magnitude",
+        ),
+    ]
@@ -6,9 +6,11 @@ from api.models.album_user import AlbumUser
 from api.models.cluster import Cluster
 from api.models.face import Face
 from api.models.file import File
+from api.models.file_fingerprint import FileFingerprint
 from api.models.long_running_job import LongRunningJob
 from api.models.person import Person
 from api.models.photo import Photo
+from api.models.photo_embedding import PhotoEmbedding
 from api.models.user import User
 
 __all__ = [
@@ -22,6 +24,8 @@ __all__ = [
     "LongRunningJob",
     "Person",
     "Photo",
+    "PhotoEmbedding",
     "User",
     "File",
+    "FileFingerprint",
 ]
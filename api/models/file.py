@@ -1,13 +1,26 @@
 import hashlib
 import os
-from mmap import ACCESS_READ, mmap
+import re
+import threading
+from dataclasses import dataclass
 
 import magic
 import pyvips
 from django.conf import settings
-from django.db import models
+from django.db import IntegrityError, models
 
 import api.util as util
+from api.models.file_fingerprint import FileFingerprint, to_signed_inode
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
 
 JPEG_EOI_MARKER = b"\xff\xd9"
 GOOGLE_PIXEL_MOTION_PHOTO_MP4_SIGNATURES = [b"ftypmp42", b"ftypisom", b"ftypiso2"]
@@ -16,6 +29,18 @@ GOOGLE_PIXEL_MOTION_PHOTO_MP4_SIGNATURES = [b"ftypmp42", b"ftypisom", b"ftypiso2
 # ........Image_UTC_Data1458170015363SEFHe...........#...#.......SEFT..0.....MotionPhoto_Data
 # but we are interested only in the content of the video which is right after MotionPhoto_Data
 SAMSUNG_MOTION_PHOTO_MARKER = b"MotionPhoto_Data"
+MOTION_PHOTO_SIGNATURES = GOOGLE_PIXEL_MOTION_PHOTO_MP4_SIGNATURES + [
+    SAMSUNG_MOTION_PHOTO_MARKER
+]
+
+# The XMP packet with the container directory is in the first APP1 segment
+MOTION_PHOTO_HEAD_SIZE = 131072
+# Files without XMP are only searched this far from their end for the video
+MOTION_PHOTO_TAIL_SIZE = 67108864
+
+_MICRO_VIDEO_OFFSET = re.compile(rb'MicroVideoOffset="(\d+)"')
+_CONTAINER_ITEM = re.compile(rb"<Container:Item\b[^>]*>")
+_ITEM_LENGTH = re.compile(rb'Item:Length="(\d+)"')
 
 # Most optimal value for performance/memory. Found here:
 # https://stackoverflow.com/questions/17731660/hashlib-optimal-size-of-chunks-to-be-used-in-md5-update
@@ -46,35 +71,141 @@ class File(models.Model):
     )
     missing = models.BooleanField(default=False)
     embedded_media = models.ManyToManyField("File")
+    mime_type = models.CharField(max_length=127, blank=True, null=True)
+    width = models.IntegerField(blank=True, null=True)
+    height = models.IntegerField(blank=True, null=True)
+    has_motion_video = models.BooleanField(default=False)
+    # state of the file on disk, when it was last processed
+    size = models.BigIntegerField(blank=True, null=True)
+    mtime = models.BigIntegerField(blank=True, null=True)
+    inode = models.BigIntegerField(blank=True, null=True)
+    last_seen_scan = models.CharField(max_length=36, blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # text_pattern_ops also serves the prefix lookups of directory scans
+            models.Index(
+                fields=["path"],
+                name="api_file_path_idx",
+                opclasses=["text_pattern_ops"],
+            ),
+        ]
 
     @staticmethod
-    def create(path: str, user):
+    def create(path: str, user, hash=None, media_info=None):
         file = File()
         file.path = path
-        file.hash = calculate_hash(user, path)
-        file._find_out_type()
+        file.hash = hash or calculate_hash(user, path)
+        file._find_out_type(media_info)
+        file._read_stat()
         file.save()
         return file
 
-    def _find_out_type(self):
-        self.type = File.IMAGE
-        if is_raw(self.path):
-            self.type = File.RAW_FILE
-        if is_video(self.path):
-            self.type = File.VIDEO
-        if is_metadata(self.path):
-            self.type = File.METADATA_FILE
-        self.save()
+    def _find_out_type(self, media_info=None):
+        media_info = media_info or classify_media(self.path)
+        self.type = media_info.kind
+        self.mime_type = media_info.mime
+        self.width = media_info.width
+        self.height = media_info.height
+        self.has_motion_video = media_info.has_motion_video
+
+    def _read_stat(self):
+        try:
+            file_stat = os.stat(self.path)
+        except OSError:
+            return
+        self.size = file_stat.st_size
+        self.mtime = file_stat.st_mtime_ns
+        self.inode = to_signed_inode(file_stat.st_ino)
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    """
+    Everything the ingest needs to know about the content of a file, see `classify_media`.
+
+    """
+
+    mime: str
+    kind: int
+    width: int | None = None
+    height: int | None = None
+    is_raw: bool = False
+    has_motion_video: bool = False
+    motion_video_offset: int | None = None
+
+    @property
+    def is_valid(self):
+        # images are only valid, when their header could be decoded
+        return self.kind != File.IMAGE or self.width is not None
+
+
+# magic handles are expensive to open and must not be shared between threads
+_magic_handles = threading.local()
+
+
+def _get_mime_type(path):
+    handle = getattr(_magic_handles, "mime", None)
+    if handle is None:
+        handle = magic.Magic(mime=True)
+        _magic_handles.mime = handle
+    return handle.from_file(path)
+
+
+def classify_media(path) -> MediaInfo:
+    """
+    Sniffs a file once: the mime type with libmagic and, for images, the dimensions
+    from the header without decoding the pixels.
+
+    """
+    path = str(path)
+    try:
+        mime = _get_mime_type(path)
+    except Exception:
+        util.logger.error("Error while checking the mime type of: %s" % path)
+        mime = ""
+    if is_metadata(path):
+        return MediaInfo(mime, File.METADATA_FILE)
+    if "video" in mime:
+        return MediaInfo(mime, File.VIDEO)
+
+    raw = is_raw(path)
+    width = None
+    height = None
+    try:
+        image = pyvips.Image.new_from_file(path, access="sequential")
+        width = image.width
+        height = image.height
+    except Exception as e:
+        # raw files are converted by the thumbnail service, they do not need to be readable by vips
+        if not raw:
+            util.logger.info("Could not handle {}, because {}".format(path, str(e)))
+    if raw:
+        return MediaInfo(mime, File.RAW_FILE, width, height, is_raw=True)
+    motion_video_offset = -1
+    if mime == "image/jpeg":
+        try:
+            motion_video_offset = locate_motion_video(path)
+        except Exception:
+            util.logger.exception("Could not check {} for motion video".format(path))
+    if motion_video_offset == -1:
+        return MediaInfo(mime, File.IMAGE, width, height)
+    return MediaInfo(
+        mime,
+        File.IMAGE,
+        width,
+        height,
+        has_motion_video=True,
+        motion_video_offset=motion_video_offset,
+    )
 
 
 def is_video(path):
     try:
-        mime = magic.Magic(mime=True)
-        filename = mime.from_file(path)
-        return filename.find("video") != -1
+        return _get_mime_type(path).find("video") != -1
     except Exception:
         util.logger.error("Error while checking if file is video: %s" % path)
-        raise False
+        return False
 
 
 def is_raw(path):
@@ -130,80 +261,231 @@ def is_metadata(path):
 
 
 def is_valid_media(path):
-    if is_video(path) or is_raw(path) or is_metadata(path):
-        return True
+    return classify_media(path).is_valid
+
+
+def _create_hasher(algorithm):
+    # All digests are 128 bits long
+    if algorithm == "blake2b":
+        return hashlib.blake2b(digest_size=16)
+    if algorithm == "xxh3_128" and xxhash is not None:
+        return xxhash.xxh3_128()
+    if algorithm == "blake3" and blake3 is not None:
+        return blake3.blake3()
+    return hashlib.md5()
+
+
+def _hexdigest(hasher):
+    if blake3 is not None and isinstance(hasher, blake3.blake3):
+        return hasher.hexdigest(length=16)
+    return hasher.hexdigest()
+
+
+def get_hash_algorithm():
+    algorithm = settings.FINGERPRINT_ALGORITHM
+    if (
+        (algorithm == "xxh3_128" and xxhash is None)
+        or (algorithm == "blake3" and blake3 is None)
+        or algorithm not in ["md5", "blake2b", "xxh3_128", "blake3"]
+    ):
+        util.logger.warning(
+            "Hash algorithm {} is not available, falling back to md5".format(algorithm)
+        )
+        return "md5"
+    return algorithm
+
+
+def _hash_content(content, *algorithms):
+    # every algorithm is fed from the same read of the content
+    hashers = [_create_hasher(algorithm) for algorithm in algorithms]
+    for chunk in iter(lambda: content.read(BUFFER_SIZE), b""):
+        for hasher in hashers:
+            hasher.update(chunk)
+    return [_hexdigest(hasher) for hasher in hashers]
+
+
+def remember_hash(path, hash, fingerprint=None, algorithm="md5"):
     try:
-        pyvips.Image.thumbnail(path, 10000, height=200, size=pyvips.enums.Size.DOWN)
-        return True
-    except Exception as e:
-        util.logger.info("Could not handle {}, because {}".format(path, str(e)))
-        return False
+        file_stat = os.stat(path)
+        FileFingerprint.objects.update_or_create(
+            path=path,
+            defaults={
+                "size": file_stat.st_size,
+                "mtime": file_stat.st_mtime_ns,
+                "inode": to_signed_inode(file_stat.st_ino),
+                "algorithm": algorithm,
+                "fingerprint": fingerprint or hash,
+                "hash": hash,
+            },
+        )
+    except IntegrityError:
+        # Another worker fingerprinted the same file at the same time
+        pass
+
+
+def get_content_hash(path):
+    """
+    Returns the md5 hash of the content of the file at *path*, which is part of the
+    image_hash of its photo. The hash is only computed, if size, mtime or inode of the
+    file changed since it was last hashed.
+
+    When these changed, e.g. because the file was touched or copied back from a
+    backup, the fingerprint with the faster FINGERPRINT_ALGORITHM is computed first
+    and md5 only when the content changed as well.
+
+    """
+    file_stat = os.stat(path)
+    fingerprint = FileFingerprint.objects.filter(path=path).first()
+    if fingerprint is not None and fingerprint.matches(file_stat):
+        return fingerprint.hash
+
+    algorithm = get_hash_algorithm()
+    if (
+        fingerprint is not None
+        and algorithm != "md5"
+        and fingerprint.algorithm == algorithm
+    ):
+        with open(path, "rb") as f:
+            [content_fingerprint] = _hash_content(f, algorithm)
+        if content_fingerprint == fingerprint.fingerprint:
+            remember_hash(path, fingerprint.hash, content_fingerprint, algorithm)
+            return fingerprint.hash
+
+    with open(path, "rb") as f:
+        if algorithm == "md5":
+            [hash] = _hash_content(f, "md5")
+            content_fingerprint = hash
+        else:
+            hash, content_fingerprint = _hash_content(f, "md5", algorithm)
+    remember_hash(path, hash, content_fingerprint, algorithm)
+    return hash
 
 
 def calculate_hash(user, path):
     try:
-        hash_md5 = hashlib.md5()
-        with open(path, "rb") as f:
-            for chunk in iter(lambda: f.read(BUFFER_SIZE), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest() + str(user.id)
+        return get_content_hash(path) + str(user.id)
     except Exception as e:
         util.logger.error("Could not calculate hash for file {}".format(path))
         raise e
 
 
 def calculate_hash_b64(user, content):
-    hash_md5 = hashlib.md5()
+    # the frontend checks for existing uploads with the md5 hash as well
     with content as f:
-        for chunk in iter(lambda: f.read(BUFFER_SIZE), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest() + str(user.id)
+        return _hash_content(f, "md5")[0] + str(user.id)
 
 
-def _locate_embedded_video_google(data):
-    signatures = GOOGLE_PIXEL_MOTION_PHOTO_MP4_SIGNATURES
-    for signature in signatures:
-        position = data.find(signature)
-        if position != -1:
-            return position - 4
+def _read_at(image, offset, size):
+    image.seek(offset)
+    return image.read(size)
+
+
+def _locate_motion_video_xmp(image, file_size):
+    head = _read_at(image, 0, MOTION_PHOTO_HEAD_SIZE)
+    lengths = []
+    match = _MICRO_VIDEO_OFFSET.search(head)
+    if match:
+        lengths.append(int(match.group(1)))
+    for item in _CONTAINER_ITEM.findall(head):
+        if b'Mime="video/' in item:
+            match = _ITEM_LENGTH.search(item)
+            if match:
+                lengths.append(int(match.group(1)))
+    for length in lengths:
+        # the video is the last item of the container, its box starts with a size
+        position = file_size - length
+        if 0 < position < file_size and _read_at(image, position + 4, 4) == b"ftyp":
+            return position
     return -1
 
 
-def _locate_embedded_video_samsung(data):
-    position = data.find(SAMSUNG_MOTION_PHOTO_MARKER)
-    if position != -1:
-        return position + len(SAMSUNG_MOTION_PHOTO_MARKER)
+def _locate_motion_video_tail(image, file_size):
+    # a plain jpeg ends with its end of image marker, a motion photo with the video
+    end = _read_at(image, max(0, file_size - 64), 64).rstrip(b"\x00")
+    if end.endswith(JPEG_EOI_MARKER):
+        return -1
+    overlap = max(map(len, MOTION_PHOTO_SIGNATURES))
+    lower_bound = max(0, file_size - MOTION_PHOTO_TAIL_SIZE)
+    chunk_end = file_size
+    while chunk_end > lower_bound:
+        chunk_start = max(lower_bound, chunk_end - BUFFER_SIZE * 16)
+        chunk = _read_at(image, chunk_start, chunk_end - chunk_start + overlap)
+        # the video starts at the signature closest to the end of the file
+        found = -1
+        for signature in GOOGLE_PIXEL_MOTION_PHOTO_MP4_SIGNATURES:
+            position = chunk.rfind(signature)
+            if position != -1 and chunk_start + position >= 4:
+                found = max(found, chunk_start + position - 4)
+        position = chunk.rfind(SAMSUNG_MOTION_PHOTO_MARKER)
+        if position != -1:
+            found = max(
+                found, chunk_start + position + len(SAMSUNG_MOTION_PHOTO_MARKER)
+            )
+        if found != -1:
+            return found
+        chunk_end = chunk_start
     return -1
 
 
+def locate_motion_video(path) -> int:
+    """
+    Returns the offset of the video embedded into a Google or Samsung motion photo,
+    or -1 if there is none.
+
+    The offset is read from the XMP container directory, when the camera wrote one.
+    Otherwise only the end of the file is searched, where the video is appended.
+
+    """
+    with open(str(path), "rb") as image:
+        file_size = os.fstat(image.fileno()).st_size
+        position = _locate_motion_video_xmp(image, file_size)
+        if position == -1:
+            position = _locate_motion_video_tail(image, file_size)
+        return position
+
+
 def has_embedded_media(file: File) -> bool:
-    path = str(file.path)
-    mime = magic.Magic(mime=True)
-    mime_type = mime.from_file(path)
-    if mime_type != "image/jpeg":
-        return False
-    with open(path, "rb") as image:
-        with mmap(image.fileno(), 0, access=ACCESS_READ) as mm:
-            return (
-                _locate_embedded_video_samsung(mm) != -1
-                or _locate_embedded_video_google(mm) != -1
-            )
+    if file.mime_type is not None:
+        return file.has_motion_video
+    return classify_media(file.path).has_motion_video
+
+
+def _copy_range(source, destination, offset, count):
+    # copies inside the kernel, without reading the video into memory
+    try:
+        while count > 0:
+            copied = os.copy_file_range(source, destination, count, offset)
+            if copied == 0:
+                return
+            offset += copied
+            count -= copied
+    except (AttributeError, OSError):
+        while count > 0:
+            copied = os.sendfile(destination, source, offset, count)
+            if copied == 0:
+                return
+            offset += copied
+            count -= copied
+
 
+def extract_embedded_media(file: File, position=None) -> str | None:
+    """
+    Copies the video of a motion photo to the embedded media directory.
 
-def extract_embedded_media(file: File) -> str | None:
-    with open(str(file.path), "rb") as image:
-        with mmap(image.fileno(), 0, access=ACCESS_READ) as mm:
-            position = _locate_embedded_video_google(
-                mm
-            ) or _locate_embedded_video_google(mm)
-            if position == -1:
-                return None
-            output_dir = f"{settings.MEDIA_ROOT}/embedded_media"
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir)
-            output_path = f"{output_dir}/{file.hash}_1.mp4"
-            with open(output_path, "wb+") as video:
-                mm.seek(position)
-                data = mm.read(mm.size())
-                video.write(data)
-            return output_path
+    Args:
+        file: The motion photo.
+        position: The offset of the video, if it was already located by
+            `classify_media`.
+    """
+    if position is None:
+        position = locate_motion_video(file.path)
+    if position == -1:
+        return None
+    output_dir = f"{settings.MEDIA_ROOT}/embedded_media"
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    output_path = f"{output_dir}/{file.hash}_1.mp4"
+    with open(str(file.path), "rb") as image, open(output_path, "wb") as video:
+        file_size = os.fstat(image.fileno()).st_size
+        _copy_range(image.fileno(), video.fileno(), position, file_size - position)
+    return output_path
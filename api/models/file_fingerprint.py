@@ -0,0 +1,33 @@
+from django.db import models
+
+
+class FileFingerprint(models.Model):
+    """
+    Content hash of a file, valid for as long as size, mtime and inode of the file
+    stay the same. Used to avoid rehashing unchanged files.
+
+    `hash` is always md5, because it identifies the photo. `fingerprint` is the hash
+    with `algorithm`, which is only used to check cheaply, whether the content of a
+    file changed together with its size, mtime or inode.
+
+    """
+
+    path = models.TextField(unique=True)
+    size = models.BigIntegerField()
+    mtime = models.BigIntegerField()
+    inode = models.BigIntegerField()
+    algorithm = models.CharField(max_length=16, default="md5")
+    fingerprint = models.CharField(max_length=64, default="")
+    hash = models.CharField(max_length=64)
+
+    def matches(self, file_stat):
+        return (
+            self.size == file_stat.st_size
+            and self.mtime == file_stat.st_mtime_ns
+            and self.inode == to_signed_inode(file_stat.st_ino)
+        )
+
+
+def to_signed_inode(inode):
+    # Some filesystems hand out unsigned 64 bit inodes, which don't fit into a bigint
+    return inode - (1 << 64) if inode >= (1 << 63) else inode
@@ -1,16 +1,21 @@
+import copy
 import json
 import numbers
 import os
+from contextlib import contextmanager
 from fractions import Fraction
 from io import BytesIO
 
 import numpy as np
 import PIL
+import pyvips
 import requests
-from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.files.base import ContentFile
 from django.db import models
 from django.db.models import Q
+from django.db.models.fields.files import FieldFile
 from django.db.utils import IntegrityError
 
 import api.date_time_extractor as date_time_extractor
@@ -22,16 +27,19 @@ from api.geocode import GEOCODE_VERSION
 from api.geocode.geocode import reverse_geocode
 from api.image_captioning import generate_caption
 from api.llm import generate_prompt
+from api.metadata_snapshot import get_metadata
 from api.models.file import File
 from api.models.user import User, get_deleted_user
 from api.thumbnails import (
-    createAnimatedThumbnail,
-    createThumbnail,
-    createThumbnailForVideo,
+    createThumbnails,
+    createVideoThumbnails,
     doesStaticThumbnailExists,
     doesVideoThumbnailExists,
+    dominantColor,
+    probeVideo,
+    thumbnailToArray,
 )
-from api.util import get_metadata, logger
+from api.util import logger
 
 
 class VisiblePhotoManager(models.Manager):
@@ -76,6 +84,8 @@ class Photo(models.Model):
 
     search_captions = models.TextField(blank=True, null=True, db_index=True)
     search_location = models.TextField(blank=True, null=True, db_index=True)
+    # Maintained by a database trigger from search_captions and search_location
+    search_vector = SearchVectorField(blank=True, null=True, editable=False)
 
     timestamp = models.DateTimeField(blank=True, null=True, db_index=True)
     rating = models.IntegerField(default=0, db_index=True)
@@ -84,6 +94,7 @@ class Photo(models.Model):
     hidden = models.BooleanField(default=False, db_index=True)
     video = models.BooleanField(default=False)
     video_length = models.TextField(blank=True, null=True)
+    video_probe = models.JSONField(blank=True, null=True)
     size = models.BigIntegerField(default=0)
     fstop = models.FloatField(blank=True, null=True)
     focal_length = models.FloatField(blank=True, null=True)
@@ -104,16 +115,40 @@ class Photo(models.Model):
     shared_to = models.ManyToManyField(User, related_name="photo_shared_to")
 
     public = models.BooleanField(default=False, db_index=True)
-    clip_embeddings = ArrayField(
-        models.FloatField(blank=True, null=True), size=512, null=True
-    )
-    clip_embeddings_magnitude = models.FloatField(blank=True, null=True)
     last_modified = models.DateTimeField(auto_now=True)
 
     objects = models.Manager()
     visible = VisiblePhotoManager()
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=["search_vector"], name="api_photo_search_vector_idx"),
+            GinIndex(
+                fields=["search_captions"],
+                name="api_photo_search_captions_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+            GinIndex(
+                fields=["search_location"],
+                name="api_photo_search_location_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ]
+
     _loaded_values = {}
+    _commit_deferred = False
+
+    # Fields which are written back to the media file or its sidecar, see _save_metadata
+    METADATA_FIELDS = ["rating", "timestamp"]
+
+    @staticmethod
+    def _snapshot_value(value):
+        # FieldFile and JSON values are mutated in place, so compare against a copy
+        if isinstance(value, FieldFile):
+            return value.name
+        if isinstance(value, (dict, list)):
+            return copy.deepcopy(value)
+        return value
 
     @classmethod
     def from_db(cls, db, field_names, values):
@@ -121,10 +156,45 @@ class Photo(models.Model):
 
         # save original values, when model is loaded from database,
         # in a separate attribute on the model
-        instance._loaded_values = dict(zip(field_names, values))
+        instance._loaded_values = {
+            field_name: cls._snapshot_value(value)
+            for field_name, value in zip(field_names, values)
+        }
 
         return instance
 
+    def _get_dirty_fields(self):
+        dirty_fields = []
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname not in self.__dict__:
+                continue
+            if field.attname not in self._loaded_values:
+                # was deferred when loading, but has been set since
+                dirty_fields.append(field.attname)
+            elif self._loaded_values[field.attname] != self._snapshot_value(
+                getattr(self, field.attname)
+            ):
+                dirty_fields.append(field.attname)
+        return dirty_fields
+
+    def _remember_loaded_values(self, field_names=None):
+        if field_names is None:
+            self._loaded_values = {
+                field.attname: self._snapshot_value(getattr(self, field.attname))
+                for field in self._meta.concrete_fields
+                if field.attname in self.__dict__
+            }
+            return
+        loaded_values = dict(self._loaded_values)
+        for field_name in field_names:
+            attname = self._meta.get_field(field_name).attname
+            loaded_values[attname] = self._snapshot_value(getattr(self, attname))
+        self._loaded_values = loaded_values
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self._remember_loaded_values(fields)
+
     def save(
         self,
         force_insert=False,
@@ -133,23 +203,60 @@ class Photo(models.Model):
         update_fields=None,
         save_metadata=True,
     ):
+        if self._commit_deferred:
+            return
+        dirty_fields = self._get_dirty_fields() if self._loaded_values else []
         modified_fields = [
             field_name
-            for field_name, value in self._loaded_values.items()
-            if value != getattr(self, field_name)
+            for field_name in dirty_fields
+            if field_name in self.METADATA_FIELDS
         ]
-        user = User.objects.get(username=self.owner)
-        if save_metadata and user.save_metadata_to_disk != User.SaveMetadata.OFF:
-            self._save_metadata(
-                modified_fields,
-                user.save_metadata_to_disk == User.SaveMetadata.SIDECAR_FILE,
+        if save_metadata and modified_fields:
+            save_metadata_to_disk = self.owner.save_metadata_to_disk
+            if save_metadata_to_disk != User.SaveMetadata.OFF:
+                self._save_metadata(
+                    modified_fields,
+                    save_metadata_to_disk == User.SaveMetadata.SIDECAR_FILE,
+                )
+        if (
+            update_fields is None
+            and not force_insert
+            and not self._state.adding
+            and self._loaded_values
+        ):
+            # Only write the columns which changed since the photo was loaded or saved
+            if not dirty_fields:
+                return
+            result = super().save(
+                force_update=force_update,
+                using=using,
+                update_fields=dirty_fields + ["last_modified"],
             )
-        return super().save(
+            self._remember_loaded_values()
+            return result
+
+        result = super().save(
             force_insert=force_insert,
             force_update=force_update,
             using=using,
             update_fields=update_fields,
         )
+        self._remember_loaded_values(update_fields)
+        return result
+
+    @contextmanager
+    def deferred_commit(self):
+        """
+        Collects the changes of all saves within the context and writes them
+        with a single UPDATE, when the context is left.
+
+        """
+        self._commit_deferred = True
+        try:
+            yield self
+        finally:
+            self._commit_deferred = False
+            self.save(save_metadata=False)
 
     def _save_metadata(self, modified_fields=None, use_sidecar=True):
         tags_to_write = {}
@@ -281,11 +388,13 @@ class Photo(models.Model):
             user_caption = self.captions_json.get("user_caption", "")
             search_captions += user_caption + " "
 
-        for face in api.models.face.Face.objects.filter(photo=self).all():
-            search_captions += face.person.name + " "
+        for name in api.models.face.Face.objects.filter(
+            photo=self, person__isnull=False
+        ).values_list("person__name", flat=True):
+            search_captions += name + " "
 
-        for file in self.files.all():
-            search_captions += file.path + " "
+        for path in self.files.values_list("path", flat=True):
+            search_captions += path + " "
 
         if self.video:
             search_captions += "type: video "
@@ -372,65 +481,51 @@ class Photo(models.Model):
             raise e
 
     def _generate_thumbnail(self, commit=True):
-        try:
-            if not doesStaticThumbnailExists("thumbnails_big", self.image_hash):
-                if not self.video:
-                    createThumbnail(
-                        inputPath=self.main_file.path,
-                        outputHeight=1080,
-                        outputPath="thumbnails_big",
-                        hash=self.image_hash,
-                        fileType=".webp",
-                    )
-                else:
-                    createThumbnailForVideo(
-                        inputPath=self.main_file.path,
-                        outputPath="thumbnails_big",
-                        hash=self.image_hash,
-                        fileType=".webp",
-                    )
-
-            if not self.video and not doesStaticThumbnailExists(
-                "square_thumbnails", self.image_hash
-            ):
-                createThumbnail(
-                    inputPath=self.main_file.path,
-                    outputHeight=500,
-                    outputPath="square_thumbnails",
-                    hash=self.image_hash,
-                    fileType=".webp",
-                )
-            if self.video and not doesVideoThumbnailExists(
-                "square_thumbnails", self.image_hash
-            ):
-                createAnimatedThumbnail(
-                    inputPath=self.main_file.path,
-                    outputHeight=500,
-                    outputPath="square_thumbnails",
-                    hash=self.image_hash,
-                    fileType=".mp4",
-                )
+        """
+        Creates all missing thumbnails and returns the newly created static thumbnails
+        as dict of output path to in-memory pyvips image.
 
-            if not self.video and not doesStaticThumbnailExists(
-                "square_thumbnails_small", self.image_hash
-            ):
-                createThumbnail(
+        """
+        thumbnails = {}
+        try:
+            if not self.video:
+                missing_thumbnails = [
+                    (outputPath, outputHeight)
+                    for outputPath, outputHeight in [
+                        ("thumbnails_big", 1080),
+                        ("square_thumbnails", 500),
+                        ("square_thumbnails_small", 250),
+                    ]
+                    if not doesStaticThumbnailExists(outputPath, self.image_hash)
+                ]
+                thumbnails = createThumbnails(
                     inputPath=self.main_file.path,
-                    outputHeight=250,
-                    outputPath="square_thumbnails_small",
+                    outputs=missing_thumbnails,
                     hash=self.image_hash,
                     fileType=".webp",
                 )
-            if self.video and not doesVideoThumbnailExists(
-                "square_thumbnails_small", self.image_hash
-            ):
-                createAnimatedThumbnail(
+            else:
+                createVideoThumbnails(
                     inputPath=self.main_file.path,
-                    outputHeight=250,
-                    outputPath="square_thumbnails_small",
                     hash=self.image_hash,
-                    fileType=".mp4",
+                    stillOutputPath=(
+                        None
+                        if doesStaticThumbnailExists("thumbnails_big", self.image_hash)
+                        else "thumbnails_big"
+                    ),
+                    animatedOutputs=[
+                        (outputPath, outputHeight)
+                        for outputPath, outputHeight in [
+                            ("square_thumbnails", 500),
+                            ("square_thumbnails_small", 250),
+                        ]
+                        if not doesVideoThumbnailExists(outputPath, self.image_hash)
+                    ],
                 )
+                if self.video_probe is None:
+                    self.video_probe = probeVideo(self.main_file.path)
+                    if self.video_probe and self.video_probe["duration"]:
+                        self.video_length = self.video_probe["duration"]
             filetype = ".webp"
             if self.video:
                 filetype = ".mp4"
@@ -445,6 +540,7 @@ class Photo(models.Model):
             ).strip()
             if commit:
                 self.save()
+            return thumbnails
         except Exception as e:
             util.logger.exception(
                 "could not generate thumbnail for image %s" % self.main_file.path
@@ -482,14 +578,14 @@ class Photo(models.Model):
                 old_album_date = possible_old_album_date
         return old_album_date
 
-    def _calculate_aspect_ratio(self, commit=True):
+    def _calculate_aspect_ratio(self, commit=True, thumbnail=None):
         try:
-            # Relies on big thumbnail for correct aspect ratio, which is weird
-            height, width = get_metadata(
-                self.thumbnail_big.path,
-                tags=[Tags.IMAGE_HEIGHT, Tags.IMAGE_WIDTH],
-                try_sidecar=False,
-            )
+            if thumbnail is not None:
+                height, width = thumbnail.height, thumbnail.width
+            else:
+                # Relies on big thumbnail for correct aspect ratio, which is weird
+                thumbnail = pyvips.Image.new_from_file(self.thumbnail_big.path)
+                height, width = thumbnail.height, thumbnail.width
             self.aspect_ratio = round(width / height, 2)
 
             if commit:
@@ -684,13 +780,20 @@ class Photo(models.Model):
             self.subjectDistance = subjectDistance
         if digitalZoomRatio and isinstance(digitalZoomRatio, numbers.Number):
             self.digitalZoomRatio = digitalZoomRatio
-        if video_length and isinstance(video_length, numbers.Number):
+        # ffprobe reads the duration of the video stream itself, prefer it over the container tag
+        has_probed_duration = self.video_probe and self.video_probe.get("duration")
+        if (
+            video_length
+            and isinstance(video_length, numbers.Number)
+            and not has_probed_duration
+        ):
             self.video_length = video_length
         if rating and isinstance(rating, numbers.Number):
             self.rating = rating
 
         if commit:
-            self.save()
+            # the values were just read from the file, no need to write them back
+            self.save(save_metadata=False)
 
     def _extract_faces(self, second_try=False):
         unknown_cluster: api.models.cluster.Cluster = (
@@ -806,32 +909,32 @@ class Photo(models.Model):
                     album_thing.save()
 
     def _check_files(self):
-        for file in self.files.all():
-            if not file.path or not os.path.exists(file.path):
-                self.files.remove(file)
-                file.missing = True
-                file.save()
-        self.save()
+        missing_files = [
+            file
+            for file in self.files.all()
+            if not file.path or not os.path.exists(file.path)
+        ]
+        if not missing_files:
+            return
+        self.files.remove(*missing_files)
+        File.objects.filter(hash__in=[file.hash for file in missing_files]).update(
+            missing=True
+        )
+        # the file set is not a column, so saving the photo only updates last_modified
+        self.save(update_fields=["last_modified"])
 
-    def _get_dominant_color(self, palette_size=16):
+    def _get_dominant_color(self, commit=True, thumbnail=None):
         # Skip if it's already calculated
         if self.dominant_color:
             return
         try:
-            # Resize image to speed up processing
-            img = PIL.Image.open(self.square_thumbnail_small.path)
-            img.thumbnail((100, 100))
-
-            # Reduce colors (uses k-means internally)
-            paletted = img.convert("P", palette=PIL.Image.ADAPTIVE, colors=palette_size)
-
-            # Find the color that occurs most often
-            palette = paletted.getpalette()
-            color_counts = sorted(paletted.getcolors(), reverse=True)
-            palette_index = color_counts[0][1]
-            dominant_color = palette[palette_index * 3 : palette_index * 3 + 3]
-            self.dominant_color = dominant_color
-            self.save()
+            if thumbnail is None:
+                thumbnail = pyvips.Image.thumbnail(
+                    self.square_thumbnail_small.path, 100
+                )
+            self.dominant_color = dominantColor(thumbnailToArray(thumbnail))
+            if commit:
+                self.save()
         except Exception:
             logger.info("Cannot calculate dominant color {} object".format(self))
 
@@ -0,0 +1,104 @@
+from itertools import islice
+
+import numpy as np
+from django.db import models
+
+from api.models.photo import Photo
+
+FLOAT32 = "<f4"
+FLOAT16 = "<f2"
+
+
+class PhotoEmbedding(models.Model):
+    """
+    CLIP embedding of a photo, stored as raw little-endian float32 or float16 vector
+    together with the version of the model, which calculated it.
+
+    """
+
+    DTYPE_CHOICES = (
+        (FLOAT32, "float32"),
+        (FLOAT16, "float16"),
+    )
+
+    photo = models.OneToOneField(
+        Photo, on_delete=models.CASCADE, primary_key=True, related_name="embedding"
+    )
+    model_version = models.CharField(max_length=64, db_index=True)
+    dtype = models.CharField(max_length=3, choices=DTYPE_CHOICES, default=FLOAT32)
+    vector = models.BinaryField()
+    magnitude = models.FloatField()
+
+    def to_array(self):
+        return np.frombuffer(self.vector, dtype=self.dtype)
+
+
+def save_embeddings(photos, embeddings, magnitudes, model_version, dtype=FLOAT32):
+    """
+    Inserts or replaces the embeddings of *photos* with a single statement.
+
+    """
+    PhotoEmbedding.objects.bulk_create(
+        [
+            PhotoEmbedding(
+                photo_id=photo.image_hash,
+                model_version=model_version,
+                dtype=dtype,
+                vector=np.asarray(embedding, dtype=dtype).tobytes(),
+                magnitude=float(magnitude),
+            )
+            for photo, embedding, magnitude in zip(photos, embeddings, magnitudes)
+        ],
+        update_conflicts=True,
+        unique_fields=["photo"],
+        update_fields=["model_version", "dtype", "vector", "magnitude"],
+    )
+
+
+def load_embeddings(owner, model_version=None, image_hashes=None, chunk_size=10000):
+    """
+    Streams the embeddings of the visible photos of *owner*, or only those of
+    *image_hashes*, into one preallocated float32 matrix. They are fetched from a
+    server side cursor and converted in chunks of *chunk_size*.
+
+    Returns the image hashes and the matrix with one row per image hash.
+
+    """
+    embeddings = PhotoEmbedding.objects.filter(
+        photo__owner=owner, photo__hidden=False
+    ).order_by("photo_id")
+    if model_version is not None:
+        embeddings = embeddings.filter(model_version=model_version)
+    if image_hashes is not None:
+        embeddings = embeddings.filter(photo_id__in=image_hashes)
+
+    count = embeddings.count()
+    rows = embeddings.values_list("photo_id", "vector", "dtype").iterator(
+        chunk_size=chunk_size
+    )
+    loaded_hashes = []
+    matrix = None
+    # photos added while streaming are left for the next load
+    while len(loaded_hashes) < count:
+        chunk = list(islice(rows, min(chunk_size, count - len(loaded_hashes))))
+        if not chunk:
+            break
+        hashes, vectors, dtypes = zip(*chunk)
+        if matrix is None:
+            size = len(vectors[0]) // np.dtype(dtypes[0]).itemsize
+            matrix = np.empty((count, size), dtype=np.float32)
+        offset = len(loaded_hashes)
+        if len(set(dtypes)) == 1:
+            # one conversion per chunk instead of one per vector
+            matrix[offset : offset + len(chunk)] = np.frombuffer(
+                b"".join(vectors), dtype=dtypes[0]
+            ).reshape(len(chunk), -1)
+        else:
+            for row, (vector, dtype) in enumerate(zip(vectors, dtypes)):
+                matrix[offset + row] = np.frombuffer(vector, dtype=dtype)
+        loaded_hashes.extend(hashes)
+    rows.close()
+
+    if matrix is None:
+        return [], np.empty((0, 0), dtype=np.float32)
+    return loaded_hashes, matrix[: len(loaded_hashes)]
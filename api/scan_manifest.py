@@ -0,0 +1,95 @@
+import json
+import os
+
+from django.conf import settings
+
+import api.util as util
+from api.models.file import is_metadata
+from api.sidecar_index import SidecarIndex
+
+
+def _is_below(path, root):
+    if not root:
+        return True
+    return path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+class ScanManifest:
+    """
+    Remembers (size, mtime, inode) of every file seen by the last directory scan of a user,
+    so that a rescan only has to process files which were added, changed or removed since then.
+
+    """
+
+    def __init__(self, user_id, entries=None):
+        self.user_id = user_id
+        self.entries = entries if entries is not None else {}
+
+    @staticmethod
+    def get_path(user_id):
+        return os.path.join(settings.MEDIA_ROOT, "scan_manifests", f"{user_id}.json")
+
+    @classmethod
+    def load(cls, user):
+        path = cls.get_path(user.id)
+        if not os.path.exists(path):
+            return cls(user.id)
+        try:
+            with open(path, "r") as f:
+                entries = {
+                    file_path: tuple(stat) for file_path, stat in json.load(f).items()
+                }
+            return cls(user.id, entries)
+        except Exception:
+            util.logger.exception("Could not read scan manifest {}".format(path))
+            return cls(user.id)
+
+    def save(self):
+        path = self.get_path(self.user_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first, so a crash never leaves a truncated manifest
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.entries, f)
+        os.replace(path + ".tmp", path)
+
+    def diff(self, found_files, root=""):
+        """
+        Compares *found_files*, a dict of path to (size, mtime, inode) produced by a walk of
+        *root*, with the manifest.
+
+        Returns the sets of added, changed and removed paths. Media files are reported as
+        changed when one of their XMP sidecar files was added or changed.
+
+        """
+        added = set()
+        changed = set()
+        for path, stat in found_files.items():
+            known = self.entries.get(path)
+            if known is None:
+                added.add(path)
+            elif tuple(known) != tuple(stat):
+                changed.add(path)
+
+        modified_sidecars = [path for path in added | changed if is_metadata(path)]
+        if modified_sidecars:
+            sidecar_index = SidecarIndex(found_files.keys())
+            for sidecar in modified_sidecars:
+                for path in sidecar_index.get_media_files(sidecar):
+                    if path not in added:
+                        changed.add(path)
+
+        removed = {
+            path
+            for path in self.entries.keys()
+            if _is_below(path, root) and path not in found_files
+        }
+        return added, changed, removed
+
+    def update(self, found_files, root=""):
+        """Replaces all entries below *root* with *found_files*."""
+        self.entries = {
+            path: stat
+            for path, stat in self.entries.items()
+            if not _is_below(path, root)
+        }
+        self.entries.update(found_files)
@@ -0,0 +1,137 @@
+import os
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, Q, TextField, Value
+from django.db.models.functions import Replace
+from django.db.models.lookups import Contains
+
+import api.util as util
+from api.models import Photo
+
+# Captions mix names, paths and camera models, which must not be stemmed
+SEARCH_CONFIG = "simple"
+
+# Shorter terms have no trigram, so they can only use the search vector
+TRIGRAM_MIN_LENGTH = 3
+
+_WORD = re.compile(r"\w+")
+_DATE_TERM = re.compile(r"^[\d\-: ]+$")
+
+
+@TextField.register_lookup
+class ILikeContains(Contains):
+    """
+    Case insensitive substring match, which compiles to `column ILIKE %s`.
+
+    Unlike `icontains`, which compares `UPPER(column::text)`, it can be answered by
+    a gin_trgm_ops index of the column.
+
+    """
+
+    lookup_name = "ilike_contains"
+
+    def get_rhs_op(self, connection, rhs):
+        return "ILIKE %s" % rhs
+
+
+def build_search_query(term):
+    """
+    Returns a query, which matches every word of *term* as prefix of a word in the
+    search vector, or None if *term* has no words.
+
+    """
+    words = _WORD.findall(term.lower())
+    if not words:
+        return None
+    return SearchQuery(
+        " & ".join("{}:*".format(word) for word in words),
+        search_type="raw",
+        config=SEARCH_CONFIG,
+    )
+
+
+def search_photos(queryset, search_terms, extra_condition=None):
+    """
+    Filters *queryset* to the photos, which match all *search_terms*, and annotates
+    them with `search_rank`.
+
+    A term matches the search vector, or as substring the captions and the location,
+    which is answered by the trigram indexes. Terms, which look like a date, also match
+    the timestamp.
+
+    Args:
+        queryset: The photos to search.
+        search_terms: The terms, which all have to match.
+        extra_condition: A Q object, which is enough for a term to match, e.g. the
+            results of the semantic search.
+    """
+    conditions = []
+    queries = []
+    for term in search_terms:
+        query = build_search_query(term)
+        matches = []
+        if query is not None:
+            matches.append(Q(search_vector=query))
+            queries.append(query)
+        if len(term) >= TRIGRAM_MIN_LENGTH:
+            matches.append(Q(search_captions__ilike_contains=term))
+            matches.append(Q(search_location__ilike_contains=term))
+        if _DATE_TERM.match(term):
+            matches.append(Q(exif_timestamp__icontains=term))
+        if extra_condition is not None:
+            matches.append(extra_condition)
+        if not matches:
+            return queryset.none()
+        condition = matches[0]
+        for match in matches[1:]:
+            condition |= match
+        conditions.append(condition)
+
+    for condition in conditions:
+        queryset = queryset.filter(condition)
+
+    if queries:
+        combined = queries[0]
+        for query in queries[1:]:
+            combined &= query
+        queryset = queryset.annotate(
+            search_rank=SearchRank(F("search_vector"), combined)
+        )
+    else:
+        queryset = queryset.annotate(search_rank=Value(0.0))
+    return queryset
+
+
+def recreate_search_captions(image_hashes):
+    """
+    Rebuilds the search captions and with them the search vector of the photos of
+    *image_hashes*, after one of their inputs, e.g. the name of a person, changed.
+    It runs as a task, so that a person with many photos does not block a request.
+
+    """
+    count = 0
+    for photo in Photo.objects.filter(image_hash__in=image_hashes).iterator():
+        photo._recreate_search_captions()
+        count += 1
+    util.logger.info("recreated search captions of {} photos".format(count))
+    return count
+
+
+def move_search_paths(source, destination):
+    """
+    Replaces *source* with *destination* in the search captions of the photos, whose
+    files were moved, with a single UPDATE.
+
+    """
+    if os.path.isdir(destination):
+        # a moved directory must not rename its siblings, which share the prefix
+        source = source.rstrip(os.sep) + os.sep
+        destination = destination.rstrip(os.sep) + os.sep
+        moved = Q(files__path__startswith=destination)
+    else:
+        moved = Q(files__path=destination)
+    photo_ids = Photo.objects.filter(moved).values("image_hash").distinct()
+    return Photo.objects.filter(image_hash__in=photo_ids).update(
+        search_captions=Replace("search_captions", Value(source), Value(destination))
+    )
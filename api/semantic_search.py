@@ -4,15 +4,60 @@ from django.conf import settings
 
 dir_clip_ViT_B_32_model = settings.CLIP_ROOT
 
+# Stored with every embedding, embeddings of other versions are calculated again
+CLIP_MODEL_VERSION = "clip-ViT-B-32"
+
+
+# Embeddings are received as .npy file, see service/clip_embeddings/main.py
+NPY_MEDIA_TYPE = "application/x-npy"
+
+
+def read_npy(stream):
+    """
+    Reads an array in .npy format from *stream* straight into its buffer, so the
+    array shares it instead of being copied or parsed.
+
+    """
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    if fortran_order:
+        raise ValueError("Fortran ordered arrays are not supported")
+
+    buffer = bytearray(int(np.prod(shape)) * dtype.itemsize)
+    view = memoryview(buffer)
+    offset = 0
+    while offset < len(buffer):
+        read = stream.readinto(view[offset:])
+        if not read:
+            raise ValueError(
+                "Array is truncated after {} of {} bytes".format(offset, len(buffer))
+            )
+        offset += read
+    return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
 
 def create_clip_embeddings(imgs):
     json = {
         "imgs": imgs,
         "model": dir_clip_ViT_B_32_model,
+        "dtype": "float32",
     }
-    clip_embeddings = requests.post(
-        "http://localhost:8006/clip-embeddings", json=json
-    ).json()
+    with requests.post(
+        "http://localhost:8006/clip-embeddings",
+        json=json,
+        headers={"Accept": NPY_MEDIA_TYPE},
+        stream=True,
+    ) as response:
+        if response.headers.get("Content-Type", "").startswith(NPY_MEDIA_TYPE):
+            imgs_emb = read_npy(response.raw)
+            magnitudes = np.linalg.norm(imgs_emb, axis=1).tolist()
+            return imgs_emb, magnitudes
+
+        # Older services only answer with JSON
+        clip_embeddings = response.json()
 
     imgs_emb = clip_embeddings["imgs_emb"]
     magnitudes = clip_embeddings["magnitudes"]
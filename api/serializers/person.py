@@ -1,7 +1,9 @@
 from django.db.models import Q
+from django_q.tasks import AsyncTask
 from rest_framework import serializers
 
 from api.models import Person, Photo
+from api.search_index import recreate_search_captions
 from api.serializers.photos import GroupedPhotosSerializer
 from api.serializers.PhotosGroupedByDate import get_photos_ordered_by_date
 from api.util import logger
@@ -92,6 +94,12 @@ class PersonSerializer(serializers.ModelSerializer):
             new_name = validated_data.pop("newPersonName")
             instance.name = new_name
             instance.save()
+            image_hashes = (
+                Photo.objects.filter(faces__person=instance)
+                .values_list("image_hash", flat=True)
+                .distinct()
+            )
+            AsyncTask(recreate_search_captions, list(image_hashes)).run()
             return instance
         if "cover_photo" in validated_data.keys():
             image_hash = validated_data.pop("cover_photo")
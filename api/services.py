@@ -6,6 +6,7 @@ import requests
 from django.db.models import Q
 from django.utils import timezone
 
+from api.image_similarity import remove_from_image_similarity_index
 from api.models import Photo
 from api.util import logger
 
@@ -107,4 +108,5 @@ def cleanup_deleted_photos():
         Q(removed=True) & Q(last_modified__gte=timezone.now() - timedelta(days=30))
     )
     for photo in deleted_photos:
+        remove_from_image_similarity_index(photo.owner, [photo.image_hash])
         photo.delete()
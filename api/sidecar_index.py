@@ -0,0 +1,81 @@
+import os
+
+import api.util as util
+
+
+def _is_sidecar(path):
+    return os.path.splitext(path)[1].lower() == ".xmp"
+
+
+def _list_directory(directory):
+    try:
+        return [os.path.join(directory, name) for name in os.listdir(directory)]
+    except OSError:
+        return []
+
+
+class SidecarIndex:
+    """
+    Sidecar files of the media files in a directory listing, found by their names only,
+    so neither the filesystem nor the database has to be asked for them.
+
+    """
+
+    def __init__(self, paths=()):
+        self.paths = set(paths)
+        self.sidecars = {}
+        self.media_files = {}
+        sidecars = {path for path in self.paths if _is_sidecar(path)}
+        # "photo.xmp" belongs to "photo.jpg" and "photo.jpg.xmp" to "photo.jpg"
+        stems = {os.path.splitext(sidecar)[0] for sidecar in sidecars}
+        for path in self.paths:
+            if path in sidecars or (
+                os.path.splitext(path)[0] not in stems and path not in stems
+            ):
+                continue
+            existing = [
+                sidecar
+                for sidecar in util.get_sidecar_files_in_priority_order(path)
+                if sidecar in sidecars
+            ]
+            if existing:
+                self.sidecars[path] = existing
+                for sidecar in existing:
+                    self.media_files.setdefault(sidecar, []).append(path)
+
+    def get_sidecars(self, path):
+        """Returns the sidecar files of the media file *path* in priority order."""
+        return self.sidecars.get(path, [])
+
+    def get_media_files(self, sidecar):
+        """Returns the media files, which use *sidecar*."""
+        return self.media_files.get(sidecar, [])
+
+    def sidecars_by_file(self, paths):
+        """Returns the sidecar files of every media file in *paths*, see `use_sidecars`."""
+        return {
+            path: self.get_sidecars(path) for path in paths if not _is_sidecar(path)
+        }
+
+    def subset(self, paths):
+        """
+        Returns an index of *paths* and the files these belong to or use, which is small
+        enough to be handed to a task.
+
+        """
+        related = set(paths)
+        for path in paths:
+            related.update(self.get_media_files(path))
+        for path in list(related):
+            related.update(self.get_sidecars(path))
+        return SidecarIndex(related)
+
+    @classmethod
+    def from_directory(cls, directory):
+        return cls(_list_directory(directory))
+
+    @classmethod
+    def from_directories(cls, directories):
+        return cls(
+            path for directory in directories for path in _list_directory(directory)
+        )
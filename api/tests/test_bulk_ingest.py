@@ -0,0 +1,63 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+import pyvips
+from django.test import TestCase
+
+from api.directory_watcher import create_new_images, ingest_new_files
+from api.models import File, Photo
+from api.models.file import calculate_hash
+from api.tests.utils import ONE_PIXEL_PNG, create_test_user
+
+
+class BulkIngestTest(TestCase):
+    def setUp(self):
+        self.user = create_test_user()
+        self.directory = tempfile.mkdtemp()
+
+    def create_file(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path, calculate_hash(self.user, path)
+
+    def test_should_create_photos_with_files(self):
+        hashed_paths = [
+            self.create_file("a.png", ONE_PIXEL_PNG),
+            self.create_file("b.png", ONE_PIXEL_PNG + b"\x00"),
+        ]
+
+        photos = create_new_images(self.user, hashed_paths, batch_size=1)
+
+        self.assertEqual(2, len(photos))
+        for path, hash in hashed_paths:
+            photo = Photo.objects.get(image_hash=hash)
+            self.assertEqual(self.user, photo.owner)
+            self.assertEqual(path, photo.main_file.path)
+            self.assertEqual(File.IMAGE, photo.main_file.type)
+            self.assertEqual([hash], list(photo.files.values_list("hash", flat=True)))
+
+    def test_should_add_duplicates_to_existing_photo(self):
+        first = self.create_file("a.png", ONE_PIXEL_PNG)
+        create_new_images(self.user, [first])
+        second = self.create_file("b.png", ONE_PIXEL_PNG)
+        third = self.create_file("c.png", ONE_PIXEL_PNG)
+
+        photos = create_new_images(self.user, [second, third])
+
+        self.assertEqual([], photos)
+        self.assertEqual(1, Photo.objects.filter(owner=self.user).count())
+
+    @patch("api.directory_watcher.calculate_hash", side_effect=OSError)
+    def test_should_return_files_which_failed_to_ingest(self, calculate_hash_mock):
+        image, _ = self.create_file(
+            "a.png", pyvips.Image.black(1, 1).write_to_buffer(".png")
+        )
+        notes = os.path.join(self.directory, "notes.txt")
+        with open(notes, "w") as f:
+            f.write("no photo")
+
+        failed_paths = ingest_new_files(self.user, [image, notes], "job")
+
+        self.assertEqual([image], failed_paths)
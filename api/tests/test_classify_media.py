@@ -0,0 +1,60 @@
+import os
+import tempfile
+
+import pyvips
+from django.test import TestCase
+
+from api.models import File
+from api.models.file import classify_media
+from api.tests.utils import create_test_user
+
+
+class ClassifyMediaTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def create_file(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def create_image(self, name, width, height):
+        return self.create_file(
+            name, pyvips.Image.black(width, height).write_to_buffer(".png")
+        )
+
+    def test_should_read_dimensions_of_image(self):
+        path = self.create_image("image.png", 3, 2)
+
+        actual = classify_media(path)
+
+        self.assertEqual("image/png", actual.mime)
+        self.assertEqual(File.IMAGE, actual.kind)
+        self.assertEqual((3, 2), (actual.width, actual.height))
+        self.assertTrue(actual.is_valid)
+        self.assertFalse(actual.has_motion_video)
+
+    def test_should_classify_sidecar_as_metadata(self):
+        path = self.create_file("image.xmp", b"<x:xmpmeta></x:xmpmeta>")
+
+        actual = classify_media(path)
+
+        self.assertEqual(File.METADATA_FILE, actual.kind)
+        self.assertTrue(actual.is_valid)
+
+    def test_should_report_unreadable_image_as_invalid(self):
+        path = self.create_file("image.jpg", b"\x13\x37\xc0\xde")
+
+        actual = classify_media(path)
+
+        self.assertFalse(actual.is_valid)
+
+    def test_should_store_result_on_file(self):
+        path = self.create_image("image.png", 3, 2)
+
+        file = File.create(path, create_test_user())
+
+        self.assertEqual(File.IMAGE, file.type)
+        self.assertEqual("image/png", file.mime_type)
+        self.assertEqual((3, 2), (file.width, file.height))
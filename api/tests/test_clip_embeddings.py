@@ -0,0 +1,76 @@
+import io
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from django.test import TestCase
+
+from api.semantic_search import NPY_MEDIA_TYPE, create_clip_embeddings, read_npy
+
+
+def npy_response(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    buffer.seek(0)
+    response = MagicMock()
+    response.__enter__.return_value = response
+    response.headers = {"Content-Type": NPY_MEDIA_TYPE}
+    response.raw = buffer
+    return response
+
+
+class ReadNpyTest(TestCase):
+    def test_should_read_array(self):
+        expected = np.arange(6, dtype=np.float16).reshape(2, 3)
+        buffer = io.BytesIO()
+        np.save(buffer, expected)
+        buffer.seek(0)
+
+        actual = read_npy(buffer)
+
+        self.assertEqual(np.float16, actual.dtype)
+        np.testing.assert_array_equal(expected, actual)
+
+    def test_should_fail_on_truncated_array(self):
+        buffer = io.BytesIO()
+        np.save(buffer, np.ones((4, 512), dtype=np.float32))
+
+        with self.assertRaises(ValueError):
+            read_npy(io.BytesIO(buffer.getvalue()[:-4]))
+
+
+class CreateClipEmbeddingsTest(TestCase):
+    @patch("api.semantic_search.requests.post")
+    def test_should_decode_binary_embeddings(self, post):
+        expected = np.array([[3.0, 4.0], [0.0, 2.0]], dtype=np.float32)
+        post.return_value = npy_response(expected)
+
+        imgs_emb, magnitudes = create_clip_embeddings(["a.jpg", "b.jpg"])
+
+        self.assertEqual(NPY_MEDIA_TYPE, post.call_args.kwargs["headers"]["Accept"])
+        np.testing.assert_array_equal(expected, imgs_emb)
+        self.assertEqual([5.0, 2.0], magnitudes)
+
+    @patch("api.semantic_search.requests.post")
+    def test_should_keep_rows_of_unreadable_images(self, post):
+        post.return_value = npy_response(
+            np.array([[np.nan, np.nan], [3.0, 4.0]], dtype=np.float32)
+        )
+
+        imgs_emb, magnitudes = create_clip_embeddings(["broken.jpg", "b.jpg"])
+
+        self.assertEqual(2, len(imgs_emb))
+        self.assertFalse(magnitudes[0] > 0)
+        self.assertEqual(5.0, magnitudes[1])
+
+    @patch("api.semantic_search.requests.post")
+    def test_should_accept_json_embeddings(self, post):
+        response = MagicMock()
+        response.__enter__.return_value = response
+        response.headers = {"Content-Type": "application/json"}
+        response.json.return_value = {"imgs_emb": [[1.0, 0.0]], "magnitudes": [1.0]}
+        post.return_value = response
+
+        imgs_emb, magnitudes = create_clip_embeddings(["a.jpg"])
+
+        np.testing.assert_array_equal([1.0, 0.0], imgs_emb[0])
+        self.assertEqual([1.0], magnitudes)
@@ -0,0 +1,90 @@
+import hashlib
+import io
+import os
+import tempfile
+from unittest.mock import ANY, patch
+
+from django.test import TestCase, override_settings
+
+from api.models import FileFingerprint
+from api.models.file import _hash_content, calculate_hash, calculate_hash_b64
+from api.tests.utils import create_test_user
+
+
+class FileFingerprintTest(TestCase):
+    def setUp(self):
+        self.user = create_test_user()
+        self.path = os.path.join(tempfile.mkdtemp(), "photo.jpg")
+        self.write(b"content")
+
+    def write(self, content):
+        with open(self.path, "wb") as f:
+            f.write(content)
+
+    def test_should_calculate_md5_hash_with_user_id(self):
+        actual = calculate_hash(self.user, self.path)
+
+        expected = hashlib.md5(b"content").hexdigest() + str(self.user.id)
+        self.assertEqual(expected, actual)
+
+    def test_should_not_rehash_unchanged_file(self):
+        calculate_hash(self.user, self.path)
+
+        with patch("api.models.file._hash_content") as hash_content_mock:
+            calculate_hash(self.user, self.path)
+            hash_content_mock.assert_not_called()
+
+    def test_should_rehash_changed_file(self):
+        calculate_hash(self.user, self.path)
+        self.write(b"changed content")
+
+        actual = calculate_hash(self.user, self.path)
+
+        expected = hashlib.md5(b"changed content").hexdigest() + str(self.user.id)
+        self.assertEqual(expected, actual)
+        self.assertEqual(1, FileFingerprint.objects.filter(path=self.path).count())
+
+    @override_settings(FINGERPRINT_ALGORITHM="blake2b")
+    def test_should_keep_md5_as_hash_with_other_algorithm(self):
+        actual = calculate_hash(self.user, self.path)
+
+        expected = hashlib.md5(b"content").hexdigest() + str(self.user.id)
+        self.assertEqual(expected, actual)
+        fingerprint = FileFingerprint.objects.get(path=self.path)
+        self.assertEqual("blake2b", fingerprint.algorithm)
+        self.assertEqual(
+            hashlib.blake2b(b"content", digest_size=16).hexdigest(),
+            fingerprint.fingerprint,
+        )
+
+    @override_settings(FINGERPRINT_ALGORITHM="blake2b")
+    def test_should_not_rehash_with_md5_when_only_mtime_changed(self):
+        calculate_hash(self.user, self.path)
+        os.utime(self.path, ns=(0, 0))
+
+        with patch(
+            "api.models.file._hash_content", wraps=_hash_content
+        ) as hash_content_mock:
+            actual = calculate_hash(self.user, self.path)
+
+        expected = hashlib.md5(b"content").hexdigest() + str(self.user.id)
+        self.assertEqual(expected, actual)
+        hash_content_mock.assert_called_once_with(ANY, "blake2b")
+        self.assertEqual(0, FileFingerprint.objects.get(path=self.path).mtime)
+
+    @override_settings(FINGERPRINT_ALGORITHM="blake2b")
+    def test_should_rehash_with_md5_when_content_changed(self):
+        calculate_hash(self.user, self.path)
+        self.write(b"changed content")
+
+        actual = calculate_hash(self.user, self.path)
+
+        expected = hashlib.md5(b"changed content").hexdigest() + str(self.user.id)
+        self.assertEqual(expected, actual)
+
+    @override_settings(FINGERPRINT_ALGORITHM="blake2b")
+    def test_should_calculate_md5_of_uploads(self):
+        actual = calculate_hash_b64(self.user, io.BytesIO(b"content"))
+
+        expected = hashlib.md5(b"content").hexdigest() + str(self.user.id)
+        self.assertEqual(expected, actual)
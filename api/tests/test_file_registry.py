@@ -0,0 +1,116 @@
+import os
+import tempfile
+
+from django.test import TestCase
+
+from api.directory_watcher import (
+    diff_with_registry,
+    load_file_registry,
+    update_file_registry,
+)
+from api.models import File
+from api.scan_manifest import ScanManifest
+from api.tests.utils import (
+    create_test_photo,
+    create_test_photo_with_file,
+    create_test_user,
+)
+
+
+class DiffWithRegistryTest(TestCase):
+    def test_should_split_found_files_without_manifest(self):
+        registry = {"/data/a.jpg": (1, 1, 1), "/data/b.jpg": (2, 2, 2)}
+        found_files = {
+            "/data/a.jpg": (1, 1, 1),
+            "/data/b.jpg": (2, 5, 2),
+            "/data/c.jpg": (3, 3, 3),
+        }
+
+        new, changed, unchanged = diff_with_registry(found_files, registry)
+
+        self.assertEqual({"/data/c.jpg"}, new)
+        self.assertEqual({"/data/b.jpg"}, changed)
+        self.assertEqual({"/data/a.jpg"}, unchanged)
+
+    def test_should_not_retry_unchanged_files_which_are_no_photos(self):
+        manifest = ScanManifest(1, {"/data/notes.txt": (1, 1, 1)})
+        found_files = {"/data/notes.txt": (1, 1, 1), "/data/c.jpg": (3, 3, 3)}
+
+        new, _, unchanged = diff_with_registry(found_files, {}, manifest, "/data")
+
+        self.assertEqual({"/data/c.jpg"}, new)
+        self.assertEqual({"/data/notes.txt"}, unchanged)
+
+    def test_should_use_manifest_for_files_without_stat(self):
+        manifest = ScanManifest(1, {"/data/a.jpg": (1, 1, 1), "/data/b.jpg": (2, 2, 2)})
+        registry = {"/data/a.jpg": None, "/data/b.jpg": None}
+        found_files = {"/data/a.jpg": (1, 1, 1), "/data/b.jpg": (2, 5, 2)}
+
+        _, changed, unchanged = diff_with_registry(
+            found_files, registry, manifest, "/data"
+        )
+
+        self.assertEqual({"/data/b.jpg"}, changed)
+        self.assertEqual({"/data/a.jpg"}, unchanged)
+
+    def test_should_report_photo_as_changed_when_sidecar_is_new(self):
+        registry = {"/data/a.jpg": (1, 1, 1)}
+        found_files = {"/data/a.jpg": (1, 1, 1), "/data/a.xmp": (2, 2, 2)}
+
+        new, changed, _ = diff_with_registry(found_files, registry)
+
+        self.assertEqual({"/data/a.xmp"}, new)
+        self.assertEqual({"/data/a.jpg"}, changed)
+
+
+class FileRegistryTest(TestCase):
+    def setUp(self):
+        self.user = create_test_user()
+        self.photo = create_test_photo(owner=self.user)
+        self.photo.files.add(self.photo.main_file)
+        self.path = self.photo.main_file.path
+
+    def test_should_store_stat_of_created_file(self):
+        file_stat = os.stat(self.path)
+
+        registry = load_file_registry(self.user, os.path.dirname(self.path))
+
+        self.assertEqual(
+            (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino),
+            registry[self.path],
+        )
+
+    def test_should_fill_in_stat_of_legacy_files(self):
+        File.objects.filter(hash=self.photo.main_file.hash).update(
+            size=None, mtime=None, inode=None
+        )
+        registry = load_file_registry(self.user)
+        found_files = {self.path: (7, 8, 9)}
+
+        update_file_registry(found_files, registry, "job")
+
+        file = File.objects.get(hash=self.photo.main_file.hash)
+        self.assertEqual(
+            (7, 8, 9, "job"), (file.size, file.mtime, file.inode, file.last_seen_scan)
+        )
+
+    def test_should_only_load_files_at_paths(self):
+        other = create_test_photo_with_file(
+            os.path.join(tempfile.mkdtemp(), "other.jpg"), self.user, b"other"
+        )
+
+        registry = load_file_registry(self.user, paths=[other.main_file.path])
+
+        self.assertEqual([other.main_file.path], list(registry.keys()))
+
+    def test_should_prefer_most_recently_modified_file_at_same_path(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "photo.jpg")
+        current = create_test_photo_with_file(path, self.user, b"current").main_file
+        stale = create_test_photo_with_file(path, self.user, b"stale").main_file
+        File.objects.filter(hash=current.hash).update(mtime=2)
+        File.objects.filter(hash=stale.hash).update(mtime=1)
+
+        registry = load_file_registry(self.user, directory)
+
+        self.assertEqual(2, registry[path][1])
@@ -0,0 +1,149 @@
+import os
+import tempfile
+import uuid
+from concurrent.futures import Future
+from unittest.mock import MagicMock, patch
+
+from django.test import TestCase, TransactionTestCase
+from inotify_simple import Event, flags
+
+from api.directory_watcher import handle_changed_files, ingest_new_files, scan_photos
+from api.file_watcher import FileWatcher, PendingChanges, dispatch_changes
+from api.tests.utils import create_test_photo_with_file, create_test_user
+
+
+class PendingChangesTest(TestCase):
+    def test_should_wait_until_events_are_quiet(self):
+        pending = PendingChanges(debounce=2, max_delay=30)
+
+        pending.add("/data/a.jpg", now=0)
+        pending.add("/data/a.jpg", now=1)
+
+        self.assertFalse(pending.is_due(now=2))
+        self.assertTrue(pending.is_due(now=3))
+        self.assertEqual(({"/data/a.jpg"}, {}), pending.pop())
+        self.assertFalse(pending.is_due(now=10))
+
+    def test_should_not_wait_longer_than_max_delay(self):
+        pending = PendingChanges(debounce=2, max_delay=5)
+
+        for now in range(0, 6):
+            pending.add("/data/{}.jpg".format(now), now=now)
+
+        self.assertTrue(pending.is_due(now=5))
+
+    def test_should_coalesce_moves(self):
+        pending = PendingChanges()
+
+        pending.add("/data/new.jpg", now=0)
+        pending.move("/data/new.jpg", "/data/renamed.jpg", now=0)
+        pending.move("/data/a.jpg", "/data/b.jpg", now=0)
+        pending.move("/data/b.jpg", "/data/c.jpg", now=0)
+
+        paths, moves = pending.pop()
+        self.assertEqual({"/data/renamed.jpg"}, paths)
+        self.assertEqual(
+            {"/data/new.jpg": "/data/renamed.jpg", "/data/a.jpg": "/data/c.jpg"}, moves
+        )
+
+
+class DispatchChangesTest(TestCase):
+    @patch("api.file_watcher.AsyncTask")
+    def test_should_scan_changed_files_of_their_user(self, async_task):
+        user = create_test_user(scan_directory="/data/user")
+        create_test_user(scan_directory="/data/other")
+
+        dispatch_changes({"/data/user/a.jpg", "/data/outside/b.jpg"}, {})
+
+        async_task.assert_called_once()
+        args = async_task.call_args.args
+        self.assertEqual(user, args[1])
+        self.assertEqual(["/data/user/a.jpg"], args[5])
+
+
+class FileWatcherTest(TestCase):
+    @patch("api.file_watcher.AsyncTask")
+    def test_should_scan_watched_directories_after_overflow(self, async_task):
+        directory = tempfile.mkdtemp()
+        user = create_test_user(scan_directory=directory)
+        watcher = FileWatcher([directory])
+        watcher.inotify = MagicMock()
+        watcher.inotify.read.return_value = [Event(-1, flags.Q_OVERFLOW, 0, "")]
+        watcher.pending.add(os.path.join(directory, "a.jpg"))
+
+        watcher.read()
+        self.assertTrue(watcher.overflowed)
+        watcher.rescan()
+
+        async_task.assert_called_once()
+        args = async_task.call_args.args
+        self.assertEqual((scan_photos, user, False), args[:3])
+        self.assertEqual((directory,), args[4:])
+        self.assertFalse(watcher.overflowed)
+        self.assertFalse(watcher.pending.is_due(now=float("inf")))
+
+
+class RecordingPool:
+    def __init__(self):
+        self.failed = False
+        self.submitted = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def submit(self, fn, *args):
+        self.submitted.append((fn, args))
+        future = Future()
+        future.set_result([])
+        return future
+
+
+@patch("api.directory_watcher.AsyncTask")
+class ScanChangedFilesTest(TransactionTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.user = create_test_user(scan_directory=self.directory)
+        self.photo = create_test_photo_with_file(
+            os.path.join(self.directory, "photo.jpg"), self.user, b"photo"
+        )
+        create_test_photo_with_file(
+            os.path.join(self.directory, "other.jpg"), self.user, b"other"
+        )
+
+    def test_should_only_process_photos_of_scanned_files(self, async_task):
+        scan_photos(self.user, False, uuid.uuid4(), "/tmp", [self.photo.main_file.path])
+
+        self.assertEqual(4, async_task.call_count)
+        for call in async_task.call_args_list:
+            self.assertEqual([self.photo.image_hash], call.args[-1])
+
+    def test_should_not_process_photos_without_scanned_files(self, async_task):
+        missing = os.path.join(self.directory, "missing.jpg")
+
+        scan_photos(self.user, False, uuid.uuid4(), self.directory, [missing])
+
+        async_task.assert_not_called()
+
+    def test_should_process_photo_of_scanned_sidecar(self, async_task):
+        sidecar = os.path.join(self.directory, "photo.xmp")
+        with open(sidecar, "w") as f:
+            f.write("<x:xmpmeta/>")
+        pool = RecordingPool()
+
+        with patch("api.directory_watcher.IngestPool", return_value=pool):
+            scan_photos(self.user, False, uuid.uuid4(), self.directory, [sidecar])
+
+        submitted = {fn: args for fn, args in pool.submitted}
+        self.assertEqual([sidecar], submitted[ingest_new_files][1])
+        self.assertEqual(
+            [self.photo.main_file.path],
+            submitted[ingest_new_files][3].get_media_files(sidecar),
+        )
+        self.assertEqual(
+            [self.photo.main_file.path], submitted[handle_changed_files][1]
+        )
+        for call in async_task.call_args_list:
+            self.assertEqual([self.photo.image_hash], call.args[-1])
@@ -0,0 +1,99 @@
+import io
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from django.test import TestCase
+
+from api.image_similarity import (
+    add_to_image_similarity_index,
+    benchmark_image_similarity_index,
+    build_image_similarity_index,
+    update_image_similarity_index,
+)
+from api.models.photo_embedding import save_embeddings
+from api.semantic_search import CLIP_MODEL_VERSION
+from api.tests.utils import create_test_photo, create_test_user
+
+
+def response(status_code, body=None):
+    res = MagicMock()
+    res.status_code = status_code
+    res.json.return_value = body or {}
+    return res
+
+
+@patch("api.image_similarity.build_image_similarity_index")
+@patch("api.image_similarity.requests")
+class ImageSimilarityIndexTest(TestCase):
+    def setUp(self):
+        self.user = create_test_user()
+        self.photo = create_test_photo(owner=self.user)
+        save_embeddings([self.photo], [[1.0, 0.0]], [1.0], CLIP_MODEL_VERSION)
+
+    def test_should_add_photos_to_index(self, requests, build):
+        requests.post.return_value = response(200)
+
+        add_to_image_similarity_index(self.user, [self.photo.image_hash])
+
+        post_data = requests.post.call_args.kwargs["json"]
+        self.assertEqual([self.photo.image_hash], post_data["image_hashes"])
+        self.assertEqual([[1.0, 0.0]], post_data["image_embeddings"])
+        build.assert_not_called()
+
+    def test_should_rebuild_index_of_other_model(self, requests, build):
+        requests.post.return_value = response(409)
+
+        add_to_image_similarity_index(self.user, [self.photo.image_hash])
+
+        build.assert_called_once_with(self.user)
+
+    def test_should_only_rebuild_index_of_other_model(self, requests, build):
+        requests.get.return_value = response(
+            200, {"model_version": CLIP_MODEL_VERSION, "index_size": 1}
+        )
+        update_image_similarity_index(self.user)
+        build.assert_not_called()
+        self.assertTrue(
+            requests.post.call_args.args[0].endswith(
+                "/index/{}/save/".format(self.user.id)
+            )
+        )
+
+        requests.get.return_value = response(200, {"model_version": "old"})
+        update_image_similarity_index(self.user)
+        build.assert_called_once_with(self.user)
+
+    def test_should_benchmark_embeddings_of_user(self, requests, build):
+        requests.post.return_value = response(200, {"result": {"vectors": 1}})
+
+        actual = benchmark_image_similarity_index(self.user, queries=10, n=5)
+
+        body = np.load(io.BytesIO(requests.post.call_args.kwargs["data"]))
+        np.testing.assert_array_equal([[1.0, 0.0]], body)
+        self.assertEqual(
+            {"queries": 10, "n": 5}, requests.post.call_args.kwargs["params"]
+        )
+        self.assertEqual({"vectors": 1}, actual)
+
+
+@patch("api.image_similarity.requests")
+class BuildImageSimilarityIndexTest(TestCase):
+    def test_should_send_all_embeddings_at_once(self, requests):
+        user = create_test_user()
+        photos = sorted(
+            [create_test_photo(owner=user) for _ in range(3)],
+            key=lambda photo: photo.image_hash,
+        )
+        embeddings = np.arange(6, dtype=np.float32).reshape(3, 2)
+        save_embeddings(photos, embeddings, [1.0, 1.0, 1.0], CLIP_MODEL_VERSION)
+        requests.put.return_value = response(200)
+
+        build_image_similarity_index(user)
+
+        body = io.BytesIO(b"".join(requests.put.call_args.kwargs["data"]))
+        image_hashes, image_embeddings = np.load(body), np.load(body)
+        self.assertEqual(
+            [photo.image_hash.encode() for photo in photos], image_hashes.tolist()
+        )
+        np.testing.assert_array_equal(embeddings, image_embeddings)
+        requests.post.assert_not_called()
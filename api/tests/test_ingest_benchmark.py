@@ -0,0 +1,52 @@
+import numpy as np
+from django.test import TestCase
+
+from api.ingest_benchmark import (
+    CLIP_EMBEDDING_SIZE,
+    PHOTO_STAGES,
+    StageStats,
+    instrumented,
+    stand_in_response,
+)
+from api.models import Photo
+
+
+class StageStatsTest(TestCase):
+    def test_should_report_percentiles_and_throughput(self):
+        stats = StageStats()
+        for duration in [0.1] * 8 + [1.1] * 2:
+            stats.record(duration, queries=2)
+        stats.record(0.1, queries=0, failed=True)
+
+        actual = stats.report()
+
+        self.assertEqual(11, actual["calls"])
+        self.assertEqual(1, actual["failures"])
+        self.assertEqual(100.0, actual["p50_ms"])
+        self.assertEqual(1100.0, actual["p95_ms"])
+        self.assertEqual(20, actual["queries"])
+
+
+class InstrumentedTest(TestCase):
+    def test_should_restore_stages(self):
+        original = Photo._generate_thumbnail
+        stats = {}
+
+        with instrumented(stats, queries=None):
+            self.assertIsNot(original, Photo._generate_thumbnail)
+
+        self.assertIs(original, Photo._generate_thumbnail)
+        self.assertEqual(set(PHOTO_STAGES), set(PHOTO_STAGES) & set(stats.keys()))
+
+
+class StandInResponseTest(TestCase):
+    def test_should_answer_clip_embeddings_for_every_image(self):
+        actual = stand_in_response("/clip-embeddings", {"imgs": ["a.jpg", "b.jpg"]})
+
+        self.assertEqual((2, CLIP_EMBEDDING_SIZE), actual.shape)
+        self.assertAlmostEqual(1.0, float(np.linalg.norm(actual[0])), places=5)
+
+    def test_should_answer_places365_tags(self):
+        actual = stand_in_response("/generate-tags", {"image_path": "a.jpg"})
+
+        self.assertEqual("outdoor", actual["tags"]["environment"])
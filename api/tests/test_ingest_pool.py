@@ -0,0 +1,31 @@
+import os
+import time
+
+from django.test import TestCase
+
+from api.ingest_pool import IngestPool
+
+
+class IngestPoolTest(TestCase):
+    def test_should_reuse_worker_processes(self):
+        with IngestPool(workers=1, queue_size=1) as pool:
+            futures = [pool.submit(os.getpid) for _ in range(4)]
+
+        pids = {future.result() for future in futures}
+        self.assertEqual(1, len(pids))
+        self.assertNotIn(os.getpid(), pids)
+
+    def test_should_block_while_queue_is_full(self):
+        start = time.monotonic()
+        with IngestPool(workers=1, queue_size=1) as pool:
+            for _ in range(3):
+                pool.submit(time.sleep, 0.5)
+            submitted = time.monotonic() - start
+
+        self.assertGreaterEqual(submitted, 0.5)
+
+    def test_should_report_failed_work(self):
+        with IngestPool(workers=1) as pool:
+            pool.submit(int, "not a number")
+
+        self.assertTrue(pool.failed)
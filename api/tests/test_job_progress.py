@@ -0,0 +1,54 @@
+import uuid
+
+from django.test import TestCase
+
+from api.job_progress import JobProgress
+from api.models import LongRunningJob
+from api.tests.utils import create_test_user
+
+
+class JobProgressTest(TestCase):
+    def setUp(self):
+        self.job_id = str(uuid.uuid4())
+        LongRunningJob.objects.create(
+            started_by=create_test_user(),
+            job_id=self.job_id,
+            job_type=LongRunningJob.JOB_SCAN_PHOTOS,
+            progress_target=3,
+        )
+
+    def get_job(self):
+        return LongRunningJob.objects.get(job_id=self.job_id)
+
+    def test_should_buffer_increments_until_flush(self):
+        progress = JobProgress(self.job_id, flush_interval=60, flush_size=10)
+
+        with self.assertNumQueries(0):
+            progress.increment()
+            progress.increment()
+        with self.assertNumQueries(1):
+            progress.flush()
+
+        job = self.get_job()
+        self.assertEqual(2, job.progress_current)
+        self.assertFalse(job.finished)
+
+    def test_should_finish_job_when_target_is_reached(self):
+        with JobProgress(self.job_id, flush_interval=60, flush_size=10) as progress:
+            progress.increment()
+            progress.increment(failed=True)
+            progress.increment()
+
+        job = self.get_job()
+        self.assertEqual(3, job.progress_current)
+        self.assertTrue(job.finished)
+        self.assertTrue(job.failed)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_should_flush_when_size_is_reached(self):
+        progress = JobProgress(self.job_id, flush_interval=60, flush_size=2)
+
+        progress.increment()
+        progress.increment()
+
+        self.assertEqual(2, self.get_job().progress_current)
@@ -0,0 +1,69 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+
+from api.exif_tags import Tags
+from api.metadata_snapshot import ALL_TAGS, clear_snapshots, get_metadata
+
+
+def fake_metadata_batch(values_by_file):
+    def get_metadata_batch(media_files, tags, try_sidecar=True, struct=False):
+        return [
+            [values_by_file.get(media_file, {}).get(tag) for tag in tags]
+            for media_file in media_files
+        ]
+
+    return get_metadata_batch
+
+
+@override_settings(PERSIST_METADATA_SNAPSHOTS=False)
+class MetadataSnapshotTest(TestCase):
+    def setUp(self):
+        clear_snapshots()
+        self.directory = tempfile.mkdtemp()
+        self.media_file = os.path.join(self.directory, "photo.jpg")
+        self.sidecar_file = os.path.join(self.directory, "photo.xmp")
+        with open(self.media_file, "wb") as f:
+            f.write(b"jpeg")
+        with open(self.sidecar_file, "wb") as f:
+            f.write(b"xmp")
+        self.values_by_file = {
+            self.media_file: {Tags.RATING: 1, Tags.CAMERA: "camera"},
+            self.sidecar_file: {Tags.RATING: 5},
+        }
+
+    @patch("api.metadata_snapshot.util.get_metadata_batch")
+    def test_should_read_all_tags_once(self, get_metadata_batch_mock):
+        get_metadata_batch_mock.side_effect = fake_metadata_batch(self.values_by_file)
+
+        rating, camera = get_metadata(self.media_file, [Tags.RATING, Tags.CAMERA])
+        (rating_without_sidecar,) = get_metadata(
+            self.media_file, [Tags.RATING], try_sidecar=False
+        )
+
+        self.assertEqual(5, rating)
+        self.assertEqual("camera", camera)
+        self.assertEqual(1, rating_without_sidecar)
+        get_metadata_batch_mock.assert_called_once()
+        self.assertEqual(ALL_TAGS, get_metadata_batch_mock.call_args.args[1])
+
+    @patch("api.metadata_snapshot.util.get_metadata_batch")
+    def test_should_read_again_when_sidecar_changed(self, get_metadata_batch_mock):
+        get_metadata_batch_mock.side_effect = fake_metadata_batch(self.values_by_file)
+
+        get_metadata(self.media_file, [Tags.RATING])
+        with open(self.sidecar_file, "wb") as f:
+            f.write(b"changed xmp")
+        get_metadata(self.media_file, [Tags.RATING])
+
+        self.assertEqual(2, get_metadata_batch_mock.call_count)
+
+    @patch("api.metadata_snapshot.util.get_metadata")
+    def test_should_request_unknown_tags_directly(self, get_metadata_mock):
+        get_metadata_mock.return_value = ["value"]
+
+        values = get_metadata(self.media_file, ["EXIF:Unknown"])
+
+        self.assertEqual(["value"], values)
@@ -10,6 +10,7 @@ from api.models.file import (
     File,
     extract_embedded_media,
     has_embedded_media,
+    locate_motion_video,
 )
 from api.tests.utils import create_test_photo, create_test_user
 
@@ -80,6 +81,30 @@ class MotionPhotoTest(TestCase):
             contents = f.read()
             self.assertEqual(MP4, contents)
 
+    def test_locate_video_from_xmp_container_directory(self):
+        xmp = (
+            b'<Container:Item Item:Mime="image/jpeg" Item:Semantic="Primary"/>'
+            b'<Container:Item Item:Mime="video/mp4" Item:Semantic="MotionPhoto" '
+            b'Item:Length="%d"/>' % len(MP4)
+        )
+        # a signature before the video must not be mistaken for its start
+        content = JPEG_MAGIC_NUMBER + xmp + MP4_PREFIX + b"ftypisom" + JPEG + MP4
+        with open(self.test_image_path, "wb+") as f:
+            f.write(content)
+
+        actual = locate_motion_video(self.test_image_path)
+
+        self.assertEqual(len(content) - len(MP4), actual)
+
+    def test_plain_jpeg_should_not_be_searched(self):
+        content = JPEG_MAGIC_NUMBER + MP4_PREFIX + b"ftypisom" + JPEG + b"\x00\x00"
+        with open(self.test_image_path, "wb+") as f:
+            f.write(content)
+
+        actual = locate_motion_video(self.test_image_path)
+
+        self.assertEqual(-1, actual)
+
     def test_fetch_embedded_media_as_owner(self):
         self.client.force_authenticate(user=self.user)
         embedded_media = create_test_file(self.test_video_path, self.user, MP4)
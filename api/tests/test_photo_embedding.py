@@ -0,0 +1,53 @@
+import numpy as np
+from django.test import TestCase
+
+from api.models import PhotoEmbedding
+from api.models.photo_embedding import FLOAT16, load_embeddings, save_embeddings
+from api.tests.utils import create_test_photos, create_test_user
+
+
+class PhotoEmbeddingTest(TestCase):
+    def setUp(self):
+        self.user = create_test_user()
+        self.photos = sorted(
+            create_test_photos(number_of_photos=3, owner=self.user),
+            key=lambda photo: photo.image_hash,
+        )
+        self.embeddings = np.arange(12, dtype=np.float32).reshape(3, 4)
+
+    def test_should_load_embeddings_as_one_matrix(self):
+        save_embeddings(self.photos, self.embeddings, [1.0, 2.0, 3.0], "v1")
+
+        image_hashes, matrix = load_embeddings(self.user, chunk_size=2)
+
+        self.assertEqual([photo.image_hash for photo in self.photos], image_hashes)
+        self.assertEqual(np.float32, matrix.dtype)
+        np.testing.assert_array_equal(self.embeddings, matrix)
+
+    def test_should_replace_embeddings(self):
+        save_embeddings(self.photos, self.embeddings, [1.0, 2.0, 3.0], "v1")
+        save_embeddings(self.photos[:1], [[1, 0, 0, 0]], [1.0], "v2", FLOAT16)
+
+        embedding = PhotoEmbedding.objects.get(photo=self.photos[0])
+
+        self.assertEqual(3, PhotoEmbedding.objects.count())
+        self.assertEqual("v2", embedding.model_version)
+        self.assertEqual(8, len(embedding.vector))
+        np.testing.assert_array_equal([1, 0, 0, 0], embedding.to_array())
+
+    def test_should_only_load_visible_photos_of_model_version(self):
+        save_embeddings(self.photos, self.embeddings, [1.0, 2.0, 3.0], "v1")
+        save_embeddings(self.photos[:1], [[1, 0, 0, 0]], [1.0], "v2")
+        self.photos[1].hidden = True
+        self.photos[1].save()
+
+        image_hashes, matrix = load_embeddings(self.user, "v1")
+
+        self.assertEqual([self.photos[2].image_hash], image_hashes)
+        np.testing.assert_array_equal(self.embeddings[2:], matrix)
+
+    def test_should_load_no_embeddings(self):
+        image_hashes, matrix = load_embeddings(self.user)
+
+        self.assertEqual([], image_hashes)
+        self.assertEqual(0, len(matrix))
@@ -0,0 +1,65 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from api.models import Photo
+from api.tests.utils import create_test_photo, create_test_user
+
+
+class PhotoSaveTest(TestCase):
+    def setUp(self):
+        self.user = create_test_user()
+        self.photo = create_test_photo(owner=self.user)
+
+    def test_should_not_write_unchanged_photo(self):
+        photo = Photo.objects.get(image_hash=self.photo.image_hash)
+
+        with self.assertNumQueries(0):
+            photo.save()
+
+    def test_should_only_write_changed_columns(self):
+        photo = Photo.objects.get(image_hash=self.photo.image_hash)
+        photo.camera = "camera"
+
+        with CaptureQueriesContext(connection) as context:
+            photo.save()
+
+        self.assertEqual(1, len(context.captured_queries))
+        sql = context.captured_queries[0]["sql"]
+        self.assertIn('"camera"', sql)
+        self.assertNotIn('"lens"', sql)
+        self.assertEqual("camera", Photo.objects.get(pk=photo.pk).camera)
+
+    def test_should_detect_in_place_changes_of_json_fields(self):
+        photo = Photo.objects.get(image_hash=self.photo.image_hash)
+        photo.captions_json = {"user_caption": "before"}
+        photo.save()
+
+        photo.captions_json["user_caption"] = "after"
+        photo.save()
+
+        self.assertEqual(
+            "after", Photo.objects.get(pk=photo.pk).captions_json["user_caption"]
+        )
+
+    def test_should_save_fields_set_after_deferred_loading(self):
+        photo = Photo.objects.only("image_hash").get(pk=self.photo.pk)
+        photo.lens = "lens"
+        photo.save()
+
+        self.assertEqual("lens", Photo.objects.get(pk=photo.pk).lens)
+
+    def test_should_write_deferred_changes_with_one_update(self):
+        photo = Photo.objects.get(image_hash=self.photo.image_hash)
+
+        with CaptureQueriesContext(connection) as context:
+            with photo.deferred_commit():
+                photo.camera = "camera"
+                photo.save()
+                photo.lens = "lens"
+                photo.save()
+
+        self.assertEqual(1, len(context.captured_queries))
+        saved_photo = Photo.objects.get(pk=photo.pk)
+        self.assertEqual("camera", saved_photo.camera)
+        self.assertEqual("lens", saved_photo.lens)
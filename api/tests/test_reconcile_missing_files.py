@@ -0,0 +1,46 @@
+import os
+import tempfile
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from api.directory_watcher import reconcile_missing_files
+from api.models import File
+from api.tests.utils import create_test_photo_with_file, create_test_user
+
+
+class ReconcileMissingFilesTest(TestCase):
+    def setUp(self):
+        self.user = create_test_user()
+        self.directory = tempfile.mkdtemp()
+        self.photo = create_test_photo_with_file(
+            os.path.join(self.directory, "photo.jpg"), self.user, b"photo"
+        )
+        self.other_photo = create_test_photo_with_file(
+            os.path.join(self.directory, "other.jpg"), self.user, b"other"
+        )
+
+    def test_should_unlink_files_which_were_not_found(self):
+        os.remove(self.photo.main_file.path)
+
+        actual = reconcile_missing_files(self.user, [self.other_photo.main_file.path])
+
+        self.assertEqual(1, actual)
+        self.assertTrue(File.objects.get(hash=self.photo.main_file.hash).missing)
+        self.assertEqual(0, self.photo.files.count())
+        self.assertEqual(1, self.other_photo.files.count())
+
+    def test_should_keep_existing_files_which_were_not_walked(self):
+        actual = reconcile_missing_files(self.user, [])
+
+        self.assertEqual(0, actual)
+        self.assertEqual(1, self.photo.files.count())
+        self.assertFalse(File.objects.get(hash=self.photo.main_file.hash).missing)
+
+    def test_should_invalidate_api_cache_when_files_are_missing(self):
+        os.remove(self.photo.main_file.path)
+        cache.delete("api_updated_at_timestamp")
+
+        reconcile_missing_files(self.user, [self.other_photo.main_file.path])
+
+        self.assertIsNotNone(cache.get("api_updated_at_timestamp"))
@@ -0,0 +1,89 @@
+import os
+import tempfile
+
+from django.test import TestCase, override_settings
+
+from api.directory_watcher import walk_directory, walk_directory_with_stats
+from api.scan_manifest import ScanManifest
+from api.tests.utils import create_test_user
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class ScanManifestTest(TestCase):
+    def setUp(self):
+        self.user = create_test_user()
+
+    def test_should_report_added_changed_and_removed_files(self):
+        manifest = ScanManifest(
+            self.user.id,
+            {
+                "/data/a.jpg": (1, 1, 1),
+                "/data/b.jpg": (2, 2, 2),
+                "/data/c.jpg": (3, 3, 3),
+            },
+        )
+        found_files = {
+            "/data/a.jpg": (1, 1, 1),
+            "/data/b.jpg": (2, 5, 2),
+            "/data/d.jpg": (4, 4, 4),
+        }
+
+        added, changed, removed = manifest.diff(found_files, "/data")
+
+        self.assertEqual({"/data/d.jpg"}, added)
+        self.assertEqual({"/data/b.jpg"}, changed)
+        self.assertEqual({"/data/c.jpg"}, removed)
+
+    def test_should_report_media_file_as_changed_when_sidecar_changed(self):
+        manifest = ScanManifest(
+            self.user.id,
+            {"/data/a.jpg": (1, 1, 1), "/data/a.xmp": (1, 1, 2)},
+        )
+        found_files = {"/data/a.jpg": (1, 1, 1), "/data/a.xmp": (1, 9, 2)}
+
+        _, changed, _ = manifest.diff(found_files, "/data")
+
+        self.assertEqual({"/data/a.jpg", "/data/a.xmp"}, changed)
+
+    def test_should_only_remove_files_below_scanned_directory(self):
+        manifest = ScanManifest(
+            self.user.id,
+            {"/data/uploads/a.jpg": (1, 1, 1), "/data/other/b.jpg": (2, 2, 2)},
+        )
+
+        _, _, removed = manifest.diff({}, "/data/uploads")
+        manifest.update({"/data/uploads/c.jpg": (3, 3, 3)}, "/data/uploads")
+
+        self.assertEqual({"/data/uploads/a.jpg"}, removed)
+        self.assertEqual(
+            {"/data/other/b.jpg", "/data/uploads/c.jpg"}, set(manifest.entries)
+        )
+
+    def test_should_persist_manifest(self):
+        ScanManifest(self.user.id, {"/data/a.jpg": (1, 2, 3)}).save()
+
+        manifest = ScanManifest.load(self.user)
+
+        self.assertEqual({"/data/a.jpg": (1, 2, 3)}, manifest.entries)
+
+
+class WalkDirectoryTest(TestCase):
+    def test_should_walk_nested_directories_and_skip_hidden_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, "a", "b"))
+            os.makedirs(os.path.join(directory, ".hidden"))
+            for path in ["top.jpg", "a/a.jpg", "a/b/b.jpg", ".hidden/h.jpg", ".h.jpg"]:
+                with open(os.path.join(directory, path), "wb") as f:
+                    f.write(b"\x00" * len(path))
+
+            found_files = walk_directory_with_stats(directory)
+            photo_list = []
+            walk_directory(directory, photo_list)
+
+            expected = sorted(
+                os.path.join(directory, path)
+                for path in ["top.jpg", "a/a.jpg", "a/b/b.jpg"]
+            )
+            self.assertEqual(expected, photo_list)
+            size, _, _ = found_files[os.path.join(directory, "a/b/b.jpg")]
+            self.assertEqual(len("a/b/b.jpg"), size)
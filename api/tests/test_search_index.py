@@ -0,0 +1,121 @@
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from api.models import Photo
+from api.search_index import move_search_paths, recreate_search_captions, search_photos
+from api.serializers.person import PersonSerializer
+from api.tests.utils import create_test_face, create_test_photo, create_test_user
+
+
+class SearchPhotosTest(TestCase):
+    def setUp(self):
+        self.user = create_test_user()
+
+    def search(self, *terms):
+        return search_photos(Photo.objects.filter(owner=self.user), terms)
+
+    def test_should_match_prefix_of_words(self):
+        beach = create_test_photo(owner=self.user, search_captions="sandy beach")
+        create_test_photo(owner=self.user, search_captions="mountain lake")
+
+        actual = self.search("bea")
+
+        self.assertEqual([beach], list(actual))
+
+    def test_should_match_all_terms(self):
+        create_test_photo(owner=self.user, search_captions="sandy beach")
+        sunset = create_test_photo(
+            owner=self.user,
+            search_captions="beach at sunset",
+            search_location="Lisbon, Portugal",
+        )
+
+        actual = self.search("beach", "lisbon")
+
+        self.assertEqual([sunset], list(actual))
+
+    def test_should_rank_captions_above_location(self):
+        location = create_test_photo(
+            owner=self.user, search_captions="street", search_location="Paris"
+        )
+        caption = create_test_photo(owner=self.user, search_captions="paris street")
+
+        actual = list(self.search("paris").order_by("-search_rank"))
+
+        self.assertEqual([caption, location], actual)
+
+    def test_should_match_substring_of_path(self):
+        photo = create_test_photo(
+            owner=self.user, search_captions="/data/holidays2019/image.jpg"
+        )
+
+        actual = self.search("days2019")
+
+        self.assertEqual([photo], list(actual))
+
+    def test_should_match_substring_with_ilike(self):
+        # unlike UPPER(column) LIKE, ILIKE can use the trigram indexes
+        actual = self.search("days2019")
+
+        self.assertIn('"search_captions" ILIKE', str(actual.query))
+        self.assertNotIn("UPPER", str(actual.query))
+
+    def test_should_escape_wildcards_in_substring(self):
+        create_test_photo(owner=self.user, search_captions="sandy beach")
+        discount = create_test_photo(owner=self.user, search_captions="100% sale")
+
+        actual = self.search("0% ")
+
+        self.assertEqual([discount], list(actual))
+
+    def test_should_update_vector_when_captions_change(self):
+        photo = create_test_photo(owner=self.user, search_captions="sandy beach")
+        photo.search_captions = "mountain lake"
+        photo.save()
+
+        self.assertFalse(self.search("beach").exists())
+        self.assertEqual([photo], list(self.search("mountain")))
+
+
+class MoveSearchPathsTest(TestCase):
+    def test_should_replace_moved_file_in_captions(self):
+        user = create_test_user()
+        photo = create_test_photo(owner=user)
+        photo.search_captions = "beach {}".format(photo.main_file.path)
+        photo.save()
+        photo.main_file.path = photo.main_file.path.replace("/tmp/", "/tmp/moved/")
+        photo.main_file.save()
+        photo.files.add(photo.main_file)
+
+        move_search_paths(
+            photo.main_file.path.replace("/tmp/moved/", "/tmp/"), photo.main_file.path
+        )
+
+        photo.refresh_from_db()
+        self.assertEqual("beach {}".format(photo.main_file.path), photo.search_captions)
+
+
+class RecreateSearchCaptionsTest(TestCase):
+    def setUp(self):
+        self.photo = create_test_photo(
+            owner=create_test_user(), thumbnail_big="thumbnails_big/photo.webp"
+        )
+        self.person = create_test_face(photo=self.photo).person
+
+    def test_should_add_new_person_name_to_captions(self):
+        self.person.name = "Alice"
+        self.person.save()
+
+        recreate_search_captions([self.photo.image_hash])
+
+        self.photo.refresh_from_db()
+        self.assertIn("Alice", self.photo.search_captions)
+
+    @patch("api.serializers.person.AsyncTask")
+    def test_should_recreate_captions_in_task_when_person_is_renamed(self, async_task):
+        PersonSerializer().update(self.person, {"newPersonName": "Alice"})
+
+        async_task.assert_called_once_with(
+            recreate_search_captions, [self.photo.image_hash]
+        )
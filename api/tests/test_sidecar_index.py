@@ -0,0 +1,69 @@
+import os
+
+from django.test import TestCase
+
+from api import util
+from api.directory_watcher import create_new_image
+from api.models import File
+from api.sidecar_index import SidecarIndex
+from api.tests.utils import create_test_photo, create_test_user
+
+
+class SidecarIndexTest(TestCase):
+    def setUp(self):
+        self.index = SidecarIndex(
+            [
+                "/data/a.jpg",
+                "/data/a.jpg.XMP",
+                "/data/a.xmp",
+                "/data/b.png",
+                "/data/c.heic",
+                "/data/c.xmp",
+            ]
+        )
+
+    def test_should_find_sidecars_in_priority_order(self):
+        self.assertEqual(
+            ["/data/a.xmp", "/data/a.jpg.XMP"], self.index.get_sidecars("/data/a.jpg")
+        )
+        self.assertEqual([], self.index.get_sidecars("/data/b.png"))
+
+    def test_should_find_media_files_of_sidecar(self):
+        self.assertEqual(["/data/c.heic"], self.index.get_media_files("/data/c.xmp"))
+
+    def test_subset_should_keep_all_sidecars_of_media_files(self):
+        subset = self.index.subset(["/data/a.xmp"])
+
+        self.assertEqual(
+            ["/data/a.xmp", "/data/a.jpg.XMP"], subset.get_sidecars("/data/a.jpg")
+        )
+
+    def test_should_not_look_up_known_sidecars(self):
+        with util.use_sidecars(self.index.sidecars_by_file(["/data/a.jpg"])):
+            actual = util.get_existing_sidecar_files("/data/a.jpg")
+
+        self.assertEqual(["/data/a.xmp", "/data/a.jpg.XMP"], actual)
+        self.assertEqual([], util.get_existing_sidecar_files("/data/a.jpg"))
+
+
+class AttachSidecarTest(TestCase):
+    def test_should_attach_sidecar_to_photo_of_media_file(self):
+        user = create_test_user()
+        photo = create_test_photo(owner=user)
+        directory = os.path.dirname(photo.main_file.path)
+        sidecar = os.path.splitext(photo.main_file.path)[0] + ".xmp"
+        with open(sidecar, "w") as f:
+            f.write("<x:xmpmeta></x:xmpmeta>")
+        photo.files.add(photo.main_file)
+
+        create_new_image(
+            user,
+            sidecar,
+            sidecar_index=SidecarIndex(
+                [photo.main_file.path, sidecar, os.path.join(directory, "other.jpg")]
+            ),
+        )
+
+        self.assertIn(
+            File.METADATA_FILE, photo.files.values_list("type", flat=True).distinct()
+        )
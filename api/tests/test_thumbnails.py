@@ -0,0 +1,120 @@
+import json
+import os
+import tempfile
+from unittest.mock import patch
+
+import numpy as np
+import pyvips
+from django.test import TestCase, override_settings
+
+from api.thumbnails import (
+    createThumbnails,
+    createVideoThumbnails,
+    dominantColor,
+    probeVideo,
+    thumbnailToArray,
+)
+
+media_root = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=media_root)
+class CreateThumbnailsTest(TestCase):
+    def setUp(self):
+        for output_path in ["thumbnails_big", "square_thumbnails_small"]:
+            os.makedirs(os.path.join(media_root, output_path), exist_ok=True)
+        self.input_path = os.path.join(media_root, "original.png")
+        (pyvips.Image.black(1500, 1000, bands=3) + [255, 0, 0]).write_to_file(
+            self.input_path
+        )
+
+    def test_should_create_all_thumbnails_from_one_decode(self):
+        with patch(
+            "api.thumbnails.pyvips.Image.thumbnail", wraps=pyvips.Image.thumbnail
+        ) as thumbnail:
+            thumbnails = createThumbnails(
+                self.input_path,
+                [("square_thumbnails_small", 250), ("thumbnails_big", 1080)],
+                "hash",
+                ".webp",
+            )
+
+        thumbnail.assert_called_once()
+        self.assertEqual(1000, thumbnails["thumbnails_big"].height)
+        self.assertEqual(250, thumbnails["square_thumbnails_small"].height)
+        small = pyvips.Image.new_from_file(
+            os.path.join(media_root, "square_thumbnails_small", "hash.webp")
+        )
+        self.assertEqual(375, small.width)
+
+    def test_should_convert_thumbnail_to_rgb_array(self):
+        thumbnails = createThumbnails(
+            self.input_path, [("square_thumbnails_small", 250)], "hash", ".webp"
+        )
+
+        pixels = thumbnailToArray(thumbnails["square_thumbnails_small"])
+
+        self.assertEqual((250, 375, 3), pixels.shape)
+        self.assertEqual([255, 0, 0], pixels[0, 0].tolist())
+
+
+class DominantColorTest(TestCase):
+    def test_should_return_mean_of_most_frequent_color(self):
+        pixels = np.zeros((10, 10, 3), dtype=np.uint8)
+        pixels[:, :6] = [200, 10, 10]
+        pixels[:6, :6] = [202, 12, 12]
+        pixels[:, 6:] = [0, 0, 250]
+
+        actual = dominantColor(pixels)
+
+        self.assertEqual([201, 11, 11], actual)
+
+
+class VideoThumbnailsTest(TestCase):
+    @patch("api.thumbnails.subprocess.Popen")
+    def test_should_create_all_video_thumbnails_with_one_ffmpeg_run(self, popen):
+        createVideoThumbnails(
+            "/data/video.mp4",
+            "hash",
+            "thumbnails_big",
+            [("square_thumbnails", 500), ("square_thumbnails_small", 250)],
+        )
+
+        popen.assert_called_once()
+        command = popen.call_args.args[0]
+        self.assertEqual(["ffmpeg", "-t", "5", "-i", "/data/video.mp4"], command[:5])
+        self.assertIn(
+            "[0:v]split=3[v0][v1][v2];[v1]scale=-2:500[s1];[v2]scale=-2:250[s2]",
+            command,
+        )
+
+    @patch("api.thumbnails.subprocess.run")
+    def test_should_read_probe_of_video_stream(self, run):
+        run.return_value.stdout = json.dumps(
+            {
+                "streams": [
+                    {"codec_type": "audio", "codec_name": "aac"},
+                    {
+                        "codec_type": "video",
+                        "codec_name": "h264",
+                        "width": 1920,
+                        "height": 1080,
+                        "side_data_list": [{"rotation": -90}],
+                    },
+                ],
+                "format": {"duration": "12.5"},
+            }
+        )
+
+        actual = probeVideo("/data/video.mp4")
+
+        self.assertEqual(
+            {
+                "duration": 12.5,
+                "codec": "h264",
+                "rotation": -90,
+                "width": 1920,
+                "height": 1080,
+            },
+            actual,
+        )
@@ -4,6 +4,8 @@ from django.utils import timezone
 from faker import Faker
 
 from api.models import Face, File, Person, Photo, User
+from api.models.photo_embedding import save_embeddings
+from api.semantic_search import CLIP_MODEL_VERSION
 
 fake = Faker()
 
@@ -46,12 +48,18 @@ def create_test_photo(**kwargs):
     pk = fake.md5()
     if "aspect_ratio" not in kwargs.keys():
         kwargs["aspect_ratio"] = 1
+    clip_embeddings = kwargs.pop("clip_embeddings", None)
+    clip_embeddings_magnitude = kwargs.pop("clip_embeddings_magnitude", None)
     photo = Photo(pk=pk, image_hash=pk, **kwargs)
     file = create_test_file(f"/tmp/{pk}.png", photo.owner, ONE_PIXEL_PNG)
     photo.main_file = file
     if "added_on" not in kwargs.keys():
         photo.added_on = timezone.now()
     photo.save()
+    if clip_embeddings is not None:
+        save_embeddings(
+            [photo], [clip_embeddings], [clip_embeddings_magnitude], CLIP_MODEL_VERSION
+        )
     return photo
 
 
@@ -59,6 +67,16 @@ def create_test_photos(number_of_photos=1, **kwargs):
     return [create_test_photo(**kwargs) for _ in range(0, number_of_photos)]
 
 
+def create_test_photo_with_file(path: str, owner: User, content: bytes, **kwargs):
+    # files with the same content share one row, so every photo gets its own content
+    photo = create_test_photo(owner=owner, **kwargs)
+    file = create_test_file(path, owner, content)
+    photo.files.add(file)
+    photo.main_file = file
+    photo.save()
+    return photo
+
+
 def create_test_face(**kwargs):
     person = Person()
     person.save()
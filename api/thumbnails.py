@@ -1,13 +1,74 @@
+import json
 import os
 import subprocess
 
+import numpy as np
 import pyvips
-import requests
 from django.conf import settings
 
 import api.util as util
+from api.exif_tags import Tags
+from api.metadata_snapshot import get_metadata
 from api.models.file import is_raw
 
+# Embedded previews of raw files, JpgFromRaw is usually full size, PreviewImage depends on the camera
+RAW_PREVIEW_TAGS = ["JpgFromRaw", "PreviewImage"]
+
+
+def extractRawPreview(inputPath):
+    try:
+        response = util.get_service_session().post(
+            "http://localhost:8010/get-preview",
+            json={"source": inputPath, "tags": RAW_PREVIEW_TAGS},
+        )
+    except Exception:
+        util.logger.exception("Could not extract preview from {}".format(inputPath))
+        return None
+    if response.status_code != 200:
+        return None
+    return response.content
+
+
+def createThumbnailFromRawPreview(inputPath, outputHeight, completePath):
+    """
+    Creates the thumbnail of a raw file from its embedded JPEG preview, which is much
+    faster than demosaicing the raw data. Returns False, when the raw file does not
+    contain a preview, which is big enough.
+
+    """
+    preview = extractRawPreview(inputPath)
+    if not preview:
+        return False
+    try:
+        # the preview is stored unrotated, the orientation is only set on the raw file
+        (orientation,) = get_metadata(
+            inputPath, tags=[Tags.ORIENTATION], try_sidecar=False
+        )
+        orientation = int(orientation) if orientation in range(2, 9) else 1
+        transposed = orientation >= 5
+        header = pyvips.Image.new_from_buffer(preview, "")
+        previewHeight = header.width if transposed else header.height
+        if previewHeight < outputHeight:
+            return False
+
+        x = pyvips.Image.thumbnail_buffer(
+            preview,
+            outputHeight if transposed else 10000,
+            height=10000 if transposed else outputHeight,
+            size=pyvips.enums.Size.DOWN,
+            no_rotate=True,
+        ).copy_memory()
+        if orientation != 1:
+            x.set_type(pyvips.GValue.gint_type, "orientation", orientation)
+            x = x.autorot()
+        x.write_to_file(completePath, Q=95)
+        return True
+    except Exception:
+        util.logger.exception(
+            "Could not create thumbnail from preview of {}".format(inputPath)
+        )
+        return False
+
 
 def createThumbnail(inputPath, outputHeight, outputPath, hash, fileType):
     try:
@@ -16,12 +77,18 @@ def createThumbnail(inputPath, outputHeight, outputPath, hash, fileType):
                 completePath = os.path.join(
                     settings.MEDIA_ROOT, outputPath, hash + fileType
                 ).strip()
+                if createThumbnailFromRawPreview(inputPath, outputHeight, completePath):
+                    return completePath
                 json = {
                     "source": inputPath,
                     "destination": completePath,
                     "height": outputHeight,
                 }
-                response = requests.post("http://localhost:8003/", json=json).json()
+                response = (
+                    util.get_service_session()
+                    .post("http://localhost:8003/", json=json)
+                    .json()
+                )
                 return response["thumbnail"]
             else:
                 # only encode raw image in worse case, smaller thumbnails can get created from the big thumbnail instead
@@ -53,57 +120,188 @@ def createThumbnail(inputPath, outputHeight, outputPath, hash, fileType):
         raise e
 
 
-def createAnimatedThumbnail(inputPath, outputHeight, outputPath, hash, fileType):
+def createThumbnails(inputPath, outputs, hash, fileType):
+    """
+    Creates a thumbnail for every (outputPath, outputHeight) in *outputs* while decoding
+    the input only once. The input is shrunk on load to the biggest height and all
+    smaller thumbnails are resized from that image in memory.
+
+    Returns a dict of output path to the thumbnail as in-memory pyvips image, so that
+    later stages do not have to read the thumbnails again.
+
+    """
+    if not outputs:
+        return {}
+    outputs = sorted(outputs, key=lambda output: output[1], reverse=True)
     try:
-        output = os.path.join(settings.MEDIA_ROOT, outputPath, hash + fileType).strip()
-        command = [
-            "ffmpeg",
-            "-i",
-            inputPath,
-            "-to",
-            "00:00:05",
-            "-vcodec",
-            "libx264",
-            "-crf",
-            "20",
-            "-an",
-            "-filter:v",
-            f"scale=-2:{outputHeight}",
-            output,
-        ]
+        source = inputPath
+        thumbnails = {}
+        if is_raw(inputPath):
+            # raw files are converted by the thumbnail service, all smaller thumbnails are created from its result
+            bigThumbnailPath = os.path.join(
+                settings.MEDIA_ROOT, "thumbnails_big", hash + fileType
+            )
+            if outputs[0][0] == "thumbnails_big":
+                createThumbnail(
+                    inputPath, outputs[0][1], "thumbnails_big", hash, fileType
+                )
+                thumbnails["thumbnails_big"] = pyvips.Image.new_from_file(
+                    bigThumbnailPath
+                ).copy_memory()
+                outputs = outputs[1:]
+            source = bigThumbnailPath
+            if not outputs:
+                return thumbnails
 
-        with subprocess.Popen(command) as proc:
-            proc.wait()
+        image = pyvips.Image.thumbnail(
+            source, 10000, height=outputs[0][1], size=pyvips.enums.Size.DOWN
+        ).copy_memory()
+        for outputPath, outputHeight in outputs:
+            thumbnail = image
+            if outputHeight < image.height:
+                thumbnail = image.thumbnail_image(
+                    10000, height=outputHeight, size=pyvips.enums.Size.DOWN
+                ).copy_memory()
+            completePath = os.path.join(
+                settings.MEDIA_ROOT, outputPath, hash + fileType
+            ).strip()
+            thumbnail.write_to_file(completePath, Q=95)
+            thumbnails[outputPath] = thumbnail
+        return thumbnails
     except Exception as e:
-        util.logger.error(
-            "Could not create animated thumbnail for file {}".format(inputPath)
-        )
+        util.logger.error("Could not create thumbnails for file {}".format(inputPath))
         raise e
 
 
-def createThumbnailForVideo(inputPath, outputPath, hash, fileType):
+def thumbnailToArray(thumbnail):
+    """
+    Returns the pixels of an in-memory pyvips thumbnail as (height, width, 3) uint8
+    RGB array, which shares the buffer pyvips rendered into.
+
+    """
+    if thumbnail.interpretation != "srgb":
+        thumbnail = thumbnail.colourspace("srgb")
+    thumbnail = thumbnail.cast("uchar")
+    if thumbnail.bands > 3:
+        thumbnail = thumbnail.extract_band(0, n=3)
+    elif thumbnail.bands == 1:
+        thumbnail = thumbnail.bandjoin([thumbnail, thumbnail])
+    return np.ndarray(
+        buffer=thumbnail.write_to_memory(),
+        dtype=np.uint8,
+        shape=(thumbnail.height, thumbnail.width, 3),
+    )
+
+
+def dominantColor(pixels, bits=3):
+    """
+    Returns the mean [r, g, b] of the most frequent color in *pixels*, after every
+    channel was reduced to *bits* bits.
+
+    """
+    pixels = pixels.reshape(-1, 3)
+    quantized = (pixels >> (8 - bits)).astype(np.int32)
+    bins = (quantized[:, 0] << (2 * bits)) | (quantized[:, 1] << bits) | quantized[:, 2]
+    dominant = np.argmax(np.bincount(bins, minlength=1 << (3 * bits)))
+    return [int(round(value)) for value in pixels[bins == dominant].mean(axis=0)]
+
+
+def createVideoThumbnails(inputPath, hash, stillOutputPath, animatedOutputs):
+    """
+    Creates the still thumbnail in *stillOutputPath* and an animated thumbnail for every
+    (outputPath, outputHeight) in *animatedOutputs* with a single ffmpeg run, which
+    decodes the first five seconds of the video only once.
+
+    """
+    outputs = ([stillOutputPath] if stillOutputPath else []) + [
+        outputPath for outputPath, _ in animatedOutputs
+    ]
+    if not outputs:
+        return
     try:
-        output = os.path.join(settings.MEDIA_ROOT, outputPath, hash + fileType).strip()
-        command = [
-            "ffmpeg",
-            "-i",
-            inputPath,
-            "-ss",
-            "00:00:00.000",
-            "-vframes",
-            "1",
-            output,
-        ]
+        streams = "".join(f"[v{index}]" for index in range(len(outputs)))
+        filters = [f"[0:v]split={len(outputs)}{streams}"]
+        command = ["ffmpeg", "-t", "5", "-i", inputPath]
+        outputArguments = []
+        index = 0
+        if stillOutputPath:
+            output = os.path.join(
+                settings.MEDIA_ROOT, stillOutputPath, hash + ".webp"
+            ).strip()
+            outputArguments += ["-map", "[v0]", "-frames:v", "1", output]
+            index += 1
+        for outputPath, outputHeight in animatedOutputs:
+            output = os.path.join(
+                settings.MEDIA_ROOT, outputPath, hash + ".mp4"
+            ).strip()
+            filters.append(f"[v{index}]scale=-2:{outputHeight}[s{index}]")
+            outputArguments += [
+                "-map",
+                f"[s{index}]",
+                "-vcodec",
+                "libx264",
+                "-crf",
+                "20",
+                "-an",
+                output,
+            ]
+            index += 1
+        command += ["-filter_complex", ";".join(filters)] + outputArguments
 
         with subprocess.Popen(command) as proc:
             proc.wait()
     except Exception as e:
         util.logger.error(
-            "Could not create thumbnail for video file {}".format(inputPath)
+            "Could not create thumbnails for video file {}".format(inputPath)
         )
         raise e
 
 
+def probeVideo(inputPath):
+    """
+    Returns duration, codec, rotation and dimensions of the first video stream,
+    read with ffprobe.
+
+    """
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-print_format",
+        "json",
+        "-show_format",
+        "-show_streams",
+        inputPath,
+    ]
+    try:
+        probe = json.loads(subprocess.run(command, capture_output=True).stdout)
+    except Exception:
+        util.logger.exception("Could not probe video file {}".format(inputPath))
+        return None
+    stream = next(
+        (
+            stream
+            for stream in probe.get("streams", [])
+            if stream.get("codec_type") == "video"
+        ),
+        None,
+    )
+    if stream is None:
+        return None
+    rotation = stream.get("tags", {}).get("rotate")
+    for side_data in stream.get("side_data_list", []):
+        if "rotation" in side_data:
+            rotation = side_data["rotation"]
+    duration = probe.get("format", {}).get("duration") or stream.get("duration")
+    return {
+        "duration": float(duration) if duration else None,
+        "codec": stream.get("codec_name"),
+        "rotation": int(rotation) if rotation else 0,
+        "width": stream.get("width"),
+        "height": stream.get("height"),
+    }
+
+
 def doesStaticThumbnailExists(outputPath, hash):
     return os.path.exists(
         os.path.join(settings.MEDIA_ROOT, outputPath, hash + ".webp").strip()
@@ -1,6 +1,8 @@
 import logging.handlers
 import os
 import os.path
+import threading
+from contextlib import contextmanager
 
 import exiftool
 import requests
@@ -54,6 +56,22 @@ weekdays = {
 }
 
 
+# Sessions keep the connections to the local services open, one per process and thread
+_service_sessions = threading.local()
+
+
+def get_service_session():
+    """
+    Returns the requests session, which the current process and thread use to call the
+    local services.
+
+    """
+    if getattr(_service_sessions, "pid", None) != os.getpid():
+        _service_sessions.session = requests.Session()
+        _service_sessions.pid = os.getpid()
+    return _service_sessions.session
+
+
 def get_sidecar_files_in_priority_order(media_file):
     """
     Returns a list of possible XMP sidecar files for *media_file*, ordered
@@ -69,13 +87,43 @@ def get_sidecar_files_in_priority_order(media_file):
     ]
 
 
+# Sidecar files of the media files a task works on, known from the directory walk
+_known_sidecar_files = {}
+
+
+@contextmanager
+def use_sidecars(sidecars_by_file):
+    """
+    Uses the sidecar files in *sidecars_by_file*, a dict of media file to its existing
+    sidecar files, instead of looking for them on the filesystem.
+
+    """
+    _known_sidecar_files.update(sidecars_by_file)
+    try:
+        yield
+    finally:
+        for media_file in sidecars_by_file:
+            _known_sidecar_files.pop(media_file, None)
+
+
+def get_existing_sidecar_files(media_file):
+    """
+    Returns the sidecar files of *media_file*, which exist, ordered by priority.
+
+    """
+    known = _known_sidecar_files.get(media_file)
+    if known is not None:
+        return list(known)
+    return [
+        file
+        for file in get_sidecar_files_in_priority_order(media_file)
+        if os.path.exists(file)
+    ]
+
+
 def _get_existing_metadata_files_reversed(media_file, include_sidecar_files):
     if include_sidecar_files:
-        files = [
-            file
-            for file in get_sidecar_files_in_priority_order(media_file)
-            if os.path.exists(file)
-        ]
+        files = get_existing_sidecar_files(media_file)
         files.append(media_file)
         return list(reversed(files))
     return [media_file]
@@ -102,7 +150,35 @@ def get_metadata(media_file, tags, try_sidecar=True, struct=False):
         "files_by_reverse_priority": files_by_reverse_priority,
         "struct": struct,
     }
-    response = requests.post("http://localhost:8010/get-tags", json=json).json()
+    response = (
+        get_service_session().post("http://localhost:8010/get-tags", json=json).json()
+    )
+    return response["values"]
+
+
+def get_metadata_batch(media_files, tags, try_sidecar=True, struct=False):
+    """
+    Get values for each metadata tag in *tags* from every file in *media_files*
+    with a single request to the exif service.
+    *try_sidecar* and *struct* behave like in `get_metadata`.
+
+    Returns a list with one list of tag values per file in *media_files*.
+
+    """
+
+    json = {
+        "tags": tags,
+        "media_files": [
+            _get_existing_metadata_files_reversed(media_file, try_sidecar)
+            for media_file in media_files
+        ],
+        "struct": struct,
+    }
+    response = (
+        get_service_session()
+        .post("http://localhost:8010/get-tags-batch", json=json)
+        .json()
+    )
     return response["values"]
 
 
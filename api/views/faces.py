@@ -1,7 +1,7 @@
 import uuid
 
 from django.db.models import Case, Count, IntegerField, Q, When
-from django_q.tasks import Chain
+from django_q.tasks import AsyncTask, Chain
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import OpenApiParameter, extend_schema
 from rest_framework.response import Response
@@ -12,6 +12,7 @@ from api.face_classify import cluster_all_faces
 from api.ml_models import do_all_models_exist, download_models
 from api.models import Face
 from api.models.person import Person, get_or_create_person
+from api.search_index import recreate_search_captions
 from api.serializers.face import (
     FaceListSerializer,
     IncompletePersonFaceListSerializer,
@@ -165,6 +166,7 @@ class SetFacePersonLabel(APIView):
 
         updated = []
         not_updated = []
+        image_hashes = set()
         for face in faces.values():
             if face.photo.owner == request.user:
                 face.person = person
@@ -172,11 +174,12 @@ class SetFacePersonLabel(APIView):
                 face.person_label_probability = 1.0
                 face.save()
                 updated.append(FaceListSerializer(face).data)
+                image_hashes.add(face.photo.image_hash)
             else:
                 not_updated.append(FaceListSerializer(face).data)
         person._calculate_face_count()
         person._set_default_cover_photo()
-        face.photo._recreate_search_captions()
+        AsyncTask(recreate_search_captions, list(image_hashes)).run()
         return Response(
             {
                 "status": True,
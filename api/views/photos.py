@@ -6,6 +6,10 @@ from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from api.image_similarity import (
+    add_to_image_similarity_index,
+    remove_from_image_similarity_index,
+)
 from api.models import File, Photo, User
 from api.permissions import IsOwnerOrReadOnly, IsPhotoOrAlbumSharedTo
 from api.serializers.photos import (
@@ -206,6 +210,7 @@ class SetPhotosHidden(APIView):
         image_hashes = data["image_hashes"]
 
         updated = []
+        updated_hashes = []
         not_updated = []
         for image_hash in image_hashes:
             try:
@@ -221,9 +226,16 @@ class SetPhotosHidden(APIView):
                 photo.hidden = val_hidden
                 photo.save()
                 updated.append(PhotoSerializer(photo).data)
+                updated_hashes.append(photo.image_hash)
             else:
                 not_updated.append(PhotoSerializer(photo).data)
 
+        # hidden photos are not part of the similarity index
+        if val_hidden:
+            remove_from_image_similarity_index(request.user, updated_hashes)
+        else:
+            add_to_image_similarity_index(request.user, updated_hashes)
+
         if val_hidden:
             logger.info(
                 "{} photos were set hidden. {} photos were already hidden.".format(
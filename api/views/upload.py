@@ -20,7 +20,7 @@ from rest_framework_simplejwt.tokens import AccessToken
 import api.util as util
 from api.directory_watcher import create_new_image, handle_new_image
 from api.models import Photo, User
-from api.models.file import calculate_hash, calculate_hash_b64
+from api.models.file import calculate_hash, calculate_hash_b64, remember_hash
 
 
 class UploadPhotoExists(viewsets.ViewSet):
@@ -153,12 +153,14 @@ class UploadPhotosChunkedComplete(ChunkedUploadCompleteView):
                 with open(photo_path, "wb") as f:
                     photo.seek(0)
                     f.write(photo.read())
+                # the upload was hashed already, so scanning the file later must not hash it again
+                remember_hash(photo_path, image_hash.removesuffix(str(user.id)))
             chunked_upload = get_object_or_404(
                 ChunkedUpload, upload_id=request.POST.get("upload_id")
             )
             chunked_upload.delete(delete_file=True)
             chain = Chain()
-            photo = create_new_image(user, photo_path)
+            photo = create_new_image(user, photo_path, image_hash)
             chain.append(handle_new_image, user, photo_path, image_hash, photo)
             chain.append(photo._generate_captions, True)
             chain.append(photo._geolocate)
@@ -1,9 +1,18 @@
+import datetime
+import io
 import json
 
+import gevent
+import numpy as np
 from flask import Flask, jsonify, request
 from flask_restful import Api, Resource
 from gevent.pywsgi import WSGIServer
-from retrieval_index import RetrievalIndex
+from retrieval_index import (
+    SAVE_INTERVAL,
+    ModelVersionMismatch,
+    RetrievalIndex,
+    benchmark,
+)
 from utils import logger
 
 app = Flask(__name__)
@@ -11,6 +20,45 @@ api = Api(app)
 
 index = RetrievalIndex()
 
+NPY_MEDIA_TYPE = "application/x-npy"
+
+
+def read_npy_body():
+    """
+    Returns the arrays of the request body, which holds one or more consecutive
+    .npy files. Every array is read from the stream straight into its own buffer,
+    so the body is never held twice.
+
+    """
+    stream = request.stream
+    arrays = []
+    while True:
+        magic = stream.read(np.lib.format.MAGIC_LEN)
+        if not magic:
+            return arrays
+        version = np.lib.format.read_magic(io.BytesIO(magic))
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+        buffer = bytearray(int(np.prod(shape)) * dtype.itemsize)
+        view = memoryview(buffer)
+        offset = 0
+        while offset < len(buffer):
+            read = stream.readinto(view[offset:])
+            if not read:
+                raise ValueError(
+                    "Array is truncated after {} of {} bytes".format(
+                        offset, len(buffer)
+                    )
+                )
+            offset += read
+        arrays.append(
+            np.frombuffer(buffer, dtype=dtype).reshape(
+                shape, order="F" if fortran_order else "C"
+            )
+        )
+
 
 class BuildIndex(Resource):
     def post(self):
@@ -19,20 +67,86 @@ class BuildIndex(Resource):
         user_id = request_body["user_id"]
         image_hashes = request_body["image_hashes"]
         image_embeddings = request_body["image_embeddings"]
+        model_version = request_body.get("model_version")
 
-        index.build_index_for_user(user_id, image_hashes, image_embeddings)
-
-        return jsonify({"status": True, "index_size": index.indices[user_id].ntotal})
+        try:
+            index.build_index_for_user(
+                user_id, image_hashes, image_embeddings, model_version
+            )
+        except ModelVersionMismatch as e:
+            logger.warning(str(e))
+            return {"status": False, "error": str(e)}, 409
+
+        return jsonify(
+            {"status": True, "index_size": index.status(user_id)["index_size"]}
+        )
+
+    def put(self):
+        if request.mimetype != NPY_MEDIA_TYPE:
+            return {"status": False, "error": "expected .npy body"}, 415
+
+        user_id = request.args.get("user_id", type=int)
+        if user_id is None:
+            return {"status": False, "error": "expected user_id"}, 400
+
+        image_hashes, image_embeddings = read_npy_body()
+        start = datetime.datetime.now()
+        index_size = index.replace(
+            user_id,
+            [h.decode() for h in image_hashes.tolist()],
+            image_embeddings,
+            request.args.get("model_version"),
+        )
+        elapsed = (datetime.datetime.now() - start).total_seconds()
+        logger.info(
+            "replaced index for user %d with %d photos - took %.2f seconds"
+            % (user_id, index_size, elapsed)
+        )
+
+        return jsonify({"status": True, "index_size": index_size})
 
     def delete(self):
         user_id = json.loads(request.data)["user_id"]
-        if user_id not in index.indices:
-            return jsonify({"status": True})
-        del index.indices[user_id]
-        del index.image_hashes[user_id]
+        index.delete(user_id)
         return jsonify({"status": True})
 
 
+class Images(Resource):
+    def post(self):
+        request_body = json.loads(request.data)
+
+        try:
+            index_size = index.add(
+                request_body["user_id"],
+                request_body["image_hashes"],
+                request_body["image_embeddings"],
+                request_body.get("model_version"),
+            )
+        except ModelVersionMismatch as e:
+            logger.warning(str(e))
+            return {"status": False, "error": str(e)}, 409
+
+        return jsonify({"status": True, "index_size": index_size})
+
+    def delete(self):
+        request_body = json.loads(request.data)
+
+        index_size = index.remove(request_body["user_id"], request_body["image_hashes"])
+
+        return jsonify({"status": True, "index_size": index_size})
+
+
+class IndexStatus(Resource):
+    def get(self, user_id):
+        return jsonify({"status": True, **index.status(user_id)})
+
+
+class SaveIndex(Resource):
+    def post(self, user_id):
+        index.save(user_id)
+        return jsonify({"status": True, **index.status(user_id)})
+
+
 class SearchIndex(Resource):
     def post(self):
         try:
@@ -58,18 +172,48 @@ class SearchIndex(Resource):
             return jsonify({"status": False, "result": []}), 500
 
 
+class Benchmark(Resource):
+    def post(self):
+        if request.mimetype != NPY_MEDIA_TYPE:
+            return {"status": False, "error": "expected .npy body"}, 415
+
+        (vectors,) = read_npy_body()
+        report = benchmark(
+            vectors,
+            queries=request.args.get("queries", 100, type=int),
+            n=request.args.get("n", 100, type=int),
+        )
+
+        return jsonify({"status": True, "result": report})
+
+
 class Health(Resource):
     def get(self):
         return jsonify({"status": True})
 
 
 api.add_resource(BuildIndex, "/build/")
+api.add_resource(Images, "/images/")
+api.add_resource(IndexStatus, "/index/<int:user_id>/")
+api.add_resource(SaveIndex, "/index/<int:user_id>/save/")
 api.add_resource(SearchIndex, "/search/")
+api.add_resource(Benchmark, "/benchmark/")
 api.add_resource(Health, "/health/")
 
 
+def save_periodically():
+    # saves the indices, which were changed after their last save
+    while True:
+        gevent.sleep(SAVE_INTERVAL)
+        try:
+            index.save()
+        except Exception as e:
+            logger.error("could not save indices: {}".format(e))
+
+
 def start_server():
     logger.info("Starting server")
+    gevent.spawn(save_periodically)
     server = WSGIServer(("0.0.0.0", 8002), app)
     server.serve_forever()
 
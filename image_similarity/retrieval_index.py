@@ -1,4 +1,9 @@
 import datetime
+import hashlib
+import json
+import math
+import os
+import time
 
 import faiss
 import numpy as np
@@ -6,28 +11,397 @@ from utils import logger
 
 embedding_size = 512
 
+BASE_DATA = os.environ.get("BASE_DATA", "/")
+INDEX_DIR = os.environ.get(
+    "INDEX_DIR", os.path.join(BASE_DATA, "protected_media", "similarity_index")
+)
+
+# "auto" chooses the index type by the number of photos of a user
+INDEX_TYPE = os.environ.get("INDEX_TYPE", "auto")
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+HNSW_MIN_SIZE = int(os.environ.get("HNSW_MIN_SIZE", 100000))
+IVFPQ_MIN_SIZE = int(os.environ.get("IVFPQ_MIN_SIZE", 1000000))
+# Seconds between two saves of an index, which is changed by added or removed photos
+SAVE_INTERVAL = float(os.environ.get("INDEX_SAVE_INTERVAL", 60))
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 128
+IVF_NPROBE = 32
+IVF_TRAINING_SIZE_PER_LIST = 64
+# k-means needs 39 points per centroid
+IVF_MIN_TRAINING_SIZE_PER_LIST = 39
+# Bytes per vector, each byte encodes 8 dimensions
+PQ_M = 64
+# The product quantizer has 256 centroids per byte
+IVFPQ_MIN_TRAINING_SIZE = IVF_MIN_TRAINING_SIZE_PER_LIST * 256
+# Share of removed vectors, which an HNSW index keeps before it is compacted
+HNSW_MAX_REMOVED = 0.25
+
+
+class ModelVersionMismatch(Exception):
+    pass
+
+
+def hash_to_id(image_hash):
+    # faiss ids are signed 64 bit integers, image hashes are longer strings
+    digest = hashlib.blake2b(image_hash.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def hashes_to_ids(image_hashes):
+    return np.array([hash_to_id(h) for h in image_hashes], dtype=np.int64)
+
+
+def choose_index_type(size):
+    if INDEX_TYPE in INDEX_TYPES:
+        if INDEX_TYPE == "ivfpq" and size < IVFPQ_MIN_TRAINING_SIZE:
+            return "hnsw"
+        return INDEX_TYPE
+    if size >= max(IVFPQ_MIN_SIZE, IVFPQ_MIN_TRAINING_SIZE):
+        return "ivfpq"
+    if size >= HNSW_MIN_SIZE:
+        return "hnsw"
+    return "flat"
+
+
+def create_index(index_type, training_vectors=None):
+    """
+    Returns an empty index of *index_type*, which maps ids to vectors. An IVF-PQ
+    index is trained on *training_vectors* first.
+
+    """
+    if index_type == "flat":
+        return faiss.IndexIDMap(faiss.IndexFlatIP(embedding_size))
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(embedding_size, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return faiss.IndexIDMap(index)
+    if index_type == "ivfpq":
+        if training_vectors is None or len(training_vectors) < IVFPQ_MIN_TRAINING_SIZE:
+            raise ValueError(
+                "an IVF-PQ index needs at least {} training vectors".format(
+                    IVFPQ_MIN_TRAINING_SIZE
+                )
+            )
+        nlist = max(
+            1,
+            min(
+                int(4 * math.sqrt(len(training_vectors))),
+                len(training_vectors) // IVF_MIN_TRAINING_SIZE_PER_LIST,
+            ),
+        )
+        # "np" skips the polysemous training, which searches do not use
+        index = faiss.index_factory(
+            embedding_size,
+            "IVF{},PQ{}np".format(nlist, PQ_M),
+            faiss.METRIC_INNER_PRODUCT,
+        )
+        sample_size = min(len(training_vectors), nlist * IVF_TRAINING_SIZE_PER_LIST)
+        sample = np.random.default_rng(0).choice(
+            len(training_vectors), sample_size, replace=False
+        )
+        index.train(np.ascontiguousarray(training_vectors[np.sort(sample)]))
+        index.nprobe = IVF_NPROBE
+        # IVF indices store ids themselves and can remove them without an id map
+        return index
+    raise ValueError("unknown index type {}".format(index_type))
+
+
+def get_index_type(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        return "ivfpq"
+    if isinstance(faiss.downcast_index(index.index), faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def get_vectors(index):
+    """
+    Returns ids and vectors of a flat or HNSW *index*.
+
+    """
+    ids = faiss.vector_to_array(index.id_map)
+    return ids, faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal)
+
+
+def _recall(found, expected):
+    expected = set(expected.tolist()) - {-1}
+    if not expected:
+        return 1.0
+    return len(expected & set(found.tolist())) / len(expected)
+
+
+def benchmark(vectors, queries=100, n=100, index_types=INDEX_TYPES, seed=0):
+    """
+    Builds an index of every type over *vectors* and searches the *n* nearest
+    neighbours of a sample of them one by one.
+
+    Returns build time, search latency and the recall against the flat index per
+    index type.
+
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if len(vectors) == 0:
+        return {"vectors": 0, "queries": 0, "n": n}
+    sample = np.random.default_rng(seed).choice(
+        len(vectors), min(queries, len(vectors)), replace=False
+    )
+    ids = np.arange(len(vectors), dtype=np.int64)
+    expected = None
+    report = {}
+    for index_type in ("flat",) + tuple(t for t in index_types if t != "flat"):
+        start = time.perf_counter()
+        try:
+            index = create_index(index_type, vectors)
+        except ValueError as e:
+            report[index_type] = {"error": str(e)}
+            continue
+        index.add_with_ids(vectors, ids)
+        build_seconds = time.perf_counter() - start
+
+        latencies = []
+        found = []
+        for query in vectors[sample]:
+            start = time.perf_counter()
+            _, result = index.search(query.reshape(1, -1), n)
+            latencies.append(time.perf_counter() - start)
+            found.append(result[0])
+        if expected is None:
+            expected = found
+
+        report[index_type] = {
+            "build_seconds": round(build_seconds, 3),
+            "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+            "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+            "recall": round(
+                float(np.mean([_recall(f, e) for f, e in zip(found, expected)])), 4
+            ),
+        }
+    return {"vectors": len(vectors), "queries": len(sample), "n": n, **report}
+
 
 class RetrievalIndex(object):
-    def __init__(self):
-        pass
+    """
+    Keeps an index per user, which maps image hashes to embeddings. The type of the
+    index follows the number of photos of the user, see `choose_index_type`.
+
+    Every index is saved to *index_dir*, together with the image hashes and the
+    version of the model, which calculated its embeddings. Indices, which photos are
+    added to or removed from, are saved at most every SAVE_INTERVAL seconds and by
+    `save`. Saved indices are memory mapped when they are loaded, until they are
+    changed.
+
+    HNSW indices can not remove vectors. Their removed vectors are left out of the
+    image hashes and skipped by searches, until the index is compacted.
+
+    """
+
+    def __init__(self, index_dir=INDEX_DIR):
+        self.index_dir = index_dir
         self.indices = {}
         self.image_hashes = {}
+        self.model_versions = {}
+        self.mapped = set()
+        self.changed = set()
+        self.saved_at = {}
+
+    def _index_path(self, user_id):
+        return os.path.join(self.index_dir, "{}.faiss".format(user_id))
 
-    def build_index_for_user(self, user_id, image_hashes, image_embeddings):
+    def _meta_path(self, user_id):
+        return os.path.join(self.index_dir, "{}.json".format(user_id))
+
+    def _load(self, user_id):
+        if user_id in self.indices:
+            return self.indices[user_id]
+        if not os.path.exists(self._meta_path(user_id)):
+            return None
+        try:
+            index = faiss.read_index(
+                self._index_path(user_id), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+            )
+            self.mapped.add(user_id)
+        except RuntimeError:
+            index = faiss.read_index(self._index_path(user_id))
+        with open(self._meta_path(user_id)) as f:
+            meta = json.load(f)
+        self.indices[user_id] = index
+        self.image_hashes[user_id] = {hash_to_id(h): h for h in meta["image_hashes"]}
+        self.model_versions[user_id] = meta["model_version"]
+        logger.info(
+            "loaded {} index for user {} with {} photos".format(
+                get_index_type(index), user_id, index.ntotal
+            )
+        )
+        return index
+
+    def _writable(self, user_id):
+        index = self._load(user_id)
+        if user_id in self.mapped:
+            # a memory mapped index can not be changed in place
+            index = faiss.read_index(self._index_path(user_id))
+            self.indices[user_id] = index
+            self.mapped.discard(user_id)
+        return index
+
+    def _save(self, user_id):
+        os.makedirs(self.index_dir, exist_ok=True)
+        index_path = self._index_path(user_id)
+        faiss.write_index(self.indices[user_id], index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+        meta_path = self._meta_path(user_id)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(
+                {
+                    "model_version": self.model_versions[user_id],
+                    "index_type": get_index_type(self.indices[user_id]),
+                    "image_hashes": list(self.image_hashes[user_id].values()),
+                },
+                f,
+            )
+        os.replace(meta_path + ".tmp", meta_path)
+        self.changed.discard(user_id)
+        self.saved_at[user_id] = time.monotonic()
+
+    def _save_later(self, user_id):
+        # saving rewrites the whole index, which must not happen for every batch
+        self.changed.add(user_id)
+        saved_at = self.saved_at.get(user_id)
+        if saved_at is None or time.monotonic() - saved_at >= SAVE_INTERVAL:
+            self._save(user_id)
+
+    def save(self, user_id=None):
+        """
+        Saves the changed index of the user, or all changed indices.
+
+        """
+        for changed_user_id in list(self.changed):
+            if user_id is None or changed_user_id == user_id:
+                self._save(changed_user_id)
+
+    def _rebuild(self, user_id, index_type):
+        # only flat and HNSW indices hold the vectors, which a new index needs
+        ids, vectors = get_vectors(self.indices[user_id])
+        live = np.isin(ids, list(self.image_hashes[user_id].keys()))
+        ids, vectors = ids[live], vectors[live]
+        index = create_index(index_type, vectors)
+        index.add_with_ids(vectors, ids)
+        self.indices[user_id] = index
+        logger.info(
+            "rebuilt index of user {} as {} index with {} photos".format(
+                user_id, index_type, index.ntotal
+            )
+        )
+        return index
+
+    def status(self, user_id):
+        index = self._load(user_id)
+        return {
+            "model_version": self.model_versions.get(user_id),
+            "index_type": get_index_type(index) if index is not None else None,
+            "index_size": len(self.image_hashes.get(user_id, {})),
+        }
+
+    def add(self, user_id, image_hashes, image_embeddings, model_version=None):
+        """
+        Adds the embeddings of *image_hashes* to the index of the user, replacing
+        the embeddings the index has for any of them.
+
+        Raises ModelVersionMismatch, when the index holds embeddings of another model.
+
+        """
+        vectors = np.ascontiguousarray(image_embeddings, dtype=np.float32)
+        index = self._writable(user_id)
+        if index is None or len(self.image_hashes[user_id]) == 0:
+            index = create_index(choose_index_type(len(vectors)), vectors)
+            self.indices[user_id] = index
+            self.image_hashes[user_id] = {}
+            self.model_versions[user_id] = model_version
+        elif model_version is not None and (
+            model_version != self.model_versions[user_id]
+        ):
+            raise ModelVersionMismatch(
+                "index of user {} holds embeddings of {}, not {}".format(
+                    user_id, self.model_versions[user_id], model_version
+                )
+            )
+
+        ids = hashes_to_ids(image_hashes)
+        index_type = get_index_type(index)
+        if index_type == "hnsw":
+            # the vector of an image hash only changes with the model version
+            new = ~np.isin(ids, faiss.vector_to_array(index.id_map))
+            index.add_with_ids(vectors[new], ids[new])
+        else:
+            index.remove_ids(ids)
+            index.add_with_ids(vectors, ids)
+        self.image_hashes[user_id].update(zip(ids.tolist(), image_hashes))
+
+        size = len(self.image_hashes[user_id])
+        target_type = choose_index_type(size)
+        if INDEX_TYPES.index(target_type) > INDEX_TYPES.index(index_type):
+            self._rebuild(user_id, target_type)
+        self._save_later(user_id)
+        return size
+
+    def replace(self, user_id, image_hashes, image_embeddings, model_version=None):
+        """
+        Replaces the index of the user by one built from *image_embeddings* at once.
+        Searches use the previous index, until the new one is complete.
+
+        """
+        vectors = np.ascontiguousarray(image_embeddings, dtype=np.float32)
+        ids = hashes_to_ids(image_hashes)
+        index = create_index(choose_index_type(len(vectors)), vectors)
+        index.add_with_ids(vectors, ids)
+
+        self.indices[user_id] = index
+        self.image_hashes[user_id] = dict(zip(ids.tolist(), image_hashes))
+        self.model_versions[user_id] = model_version
+        self.mapped.discard(user_id)
+        self._save(user_id)
+        return len(self.image_hashes[user_id])
+
+    def remove(self, user_id, image_hashes):
+        index = self._writable(user_id)
+        if index is None:
+            return 0
+        ids = hashes_to_ids(image_hashes)
+        for id in ids.tolist():
+            self.image_hashes[user_id].pop(id, None)
+        size = len(self.image_hashes[user_id])
+        if get_index_type(index) != "hnsw":
+            index.remove_ids(ids)
+        elif index.ntotal - size > HNSW_MAX_REMOVED * index.ntotal:
+            self._rebuild(user_id, "hnsw")
+        self._save_later(user_id)
+        return size
+
+    def delete(self, user_id):
+        self.indices.pop(user_id, None)
+        self.image_hashes.pop(user_id, None)
+        self.model_versions.pop(user_id, None)
+        self.mapped.discard(user_id)
+        self.changed.discard(user_id)
+        self.saved_at.pop(user_id, None)
+        for path in (self._index_path(user_id), self._meta_path(user_id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def build_index_for_user(
+        self, user_id, image_hashes, image_embeddings, model_version=None
+    ):
         logger.info(
             "building index for user {} - got {} photos to process".format(
                 user_id, len(image_hashes)
             )
         )
         start = datetime.datetime.now()
-        if not self.indices.get(user_id):
-            self.indices[user_id] = faiss.IndexFlatIP(embedding_size)
-        if not self.image_hashes.get(user_id):
-            self.image_hashes[user_id] = []
-
-        for h, e in zip(image_hashes, image_embeddings):
-            self.image_hashes[user_id].append(h)
-            self.indices[user_id].add(np.array([e], dtype=np.float32))
+        self.add(user_id, image_hashes, image_embeddings, model_version)
+        self.save(user_id)
 
         elapsed = (datetime.datetime.now() - start).total_seconds()
         logger.info(
@@ -37,13 +411,16 @@ class RetrievalIndex(object):
 
     def search_similar(self, user_id, in_embedding, n=100, thres=27.0):
         start = datetime.datetime.now()
-        dist, res_indices = self.indices[user_id].search(
-            np.array([in_embedding], dtype=np.float32), n
-        )
-        res = []
-        for distance, idx in sorted(zip(dist[0], res_indices[0]), reverse=True):
-            if distance >= thres:
-                res.append(self.image_hashes[user_id][idx])
+        index = self._load(user_id)
+        if index is None:
+            return []
+        image_hashes = self.image_hashes[user_id]
+        # removed vectors of an HNSW index take places in the result
+        k = n + index.ntotal - len(image_hashes)
+        dist, res_ids = index.search(np.array([in_embedding], dtype=np.float32), k)
+        # results are ordered by descending inner product
+        res_ids = res_ids[0][(res_ids[0] != -1) & (dist[0] >= thres)]
+        res = [image_hashes[id] for id in res_ids.tolist() if id in image_hashes][:n]
         elapsed = (datetime.datetime.now() - start).total_seconds()
         logger.info(
             "searched for %d images for user %d - took %.2f seconds"
@@ -0,0 +1,91 @@
+import io
+
+import main
+import numpy as np
+import retrieval_index
+from pytest import fixture
+from retrieval_index import RetrievalIndex, benchmark, choose_index_type
+
+
+def create_embeddings(count, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal(
+        (count, retrieval_index.embedding_size)
+    )
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def create_hashes(start, stop):
+    return ["hash{}".format(i) for i in range(start, stop)]
+
+
+@fixture()
+def small_index_sizes(monkeypatch):
+    monkeypatch.setattr(retrieval_index, "HNSW_MIN_SIZE", 10)
+    monkeypatch.setattr(retrieval_index, "IVFPQ_MIN_SIZE", 300)
+    monkeypatch.setattr(retrieval_index, "IVFPQ_MIN_TRAINING_SIZE", 300)
+
+
+def test_should_choose_index_type_by_size(small_index_sizes):
+    assert choose_index_type(9) == "flat"
+    assert choose_index_type(10) == "hnsw"
+    assert choose_index_type(299) == "hnsw"
+    assert choose_index_type(300) == "ivfpq"
+
+
+def test_should_not_choose_ivfpq_without_enough_training_vectors(
+    small_index_sizes, monkeypatch
+):
+    monkeypatch.setattr(retrieval_index, "IVFPQ_MIN_SIZE", 100)
+
+    assert choose_index_type(100) == "hnsw"
+
+
+def test_should_create_index_of_chosen_type(small_index_sizes, tmp_path):
+    index = RetrievalIndex(str(tmp_path))
+
+    index.add(1, create_hashes(0, 5), create_embeddings(5))
+    index.add(2, create_hashes(0, 20), create_embeddings(20))
+
+    assert index.status(1)["index_type"] == "flat"
+    assert index.status(2)["index_type"] == "hnsw"
+
+
+def test_should_not_find_removed_photos_in_hnsw_index(small_index_sizes, tmp_path):
+    index = RetrievalIndex(str(tmp_path))
+    embeddings = create_embeddings(20)
+    index.add(1, create_hashes(0, 20), embeddings)
+
+    index.remove(1, create_hashes(0, 2))
+
+    assert index.status(1)["index_type"] == "hnsw"
+    # every inner product of normalized vectors is above the threshold
+    nearest = index.search_similar(1, embeddings[0], n=5, thres=-2.0)
+    assert len(nearest) == 5
+    assert not set(nearest) & set(create_hashes(0, 2))
+    remaining = index.search_similar(1, embeddings[0], n=20, thres=-2.0)
+    assert sorted(remaining) == sorted(create_hashes(2, 20))
+
+
+def test_should_report_error_for_too_few_ivfpq_training_vectors():
+    report = benchmark(create_embeddings(50), queries=5, n=5)
+
+    assert report["vectors"] == 50
+    assert report["flat"]["recall"] == 1.0
+    assert "recall" in report["hnsw"]
+    assert "error" in report["ivfpq"]
+
+
+def test_should_benchmark_npy_body():
+    client = main.app.test_client()
+    body = io.BytesIO()
+    np.save(body, create_embeddings(50))
+
+    response = client.post(
+        "/benchmark/?queries=5&n=5",
+        data=body.getvalue(),
+        content_type="application/x-npy",
+    )
+
+    assert response.status_code == 200
+    assert response.get_json()["result"]["flat"]["recall"] == 1.0
+    assert client.post("/benchmark/", json=[]).status_code == 415
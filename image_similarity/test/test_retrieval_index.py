@@ -0,0 +1,228 @@
+import io
+import json
+import os
+
+import main
+import numpy as np
+import retrieval_index
+from pytest import fixture, raises
+from retrieval_index import (
+    ModelVersionMismatch,
+    RetrievalIndex,
+    hash_to_id,
+    hashes_to_ids,
+)
+
+
+def create_embeddings(count, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal(
+        (count, retrieval_index.embedding_size)
+    )
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def create_hashes(start, stop):
+    return ["hash{}".format(i) for i in range(start, stop)]
+
+
+def read_saved_hashes(index_dir, user_id):
+    with open(os.path.join(index_dir, "{}.json".format(user_id))) as f:
+        return json.load(f)["image_hashes"]
+
+
+@fixture()
+def index_dir(tmp_path):
+    return str(tmp_path)
+
+
+@fixture()
+def client(index_dir, monkeypatch):
+    monkeypatch.setattr(main, "index", RetrievalIndex(index_dir))
+    return main.app.test_client()
+
+
+def test_should_map_image_hashes_to_signed_ids():
+    ids = hashes_to_ids(create_hashes(0, 100))
+
+    assert ids.dtype == np.int64
+    assert len(set(ids.tolist())) == 100
+    assert hash_to_id("hash0") == ids[0]
+    assert -(1 << 63) <= hash_to_id("hash0") < (1 << 63)
+
+
+def test_should_find_image_hashes_of_nearest_embeddings(index_dir):
+    index = RetrievalIndex(index_dir)
+    embeddings = create_embeddings(10)
+    index.add(1, create_hashes(0, 10), embeddings)
+
+    actual = index.search_similar(1, embeddings[3], n=1, thres=0.5)
+
+    assert actual == ["hash3"]
+
+
+def test_should_load_saved_index_memory_mapped(index_dir):
+    embeddings = create_embeddings(5)
+    RetrievalIndex(index_dir).add(1, create_hashes(0, 5), embeddings, "model")
+
+    index = RetrievalIndex(index_dir)
+
+    assert index.status(1) == {
+        "model_version": "model",
+        "index_type": "flat",
+        "index_size": 5,
+    }
+    assert 1 in index.mapped
+    assert index.search_similar(1, embeddings[2], n=1, thres=0.5) == ["hash2"]
+
+
+def test_should_change_memory_mapped_index_after_reading_it(index_dir):
+    embeddings = create_embeddings(6)
+    RetrievalIndex(index_dir).add(1, create_hashes(0, 5), embeddings[:5], "model")
+    index = RetrievalIndex(index_dir)
+    index.status(1)
+
+    index.add(1, create_hashes(5, 6), embeddings[5:], "model")
+
+    assert 1 not in index.mapped
+    assert index.status(1)["index_size"] == 6
+    assert index.search_similar(1, embeddings[5], n=1, thres=0.5) == ["hash5"]
+
+
+def test_should_save_changes_only_after_interval(index_dir, monkeypatch):
+    monkeypatch.setattr(retrieval_index, "SAVE_INTERVAL", 3600)
+    index = RetrievalIndex(index_dir)
+    embeddings = create_embeddings(10)
+    index.add(1, create_hashes(0, 5), embeddings[:5])
+
+    index.add(1, create_hashes(5, 10), embeddings[5:])
+
+    assert sorted(read_saved_hashes(index_dir, 1)) == create_hashes(0, 5)
+    index.save(1)
+    assert sorted(read_saved_hashes(index_dir, 1)) == create_hashes(0, 10)
+    assert RetrievalIndex(index_dir).status(1)["index_size"] == 10
+
+
+def test_should_keep_removed_vectors_of_hnsw_index_until_compaction(
+    index_dir, monkeypatch
+):
+    monkeypatch.setattr(retrieval_index, "HNSW_MIN_SIZE", 10)
+    index = RetrievalIndex(index_dir)
+    index.add(1, create_hashes(0, 20), create_embeddings(20))
+
+    index.remove(1, create_hashes(0, 2))
+
+    assert index.indices[1].ntotal == 20
+    assert index.status(1)["index_size"] == 18
+
+    # more than a quarter of the vectors are removed now
+    index.remove(1, create_hashes(2, 6))
+
+    assert index.indices[1].ntotal == 14
+    assert index.status(1) == {
+        "model_version": None,
+        "index_type": "hnsw",
+        "index_size": 14,
+    }
+
+
+def test_should_rebuild_index_as_type_changes_with_size(index_dir, monkeypatch):
+    monkeypatch.setattr(retrieval_index, "HNSW_MIN_SIZE", 10)
+    monkeypatch.setattr(retrieval_index, "IVFPQ_MIN_SIZE", 300)
+    monkeypatch.setattr(retrieval_index, "IVFPQ_MIN_TRAINING_SIZE", 300)
+    index = RetrievalIndex(index_dir)
+    embeddings = create_embeddings(320)
+
+    index.add(1, create_hashes(0, 5), embeddings[:5])
+    assert index.status(1)["index_type"] == "flat"
+
+    index.add(1, create_hashes(5, 20), embeddings[5:20])
+    assert index.status(1)["index_type"] == "hnsw"
+    index.remove(1, create_hashes(0, 1))
+
+    index.add(1, create_hashes(20, 320), embeddings[20:])
+    assert index.status(1) == {
+        "model_version": None,
+        "index_type": "ivfpq",
+        "index_size": 319,
+    }
+    # the removed vector is not part of the rebuilt index
+    assert index.indices[1].ntotal == 319
+    assert "hash10" in index.search_similar(1, embeddings[10], n=10, thres=-2.0)
+
+
+def test_should_not_add_embeddings_of_other_model(index_dir):
+    index = RetrievalIndex(index_dir)
+    index.add(1, create_hashes(0, 5), create_embeddings(5), "old")
+
+    with raises(ModelVersionMismatch):
+        index.add(1, create_hashes(5, 6), create_embeddings(1), "new")
+
+    assert index.status(1)["index_size"] == 5
+
+
+def test_should_answer_409_for_embeddings_of_other_model(client):
+    payload = {
+        "user_id": 1,
+        "image_hashes": create_hashes(0, 2),
+        "image_embeddings": create_embeddings(2).tolist(),
+        "model_version": "old",
+    }
+    assert client.post("/images/", json=payload).status_code == 200
+
+    payload["model_version"] = "new"
+
+    assert client.post("/images/", json=payload).status_code == 409
+    assert client.post("/build/", json=payload).status_code == 409
+    assert client.get("/index/1/").get_json()["model_version"] == "old"
+
+
+def test_should_replace_index(index_dir):
+    index = RetrievalIndex(index_dir)
+    index.add(1, create_hashes(0, 5), create_embeddings(5), "old")
+    embeddings = create_embeddings(3, seed=1)
+
+    index.replace(1, create_hashes(10, 13), embeddings, "new")
+
+    for actual in (index, RetrievalIndex(index_dir)):
+        assert actual.status(1) == {
+            "model_version": "new",
+            "index_type": "flat",
+            "index_size": 3,
+        }
+        nearest = actual.search_similar(1, embeddings[1], n=5, thres=-2.0)
+        assert nearest[0] == "hash11"
+        assert sorted(nearest) == create_hashes(10, 13)
+
+
+def test_should_replace_index_with_npy_body(client):
+    embeddings = create_embeddings(3)
+    body = io.BytesIO()
+    np.save(body, np.array(create_hashes(0, 3), dtype="S"))
+    np.save(body, embeddings)
+
+    response = client.put(
+        "/build/?user_id=1&model_version=model",
+        data=body.getvalue(),
+        content_type="application/x-npy",
+    )
+
+    assert response.status_code == 200
+    assert response.get_json()["index_size"] == 3
+    assert main.index.search_similar(1, embeddings[2], n=1, thres=0.5) == ["hash2"]
+    assert client.put("/build/?user_id=1", json={}).status_code == 415
+
+
+def test_should_answer_400_for_index_upload_without_user(client):
+    body = io.BytesIO()
+    np.save(body, np.array(create_hashes(0, 1), dtype="S"))
+    np.save(body, create_embeddings(1))
+
+    for query in ("", "?user_id=me"):
+        response = client.put(
+            "/build/" + query,
+            data=body.getvalue(),
+            content_type="application/x-npy",
+        )
+
+        assert response.status_code == 400
+        assert response.get_json()["status"] is False
@@ -90,6 +90,8 @@ Q_CLUSTER = {
     "orm": "default",
     "max_rss": 300000,
     "poll": 1,
+    # scan_photos starts the processes of its ingest pool from a worker
+    "daemonize_workers": False,
 }
 
 CONSTANCE_BACKEND = "constance.backends.database.DatabaseBackend"
@@ -289,3 +291,11 @@ CHUNKED_UPLOAD_TO = os.path.join("chunked_uploads")
 
 DEFAULT_FAVORITE_MIN_RATING = os.environ.get("DEFAULT_FAVORITE_MIN_RATING", 4)
 IMAGE_SIMILARITY_SERVER = "http://localhost:8002"
+# Hash algorithm, which checks whether the content of a file with changed size, mtime or inode
+# changed: md5, blake2b, xxh3_128 (needs xxhash) or blake3 (needs blake3).
+# The image hash of a photo is always md5.
+FINGERPRINT_ALGORITHM = os.environ.get("FINGERPRINT_ALGORITHM", "md5")
+# Keep metadata snapshots on disk, so rescans of unchanged files do not call exiftool
+PERSIST_METADATA_SNAPSHOTS = os.environ.get(
+    "PERSIST_METADATA_SNAPSHOTS", "False"
+) not in ("false", "False", "0", "f")
@@ -8,7 +8,7 @@ from django.conf import settings
 
 import api.util as util
 from api.directory_watcher import handle_new_image
-from api.image_similarity import build_image_similarity_index
+from api.image_similarity import update_image_similarity_index
 from api.models import LongRunningJob
 
 
@@ -92,7 +92,7 @@ def scan_photos(user, job_id):
             lrj.save()
 
         util.logger.info("Added {} photos".format(len(paths)))
-        build_image_similarity_index(user)
+        update_image_similarity_index(user)
 
         lrj = LongRunningJob.objects.get(job_id=job_id)
         lrj.finished = True
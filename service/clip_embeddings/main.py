@@ -1,12 +1,18 @@
+import io
 import time
 
 import gevent
-from flask import Flask, request
+import numpy as np
+from flask import Flask, Response, request, stream_with_context
 from gevent.pywsgi import WSGIServer
 from semantic_search.semantic_search import SemanticSearch
 
 app = Flask(__name__)
 
+# Embeddings are sent as .npy file, when the client accepts it
+NPY_MEDIA_TYPE = "application/x-npy"
+EMBEDDING_DTYPES = {"float32": np.float32, "float16": np.float16}
+
 
 def log(message):
     print("clip embeddings: {}".format(message))
@@ -16,6 +22,32 @@ semantic_search_instance = None
 last_request_time = None
 
 
+def stream_npy(count, batches, dtype):
+    """
+    Yields an .npy file with the *count* rows of *batches*, each batch as soon as it
+    was encoded. The header needs the width of the rows, so it waits for the first one.
+
+    """
+    dtype = np.dtype(dtype).newbyteorder("<")
+    batches = iter(batches)
+    first = next(batches, None)
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        header,
+        {
+            "descr": dtype.str,
+            "fortran_order": False,
+            "shape": (count, first.shape[1] if first is not None else 0),
+        },
+    )
+    yield header.getvalue()
+    if first is None:
+        return
+    yield np.ascontiguousarray(first, dtype=dtype).tobytes()
+    for batch in batches:
+        yield np.ascontiguousarray(batch, dtype=dtype).tobytes()
+
+
 @app.route("/clip-embeddings", methods=["POST"])
 def create_clip_embeddings():
     global last_request_time
@@ -26,6 +58,7 @@ def create_clip_embeddings():
         data = request.get_json()
         imgs = data["imgs"]
         model = data["model"]
+        dtype = EMBEDDING_DTYPES[data.get("dtype", "float32")]
     except Exception as e:
         print(str(e))
         return "", 400
@@ -35,6 +68,16 @@ def create_clip_embeddings():
     if semantic_search_instance is None:
         semantic_search_instance = SemanticSearch()
 
+    if request.accept_mimetypes.best_match(["application/json", NPY_MEDIA_TYPE]) == (
+        NPY_MEDIA_TYPE
+    ):
+        count, batches = semantic_search_instance.encode_clip_embeddings(imgs, model)
+        return Response(
+            stream_with_context(stream_npy(count, batches, dtype)),
+            status=201,
+            mimetype=NPY_MEDIA_TYPE,
+        )
+
     imgs_emb, magnitudes = semantic_search_instance.calculate_clip_embeddings(
         imgs, model
     )
@@ -71,6 +71,47 @@ class SemanticSearch:
             print("Error in calculating clip embeddings: {}".format(e))
             raise e
 
+    def encode_clip_embeddings(self, img_paths, model, batch_size=32):
+        """
+        Returns the number of *img_paths* and a generator, which yields their embeddings
+        as float32 array per batch, so a batch can be sent while the next one is
+        encoded. Images, which cannot be read, get a row of NaN, so that the rows stay
+        in the order of *img_paths*.
+
+        """
+        if not self.model_is_loaded:
+            self.load(model)
+        imgs = []
+        positions = []
+        for position, path in enumerate(img_paths):
+            try:
+                imgs.append(PIL.Image.open(path))
+                positions.append(position)
+            except PIL.UnidentifiedImageError:
+                print("Error loading image: {}".format(path))
+
+        def batches():
+            done = 0
+            width = 0
+            for start in range(0, len(imgs), batch_size):
+                embeddings = self.model.encode(
+                    imgs[start : start + batch_size],
+                    batch_size=batch_size,
+                    convert_to_numpy=True,
+                )
+                batch_positions = np.asarray(positions[start : start + len(embeddings)])
+                width = embeddings.shape[1]
+                rows = np.full(
+                    (batch_positions[-1] + 1 - done, width), np.nan, dtype=np.float32
+                )
+                rows[batch_positions - done] = embeddings
+                done = batch_positions[-1] + 1
+                yield rows
+            if width and done < len(img_paths):
+                yield np.full((len(img_paths) - done, width), np.nan, dtype=np.float32)
+
+        return len(img_paths), batches()
+
     def calculate_query_embeddings(self, query, model):
         if not self.model_is_loaded:
             self.load(model)
@@ -1,6 +1,6 @@
 import exiftool
 import gevent
-from flask import Flask, request
+from flask import Flask, Response, request
 from gevent.pywsgi import WSGIServer
 
 static_et = exiftool.ExifTool()
@@ -13,6 +13,37 @@ def log(message):
     print("exif: {}".format(message))
 
 
+def get_exiftool(struct):
+    et = static_struct_et if struct else static_et
+    if not et.running:
+        et.start()
+    return et
+
+
+def find_tag_value(metadata, tag):
+    if tag in metadata:
+        return metadata[tag]
+    # without -G, exiftool does not prefix the tag names with their group
+    group, _, name = tag.rpartition(":")
+    for key, value in metadata.items():
+        key_group, _, key_name = key.rpartition(":")
+        if key_name == name and (not group or not key_group):
+            return value
+    return None
+
+
+def merge_tag_values(metadata_by_file, files_by_reverse_priority, tags):
+    values = []
+    for tag in tags:
+        value = None
+        for file in files_by_reverse_priority:
+            retrieved_value = find_tag_value(metadata_by_file.get(file, {}), tag)
+            if retrieved_value is not None:
+                value = retrieved_value
+        values.append(value)
+    return values
+
+
 @app.route("/get-tags", methods=["POST"])
 def get_tags():
     try:
@@ -23,13 +54,7 @@ def get_tags():
     except Exception:
         return "", 400
 
-    et = None
-    if struct:
-        et = static_struct_et
-    else:
-        et = static_et
-    if not et.running:
-        et.start()
+    et = get_exiftool(struct)
 
     values = []
     try:
@@ -46,6 +71,68 @@ def get_tags():
     return {"values": values}, 201
 
 
+@app.route("/get-tags-batch", methods=["POST"])
+def get_tags_batch():
+    try:
+        data = request.get_json()
+        media_files = data["media_files"]
+        tags = data["tags"]
+        struct = data["struct"]
+    except Exception:
+        return "", 400
+
+    et = get_exiftool(struct)
+
+    files = list(
+        dict.fromkeys(
+            file
+            for files_by_reverse_priority in media_files
+            for file in files_by_reverse_priority
+        )
+    )
+    metadata_by_file = {}
+    try:
+        # one exiftool execute for every tag of every file in the batch
+        if files:
+            params = ["-" + tag for tag in tags] + files
+            for metadata in et.execute_json(*params):
+                metadata_by_file[metadata.pop("SourceFile")] = metadata
+    except Exception:
+        log("An error occurred")
+
+    values = [
+        merge_tag_values(metadata_by_file, files_by_reverse_priority, tags)
+        for files_by_reverse_priority in media_files
+    ]
+    return {"values": values}, 201
+
+
+@app.route("/get-preview", methods=["POST"])
+def get_preview():
+    try:
+        data = request.get_json()
+        source = data["source"]
+        tags = data["tags"]
+    except Exception:
+        return "", 400
+
+    et = get_exiftool(False)
+
+    # raw files often contain several previews, the biggest one is the most useful
+    preview = b""
+    for tag in tags:
+        try:
+            candidate = et.execute(b"-b", ("-" + tag).encode(), source.encode())
+        except Exception:
+            log(f"could not extract {tag} from {source}")
+            continue
+        if len(candidate) > len(preview):
+            preview = candidate
+    if not preview:
+        return "", 404
+    return Response(preview, mimetype="image/jpeg")
+
+
 @app.route("/health", methods=["GET"])
 def health():
     return {"status": "OK"}, 200
@@ -0,0 +1,18 @@
+from pytest import fixture
+
+from service.exif.main import app
+
+
+@fixture()
+def client():
+    return app.test_client()
+
+
+def test_must_fail_when_passing_incomplete_json(client):
+    invalid_payloads = [
+        {"source": "foo.cr2"},
+        {"tags": ["PreviewImage"]},
+    ]
+    for payload in invalid_payloads:
+        response = client.post("/get-preview", json=payload)
+        assert response.status_code == 400
@@ -0,0 +1,42 @@
+from pytest import fixture
+
+from service.exif.main import app, find_tag_value, merge_tag_values
+
+
+@fixture()
+def client():
+    return app.test_client()
+
+
+def test_must_fail_when_passing_incomplete_json(client):
+    invalid_payloads = [
+        {"media_files": [["foo.jpg"]]},
+        {"tags": ["Rating"], "struct": False},
+        {"media_files": [["foo.jpg"]], "tags": ["Rating"]},
+    ]
+    for payload in invalid_payloads:
+        response = client.post("/get-tags-batch", json=payload)
+        assert response.status_code == 400
+
+
+def test_should_find_tag_with_and_without_group():
+    grouped = {"EXIF:FNumber": 2.8, "File:ImageHeight": 100}
+    ungrouped = {"RegionInfo": {"RegionList": []}}
+
+    assert find_tag_value(grouped, "EXIF:FNumber") == 2.8
+    assert find_tag_value(grouped, "ImageHeight") == 100
+    assert find_tag_value(ungrouped, "XMP:RegionInfo") == {"RegionList": []}
+    assert find_tag_value(grouped, "XMP:FNumber") is None
+
+
+def test_should_prefer_values_of_files_with_higher_priority():
+    metadata_by_file = {
+        "a.jpg": {"EXIF:Model": "camera", "XMP:Rating": 1},
+        "a.xmp": {"XMP:Rating": 5},
+    }
+
+    values = merge_tag_values(
+        metadata_by_file, ["a.jpg", "a.xmp"], ["XMP:Rating", "EXIF:Model", "Lens"]
+    )
+
+    assert values == [5, "camera", None]